@@ -0,0 +1,7 @@
+"""
+Benchmark harness for the TripMate API
+
+Runs scripted scenarios against the Django app with a local stand-in for the
+OpenAI chat completions API, so latency and throughput can be measured
+without spending API credits.
+"""
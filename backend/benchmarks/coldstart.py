@@ -0,0 +1,170 @@
+"""
+Cold-start budget check for the TripMate backend
+
+Boots the backend in fresh interpreters and measures how long Django setup
+plus the URLconf import takes, and how long the first list request and the
+first generate request take after boot (against the local OpenAI stand-in).
+Exits with status 1 when the median of a measurement exceeds its budget, so
+it can gate a deploy or CI step.
+
+    python -m benchmarks.coldstart --runs 5 --import-budget-ms 1500 \\
+        --first-request-budget-ms 1000 --importtime 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GENERATE_BODY = {
+    'destination': 'Lisbon',
+    'start_date': '2025-07-01',
+    'end_date': '2025-07-03',
+    'budget': '1500.00',
+    'interests': ['food'],
+}
+
+
+def child(database_path):
+    """Run inside a fresh interpreter: boot, then time the first requests"""
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trip_mate.settings')
+
+    started = time.perf_counter()
+    import django
+    django.setup()
+    from django.core.wsgi import get_wsgi_application
+    from django.urls import get_resolver
+    get_wsgi_application()
+    get_resolver().url_patterns
+    import_ms = (time.perf_counter() - started) * 1000
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    settings.ALLOWED_HOSTS = ['*']
+    settings.ADMISSION_CONTROL = {}
+    setup_test_environment()
+    connection.settings_dict['TEST']['NAME'] = database_path
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+
+    client = Client()
+    timings = {'import_ms': import_ms}
+    for name, method, path, body in [
+        ('first_list_ms', 'get', '/api/itinerary/list/', None),
+        ('first_generate_ms', 'post', '/api/itinerary/generate/', GENERATE_BODY),
+        ('warm_generate_ms', 'post', '/api/itinerary/generate/', GENERATE_BODY),
+    ]:
+        started = time.perf_counter()
+        if body is None:
+            response = getattr(client, method)(path)
+        else:
+            response = getattr(client, method)(path, data=json.dumps(body), content_type='application/json')
+        timings[name] = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise SystemExit(f"{method.upper()} {path} returned {response.status_code}")
+    print(json.dumps(timings))
+
+
+def boot(fake_url, warm_up, importtime=False):
+    """Start one child interpreter and return its timings (and -X importtime output)"""
+    env = {
+        **os.environ,
+        'OPENAI_API_KEY': 'benchmark',
+        'OPENAI_BASE_URL': fake_url,
+        'WEATHER_PROVIDER': 'fixture',
+        'GEOCODING_PROVIDER': 'local',
+        'WARM_UP_ON_START': 'true' if warm_up else 'false',
+    }
+    workdir = tempfile.mkdtemp(prefix='tripmate-coldstart-')
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-m', 'benchmarks.coldstart', '--child', os.path.join(workdir, 'coldstart.sqlite3')]
+
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise SystemExit(f"Cold-start child failed:\n{completed.stderr[-2000:]}")
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    timings['process_ms'] = (time.perf_counter() - started) * 1000
+    return timings, completed.stderr
+
+
+def slowest_imports(importtime_output, limit):
+    """Top-level packages ranked by cumulative import time, from -X importtime"""
+    totals = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented; only top-level ones carry a package's full cost
+        name = name[1:]
+        if not cumulative.strip().isdigit() or name.startswith(' '):
+            continue
+        package = name.split('.')[0]
+        totals[package] = totals.get(package, 0) + int(cumulative)
+    return sorted(totals.items(), key=lambda pair: pair[1], reverse=True)[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to boot')
+    parser.add_argument('--import-budget-ms', type=float, default=1500.0,
+                        help='Budget for django.setup() plus the URLconf import')
+    parser.add_argument('--first-request-budget-ms', type=float, default=1000.0,
+                        help='Budget for the first generate request after boot')
+    parser.add_argument('--latency', type=float, default=0.0, help='Fake OpenAI base latency in seconds')
+    parser.add_argument('--no-warm-up', action='store_true', help='Boot without WARM_UP_ON_START')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='Also list the N slowest top-level imports')
+    parser.add_argument('--child', metavar='DATABASE', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return child(args.child)
+
+    from .fake_openai import FakeOpenAIServer
+    fake = FakeOpenAIServer(latency=args.latency).start()
+    try:
+        runs = [boot(fake.url, not args.no_warm_up)[0] for _ in range(args.runs)]
+        offenders = []
+        if args.importtime:
+            offenders = slowest_imports(boot(fake.url, not args.no_warm_up, importtime=True)[1], args.importtime)
+    finally:
+        fake.stop()
+
+    print(f"Cold start over {args.runs} runs (warm-up {'off' if args.no_warm_up else 'on'})")
+    print(f"{'measurement':<20}{'median':>10}{'max':>10}")
+    for name in ['import_ms', 'first_list_ms', 'first_generate_ms', 'warm_generate_ms', 'process_ms']:
+        values = [run[name] for run in runs]
+        print(f"{name:<20}{statistics.median(values):>10.1f}{max(values):>10.1f}")
+
+    if offenders:
+        print("\nSlowest imports (cumulative ms)")
+        for package, microseconds in offenders:
+            print(f"  {package:<30}{microseconds / 1000:>8.1f}")
+
+    failures = []
+    budgets = [('import_ms', args.import_budget_ms), ('first_generate_ms', args.first_request_budget_ms)]
+    for name, budget in budgets:
+        median = statistics.median(run[name] for run in runs)
+        if median > budget:
+            failures.append(f"{name} median {median:.1f}ms exceeds budget {budget:.0f}ms")
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    if failures:
+        sys.exit(1)
+    print("\nWithin budget")
+
+
+if __name__ == '__main__':
+    main()
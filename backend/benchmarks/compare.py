@@ -0,0 +1,71 @@
+"""
+Compare two benchmark result files
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.10
+
+Exits non-zero when any scenario's p95 latency or DB queries per request
+regressed by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def change(before, after):
+    if not before:
+        return 0.0 if not after else float('inf')
+    return (after - before) / before
+
+
+def compare(baseline, candidate, threshold):
+    """Return (rows, regressions) comparing scenarios present in both runs"""
+    rows, regressions = [], []
+    for name, after in candidate['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        metrics = {
+            'p50_ms': (before['latency_ms']['p50'], after['latency_ms']['p50']),
+            'p95_ms': (before['latency_ms']['p95'], after['latency_ms']['p95']),
+            'p99_ms': (before['latency_ms']['p99'], after['latency_ms']['p99']),
+            'req_per_s': (before['requests_per_s'], after['requests_per_s']),
+            'queries': (before['db_queries_per_request'], after['db_queries_per_request']),
+        }
+        rows.append((name, metrics))
+        for metric in ('p95_ms', 'queries'):
+            delta = change(*metrics[metric])
+            if delta > threshold:
+                regressions.append(f"{name} {metric} regressed by {delta:.1%}")
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Allowed relative regression before failing (default 0.10)')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print(f"baseline {baseline['meta'].get('revision')} -> candidate {candidate['meta'].get('revision')}")
+    for name, metrics in rows:
+        print(name)
+        for metric, (before, after) in metrics.items():
+            print(f"  {metric:<10} {before:>10} -> {after:>10} ({change(before, after):+.1%})")
+
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,336 @@
+"""
+Local stand-in for the OpenAI chat completions API
+
+Answers POST /v1/chat/completions with plausible itinerary, intent, activity
+and Q&A completions. Latency, token rate, malformed-JSON rate and error rate
+are configurable so the backend can be exercised under realistic conditions.
+
+    python -m benchmarks.fake_openai --port 8765 --latency 0.3 --token-rate 60
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+ACTIVITY_TYPES = ['cultural', 'dining', 'sightseeing', 'entertainment', 'shopping', 'outdoor']
+
+
+class FakeOpenAIServer:
+    """Threaded HTTP server mimicking the chat completions endpoint"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, token_rate=0.0,
+                 malformed_rate=0.0, error_rate=0.0, error_status=500, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_rate = token_rate
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'malformed': 0, 'prompt_tokens': 0,
+                      'completion_tokens': 0, 'tasks': {}}
+
+        handler = type('Handler', (FakeOpenAIHandler,), {'server_state': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def record(self, task, prompt_tokens, completion_tokens, error=False, malformed=False):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['errors'] += int(error)
+            self.stats['malformed'] += int(malformed)
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['completion_tokens'] += completion_tokens
+            self.stats['tasks'][task] = self.stats['tasks'].get(task, 0) + 1
+
+    def delay_for(self, completion_tokens):
+        delay = self.latency
+        if self.jitter:
+            with self.lock:
+                delay += self.random.uniform(0, self.jitter)
+        if self.token_rate:
+            delay += completion_tokens / self.token_rate
+        return delay
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_state = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with self.server_state.lock:
+                self._send_json(200, self.server_state.stats)
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        state = self.server_state
+        prompt = "\n".join(m.get('content', '') for m in payload.get('messages', []))
+        task, content = build_completion(prompt, state.random, state.lock)
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = min(count_tokens(content), payload.get('max_tokens') or 4096)
+
+        streaming = bool(payload.get('stream'))
+        # Streamed completions pay the base latency up front, then emit
+        # tokens at token_rate; others wait for the whole completion.
+        time.sleep(state.delay_for(0 if streaming else completion_tokens))
+
+        if state.roll(state.error_rate):
+            state.record(task, prompt_tokens, 0, error=True)
+            self._send_json(state.error_status, {
+                'error': {'message': 'Injected failure', 'type': 'server_error', 'code': None}
+            })
+            return
+
+        malformed = task != 'answer' and state.roll(state.malformed_rate)
+        if malformed:
+            content = malform(content, state.random, state.lock)
+
+        state.record(task, prompt_tokens, completion_tokens, malformed=malformed)
+        if streaming:
+            self._send_stream(payload.get('model', 'gpt-4'), content)
+            return
+        self._send_json(200, {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'gpt-4'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        })
+
+    def _send_stream(self, model, content):
+        """Send the completion as server-sent events, one word per chunk"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        pieces = re.findall(r'\S+\s*|\s+', content)
+        pause = 1 / self.server_state.token_rate if self.server_state.token_rate else 0
+        try:
+            for index, piece in enumerate(pieces + [None]):
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'delta': {'content': piece} if piece is not None else {},
+                        'finish_reason': None if piece is not None else 'stop'
+                    }]
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                if pause and piece is not None:
+                    time.sleep(pause)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (e.g. its timeout budget expired).
+            pass
+
+
+def count_tokens(text):
+    """Rough token estimate (about four characters per token)"""
+    return max(1, len(text) // 4)
+
+
+def build_completion(prompt, rng, lock):
+    """Return (task, content) appropriate for the prompt"""
+    with lock:
+        if 'Outline a ' in prompt:
+            return 'skeleton', json.dumps(fake_skeleton(prompt, rng))
+        if re.search(r'Plan day \d+ ', prompt):
+            day = fake_itinerary('', rng)['days'][0]
+            return 'day_plan', json.dumps({'schedule': day['schedule'], 'map_points': []})
+        if 'Adapt a travel itinerary' in prompt:
+            return 'adaptation', json.dumps({'replace': [
+                {'day': 1, 'index': 0, 'activity': fake_activity(rng, 9)}
+            ]})
+        if 'Continue a travel itinerary' in prompt:
+            return 'continuation', json.dumps(fake_continuation(prompt, rng))
+        if 'travel itinerary for' in prompt:
+            return 'generation', json.dumps(fake_itinerary(prompt, rng))
+        if 'determine the intent' in prompt:
+            return 'intent', "```json\n" + json.dumps(fake_intent(rng)) + "\n```"
+        if 'Generate a new activity' in prompt:
+            return 'activity', json.dumps(fake_activity(rng, rng.randint(8, 20)))
+        return 'answer', "Day 1 starts at 09:00 with a museum visit, and lunch is budgeted at about $25."
+
+
+def fake_itinerary(prompt, rng):
+    match = re.search(r'Generate a (\d+)-day travel itinerary for (.+?) starting (\S+)', prompt)
+    duration, destination, start = (int(match.group(1)), match.group(2), match.group(3)) if match \
+        else (3, 'Paris', '2025-01-01')
+    start_date = datetime.strptime(start, '%Y-%m-%d')
+
+    days, map_points, total = [], [], 0
+    for i in range(duration):
+        schedule = [fake_activity(rng, hour, destination) for hour in (9, 12, 14, 19)]
+        total += sum(a['cost_estimate'] for a in schedule)
+        map_points.extend({'name': a['activity'], **a['location']} for a in schedule)
+        days.append({
+            'day': i + 1,
+            'date': (start_date + timedelta(days=i)).strftime('%Y-%m-%d'),
+            'schedule': schedule
+        })
+
+    return {
+        'trip_summary': f"A {duration}-day trip through {destination}.",
+        'days': days,
+        'total_estimated_cost': total,
+        'map_points': map_points,
+        'adjustment_reasons': [],
+        'booking_links': [],
+        'warnings': []
+    }
+
+
+def fake_skeleton(prompt, rng):
+    match = re.search(r'Outline a (\d+)-day trip to (.+?) from', prompt)
+    duration, destination = (int(match.group(1)), match.group(2)) if match else (3, 'Paris')
+    return {
+        'trip_summary': f"A {duration}-day trip through {destination}.",
+        'days': [
+            {'day': n, 'theme': f"Theme {n}", 'neighbourhood': f"District {rng.randint(1, 20)}", 'budget': 100}
+            for n in range(1, duration + 1)
+        ],
+        'warnings': []
+    }
+
+
+def fake_continuation(prompt, rng):
+    match = re.search(r'schedules for days ([\d, ]+)', prompt)
+    numbers = [int(n) for n in match.group(1).split(',')] if match else [1]
+    return {'days': [
+        {'day': number, 'schedule': [fake_activity(rng, hour) for hour in (9, 12, 14, 19)]}
+        for number in numbers
+    ]}
+
+
+def fake_activity(rng, hour, destination='the city'):
+    activity_type = rng.choice(ACTIVITY_TYPES)
+    return {
+        'time': f"{hour:02d}:00",
+        'activity': f"{activity_type.title()} stop in {destination} #{rng.randint(1, 999)}",
+        'type': activity_type,
+        'duration': f"{rng.randint(1, 3)}h",
+        'cost_estimate': rng.randint(0, 60),
+        'location': {'lat': round(rng.uniform(-60, 60), 4), 'lng': round(rng.uniform(-170, 170), 4)},
+        'notes': 'Generated by the benchmark stand-in server.'
+    }
+
+
+def fake_intent(rng):
+    kind = rng.choice(['edit_request', 'edit_request', 'question', 'general_chat'])
+    return {
+        'type': kind,
+        'confidence': 0.9,
+        'details': {
+            'edit_type': 'add',
+            'target_day': 1,
+            'target_activity': 0,
+            'new_content': 'something fun',
+            'question_type': 'general'
+        }
+    }
+
+
+def malform(content, rng, lock):
+    """Corrupt a JSON completion the way real models do"""
+    with lock:
+        mode = rng.choice(['truncate', 'trailing_comma', 'preamble'])
+        if mode == 'truncate':
+            return content[:max(1, int(len(content) * rng.uniform(0.5, 0.95)))]
+    if mode == 'trailing_comma':
+        return re.sub(r'\}(\s*)\]', r'},\1]', content, count=1)
+    return "Sure! Here is the JSON you asked for:\n" + content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Base latency per call in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random latency in seconds')
+    parser.add_argument('--token-rate', type=float, default=0.0, help='Completion tokens per second (0 = instant)')
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+        token_rate=args.token_rate, malformed_rate=args.malformed_rate,
+        error_rate=args.error_rate, error_status=args.error_status, seed=args.seed
+    )
+    print(f"Fake OpenAI server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
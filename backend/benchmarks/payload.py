@@ -0,0 +1,98 @@
+"""
+Response size of itinerary edits: full bodies against JSON patches
+
+Creates 3-, 7- and 14-day itineraries in a throwaway database, applies
+typical single-activity edits through the edit endpoint twice (once without
+and once with the client's known version) and reports response bytes raw
+and gzipped, the way a mobile client on a slow link receives them. Each
+patch is checked to reproduce the full response's itinerary.
+
+    python -m benchmarks.payload --durations 3,7,14
+"""
+import argparse
+import copy
+import gzip
+import json
+import os
+import random
+import tempfile
+from datetime import date, timedelta
+from .fake_openai import fake_activity, fake_itinerary
+from .run import setup_django
+
+
+def edits(rng):
+    """Edit requests as a chat turn or the edit screen sends them"""
+    return [
+        ('add', {'edit_type': 'add_activity', 'day': 2, 'new_activity': fake_activity(rng, 21)}),
+        ('remove', {'edit_type': 'remove_activity', 'day': 2, 'activity_index': 1}),
+        ('modify', {'edit_type': 'modify_activity', 'day': 1, 'activity_index': 2,
+                    'new_activity': {'time': '15:30', 'cost_estimate': 18}}),
+    ]
+
+
+def create_itinerary(data, duration):
+    from itinerary.models import Itinerary
+    start = date(2025, 6, 1)
+    return Itinerary.objects.create(
+        title='Payload Trip',
+        destination='Lisbon',
+        start_date=start,
+        end_date=start + timedelta(days=duration - 1),
+        budget=3000,
+        interests=['food'],
+        constraints={},
+        itinerary_data=copy.deepcopy(data)
+    )
+
+
+def measure(client, duration, name, edit, rng):
+    """Sizes of the full and patch responses for one edit of a fresh itinerary"""
+    from itinerary.patch import apply_patch
+
+    data = fake_itinerary(f"Generate a {duration}-day travel itinerary for Lisbon starting 2025-06-01", rng)
+    sizes = {}
+    bodies = {}
+    for form, extra in [('full', {}), ('patch', {'known_version': 1})]:
+        itinerary = create_itinerary(data, duration)
+        response = client.put(
+            f'/api/itinerary/{itinerary.pk}/edit/',
+            data=json.dumps({**edit, **extra}), content_type='application/json'
+        )
+        if response.status_code != 200:
+            raise SystemExit(f"{name} edit returned {response.status_code}: {response.content[:200]}")
+        sizes[form] = (len(response.content), len(gzip.compress(response.content)))
+        bodies[form] = json.loads(response.content)
+
+    if 'patch' not in bodies['patch']:
+        raise SystemExit(f"{duration}-day {name} edit did not return a patch")
+    if apply_patch(copy.deepcopy(data), bodies['patch']['patch']) != bodies['full']['generated_data']:
+        raise SystemExit(f"{duration}-day {name} patch does not reproduce the full response")
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', default='3,7,14', help='Comma-separated trip lengths in days')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='tripmate-payload-')
+    setup_django(os.path.join(workdir, 'payload.sqlite3'))
+    from django.conf import settings
+    from django.test import Client
+    settings.ADMISSION_CONTROL = {}
+
+    client = Client()
+    rng = random.Random(args.seed)
+    print(f"{'days':>4}  {'edit':<8}{'full B':>9}{'patch B':>9}{'full gz':>9}{'patch gz':>9}{'saved gz':>10}")
+    for duration in [int(d) for d in args.durations.split(',') if d.strip()]:
+        for name, edit in edits(rng):
+            sizes = measure(client, duration, name, edit, rng)
+            (full, full_gz), (patch, patch_gz) = sizes['full'], sizes['patch']
+            print(f"{duration:>4}  {name:<8}{full:>9}{patch:>9}{full_gz:>9}{patch_gz:>9}"
+                  f"{1 - patch_gz / full_gz:>10.0%}")
+
+
+if __name__ == '__main__':
+    main()
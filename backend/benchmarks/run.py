@@ -0,0 +1,291 @@
+"""
+Scripted load scenarios for the TripMate API
+
+Seeds a throwaway database with itineraries and chat sessions, points the
+backend at the local OpenAI stand-in and drives concurrent clients against the
+real views. Reports p50/p95/p99 latency, requests/s and DB queries per
+request, and writes the results as JSON for comparison between commits.
+
+    python -m benchmarks.run --scenarios generate,chat,list --requests 200 \\
+        --concurrency 8 --latency 0.2 --output bench.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+
+SCENARIOS = ['generate', 'edit', 'chat', 'list', 'history']
+
+
+def setup_django(database_path):
+    """Configure Django against a fresh benchmark database"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trip_mate.settings')
+
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    settings.ALLOWED_HOSTS = ['*']
+    setup_test_environment()
+    connection.settings_dict['TEST']['NAME'] = database_path
+    connection.settings_dict.setdefault('OPTIONS', {})['timeout'] = 30
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+
+
+def seed(itineraries, sessions, messages_per_session):
+    """Insert itineraries and chat sessions to run scenarios against"""
+    from itinerary.models import Itinerary
+    from itinerary.services import PlanEngine
+    from chat.models import ChatSession, ChatMessage
+
+    engine = PlanEngine.__new__(PlanEngine)
+    destinations = ['Paris', 'Rome', 'Tokyo', 'Lisbon', 'New York', 'Bangkok']
+    start = date(2025, 6, 1)
+
+    rows = []
+    for i in range(itineraries):
+        destination = destinations[i % len(destinations)]
+        duration = 3 + i % 5
+        end = start + timedelta(days=duration - 1)
+        rows.append(Itinerary(
+            title=f"{destination} Trip",
+            destination=destination,
+            start_date=start,
+            end_date=end,
+            budget=1500,
+            interests=['food', 'museums'],
+            constraints={},
+            itinerary_data=engine._generate_fallback_itinerary(destination, start, end, 1500, duration)
+        ))
+    itinerary_ids = [it.id for it in Itinerary.objects.bulk_create(rows)]
+
+    session_rows = [
+        ChatSession(session_id=f"bench-{i}", itinerary_id=itinerary_ids[i % len(itinerary_ids)])
+        for i in range(sessions)
+    ]
+    ChatSession.objects.bulk_create(session_rows)
+    session_objects = list(ChatSession.objects.filter(session_id__startswith='bench-'))
+
+    ChatMessage.objects.bulk_create([
+        ChatMessage(
+            session=session,
+            message_type='user' if n % 2 else 'assistant',
+            content=f"Benchmark message {n} for {session.session_id}"
+        )
+        for session in session_objects
+        for n in range(messages_per_session)
+    ])
+    return itinerary_ids, [s.session_id for s in session_objects]
+
+
+def build_requests(scenario, itinerary_ids, session_ids):
+    """Yield (method, path, body) tuples for a scenario, cycling through seeded ids"""
+    if scenario == 'generate':
+        destinations = itertools.cycle(['Paris', 'Rome', 'Tokyo', 'Lisbon'])
+        for n in itertools.count():
+            yield 'post', '/api/itinerary/generate/', {
+                'destination': next(destinations),
+                'start_date': '2025-07-01',
+                'end_date': f"2025-07-{3 + n % 5:02d}",
+                'budget': '2000.00',
+                'interests': ['food', 'art']
+            }
+    elif scenario == 'edit':
+        for itinerary_id in itertools.cycle(itinerary_ids):
+            yield 'put', f"/api/itinerary/{itinerary_id}/edit/", {
+                'edit_type': 'modify_activity',
+                'day': 1,
+                'activity_index': 0,
+                'new_activity': {'notes': 'Updated by benchmark'},
+                'edit_reason': 'benchmark'
+            }
+    elif scenario == 'chat':
+        for session_id in itertools.cycle(session_ids):
+            yield 'post', '/api/chat/send/', {
+                'session_id': session_id,
+                'message': 'Can you add a food tour on day 1?'
+            }
+    elif scenario == 'list':
+        while True:
+            yield 'get', '/api/itinerary/list/', None
+    elif scenario == 'history':
+        for session_id in itertools.cycle(session_ids):
+            yield 'get', f"/api/chat/history/{session_id}/", None
+    else:
+        raise ValueError(f"Unknown scenario '{scenario}'")
+
+
+def run_scenario(scenario, requests, concurrency, itinerary_ids, session_ids):
+    """Drive one scenario with concurrent clients and summarise the samples"""
+    from django.db import connection
+    from django.test import Client
+
+    request_iter = build_requests(scenario, itinerary_ids, session_ids)
+    lock = threading.Lock()
+    local = threading.local()
+    samples = []
+
+    def one_request(_):
+        with lock:
+            method, path, body = next(request_iter)
+        if not hasattr(local, 'client'):
+            local.client = Client()
+
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        kwargs = {'data': json.dumps(body), 'content_type': 'application/json'} if body is not None else {}
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = getattr(local.client, method)(path, **kwargs)
+        elapsed = time.perf_counter() - started
+        return elapsed, response.status_code, queries[0], len(response.content)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for result in pool.map(one_request, range(requests)):
+            samples.append(result)
+    wall_time = time.perf_counter() - started
+
+    return summarise(samples, wall_time)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarise(samples, wall_time):
+    latencies = sorted(s[0] for s in samples)
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample[1])] = statuses.get(str(sample[1]), 0) + 1
+    count = len(samples) or 1
+
+    return {
+        'requests': len(samples),
+        'wall_time_s': round(wall_time, 4),
+        'requests_per_s': round(len(samples) / wall_time, 2) if wall_time else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            'mean': round(sum(latencies) / count * 1000, 2)
+        },
+        'db_queries_per_request': round(sum(s[2] for s in samples) / count, 2),
+        'response_bytes_mean': round(sum(s[3] for s in samples) / count, 1),
+        'status_codes': statuses,
+        'error_rate': round(sum(1 for s in samples if s[1] >= 400) / count, 4)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def print_report(results):
+    print(f"{'scenario':<10} {'req':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'errors':>7}")
+    for name, result in results['scenarios'].items():
+        latency = result['latency_ms']
+        print(f"{name:<10} {result['requests']:>6} {result['requests_per_s']:>8} {latency['p50']:>9} "
+              f"{latency['p95']:>9} {latency['p99']:>9} {result['db_queries_per_request']:>8} "
+              f"{result['error_rate']:>7}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run TripMate API benchmark scenarios')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated list from: {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=100, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--itineraries', type=int, default=100, help='Itineraries to seed')
+    parser.add_argument('--sessions', type=int, default=20, help='Chat sessions to seed')
+    parser.add_argument('--messages', type=int, default=10, help='Messages per seeded session')
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake OpenAI base latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--token-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--admission', action='store_true',
+                        help='Keep ADMISSION_CONTROL limits (disabled by default so every request reaches the view)')
+    parser.add_argument('--output', help='Write results JSON to this path')
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    from .fake_openai import FakeOpenAIServer
+    fake = FakeOpenAIServer(
+        latency=args.latency, jitter=args.jitter, token_rate=args.token_rate,
+        malformed_rate=args.malformed_rate, error_rate=args.error_rate, seed=args.seed
+    ).start()
+
+    workdir = tempfile.mkdtemp(prefix='tripmate-bench-')
+    setup_django(os.path.join(workdir, 'bench.sqlite3'))
+
+    from django.conf import settings
+    settings.OPENAI_API_KEY = 'benchmark'
+    settings.OPENAI_BASE_URL = fake.url
+    # Weather and geocoding use their local stand-ins, never the real services
+    settings.WEATHER_PROVIDER = 'fixture'
+    settings.GEOCODING_PROVIDER = 'local'
+    if not args.admission:
+        settings.ADMISSION_CONTROL = {}
+
+    itinerary_ids, session_ids = seed(args.itineraries, args.sessions, args.messages)
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'config': vars(args)
+        },
+        'scenarios': {}
+    }
+    try:
+        for scenario in scenarios:
+            results['scenarios'][scenario] = run_scenario(
+                scenario, args.requests, args.concurrency, itinerary_ids, session_ids
+            )
+    finally:
+        fake.stop()
+    results['fake_openai'] = fake.stats
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from search.admin import FullTextSearchMixin
 from .models import ChatSession, ChatMessage
 
 
@@ -11,10 +12,12 @@ class ChatSessionAdmin(admin.ModelAdmin):
 
 
 @admin.register(ChatMessage)
-class ChatMessageAdmin(admin.ModelAdmin):
+class ChatMessageAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['session', 'message_type', 'content_preview', 'created_at']
     list_filter = ['message_type', 'created_at']
     search_fields = ['content', 'session__session_id']
+    search_kind = 'message'
+    search_exact_fields = ['session__session_id']
     readonly_fields = ['created_at']
     
     def content_preview(self, obj):
@@ -1,6 +1,26 @@
+import threading
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from django.db.models.signals import post_save
+        from itinerary.models import Itinerary
+        from .persistence import itinerary_saved
+
+        post_save.connect(itinerary_saved, sender=Itinerary, dispatch_uid='chat_itinerary_saved')
+        if settings.WARM_UP_ON_START:
+            threading.Thread(target=warm_up, name='chat-warm-up', daemon=True).start()
+
+
+def warm_up():
+    """Build the TripMate service ahead of the first chat message"""
+    from trip_mate import metrics
+    from .services import get_trip_mate
+
+    with metrics.span('startup.chat'):
+        get_trip_mate()
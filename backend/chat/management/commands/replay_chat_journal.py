@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from chat.persistence import MessageWriter
+
+
+class Command(BaseCommand):
+    help = 'Replay chat writes journaled by worker processes that exited before flushing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--journal-dir', help='Journal directory (defaults to CHAT_JOURNAL_DIR)')
+
+    def handle(self, *args, **options):
+        writer = MessageWriter(journal_dir=options.get('journal_dir'), interval=0).start()
+        messages, itineraries = writer.recover()
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {messages} chat messages and {itineraries} itinerary saves from {writer.journal_dir}"
+        ))
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class ChatSession(models.Model):
@@ -13,6 +14,10 @@ class ChatSession(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], condition=models.Q(is_active=True), name='chatsession_active_user'),
+            models.Index(fields=['updated_at'], condition=models.Q(is_active=False), name='chatsession_ended_updated'),
+        ]
 
     def __str__(self):
         return f"Chat Session {self.session_id}"
@@ -30,10 +35,17 @@ class ChatMessage(models.Model):
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES)
     content = models.TextField()
     metadata = models.JSONField(default=dict)  # Store any additional data
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Messages are written behind the request (chat.persistence): the id is
+    # assigned when the message is queued, and so is the timestamp
+    write_id = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['session', 'created_at'], name='chatmessage_session_created'),
+            models.Index(fields=['created_at'], name='chatmessage_created'),
+        ]
 
     def __str__(self):
         return f"{self.message_type}: {self.content[:50]}..."
@@ -0,0 +1,540 @@
+"""
+Session state cache and write-behind persistence for chat turns
+
+A chat turn used to cost five database round trips (session lookup, user
+message insert, itinerary load, assistant message insert, itinerary save).
+Now the session row and its itinerary live in the shared Django cache, so a
+turn reads the database at most once (on a cache miss), and writes are
+queued:
+
+- Messages are buffered per process and written with one bulk_create every
+  CHAT_FLUSH_INTERVAL seconds, or sooner once CHAT_FLUSH_BATCH_SIZE are
+  waiting.
+- With a cache shared by all workers (CACHE_BACKEND=redis), itinerary
+  edits go to the cache immediately (later turns build on them) and are
+  saved with the next flush, coalesced per itinerary. Each edit claims the
+  next itinerary version in the cache, so two writers that started from the
+  same version cannot both save: the second gets an ItineraryConflict and
+  has to start again from the current itinerary. Because versions are
+  claimed one at a time, a flush that finds a newer version in the
+  database has nothing left to write.
+- With a per-process cache, claims in it would not be seen by other
+  workers, so edits are saved at once instead, claiming the version with a
+  conditional UPDATE of the row.
+- REST edits read through the same store and always save at once, claiming
+  both in the shared cache (when there is one) and in the row.
+
+Every queued write is first appended to a journal segment in
+CHAT_JOURNAL_DIR. A segment is deleted once its writes are committed, the
+queue is flushed when the process exits, and segments left behind by a
+process that died are replayed on the next start (or by the
+replay_chat_journal command). Replayed messages are matched on write_id, so
+a replay never duplicates rows.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from itinerary.models import Itinerary
+from trip_mate import metrics
+from .models import ChatMessage, ChatSession
+from .signals import messages_bulk_created
+
+logger = logging.getLogger(__name__)
+
+CHAT_WRITES = metrics.registry.counter(
+    'tripmate_chat_writes_total', 'Write-behind chat writes', ['kind', 'outcome'])
+FLUSH_SIZE = metrics.registry.histogram(
+    'tripmate_chat_flush_messages', 'Messages written per write-behind flush', [],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+SESSION_KEY = 'chat:session:{}'
+ITINERARY_KEY = 'chat:itinerary:{}'
+VERSION_KEY = 'chat:itinerary:{}:v{}'
+
+CONFLICT_RESPONSE = "Your itinerary was changed while I was working on that, so I didn't apply my edit. Please ask again."
+
+
+class ItineraryConflict(Exception):
+    """Another writer already saved the version an edit was going to create"""
+
+    def __init__(self, itinerary_id, version):
+        super().__init__(f"Itinerary {itinerary_id} was changed after version {version}")
+        self.itinerary_id = itinerary_id
+        self.version = version
+
+
+class SessionState:
+    """What a chat turn needs to know about its session"""
+
+    def __init__(self, session_id, pk, itinerary_id=None, destination='', itinerary=None):
+        self.session_id = session_id
+        self.pk = pk
+        self.itinerary_id = itinerary_id
+        self.destination = destination
+        self.itinerary_data = itinerary['data'] if itinerary else {}
+        self.itinerary_version = itinerary['version'] if itinerary else None
+
+
+class SessionStore:
+    """Active chat sessions and their itineraries, cached across requests"""
+
+    def __init__(self, writer, ttl=None, write_behind=None):
+        self.writer = writer
+        self.ttl = ttl or getattr(settings, 'CHAT_STATE_TTL', 600)
+        # Claims in a per-process cache would let two workers save the same version
+        self.write_behind = shared_cache() if write_behind is None else write_behind
+
+    def get(self, session_id):
+        """Return the SessionState for an active session, or None"""
+        row = cache.get(SESSION_KEY.format(session_id))
+        metrics.record_cache('chat_session', row is not None)
+        if row is None:
+            return self._load(session_id)
+
+        itinerary = self.itinerary(row['itinerary_id']) if row['itinerary_id'] is not None else None
+        return SessionState(session_id, itinerary=itinerary, **row)
+
+    def itinerary(self, itinerary_id):
+        """The current {'data', 'version'} of an itinerary, including edits not flushed yet"""
+        itinerary = cache.get(ITINERARY_KEY.format(itinerary_id))
+        metrics.record_cache('chat_itinerary', itinerary is not None)
+        if itinerary is None:
+            with metrics.span('db.itinerary_load'):
+                data, version = Itinerary.objects.filter(pk=itinerary_id) \
+                    .values_list('itinerary_data', 'version').first() or ({}, 1)
+            itinerary = {'data': data, 'version': version}
+            cache.set(ITINERARY_KEY.format(itinerary_id), itinerary, self.ttl)
+        return itinerary
+
+    def save_itinerary(self, state, itinerary_data):
+        """Make an edit visible to later turns now and persist it with the next flush
+
+        Raises ItineraryConflict when the itinerary changed since the state was read.
+        """
+        if state.itinerary_id is not None:
+            version = state.itinerary_version + 1
+            itinerary = {'data': itinerary_data, 'version': version}
+            if self.write_behind:
+                self._claim(state.itinerary_id, version)
+                cache.set(ITINERARY_KEY.format(state.itinerary_id), itinerary, self.ttl)
+                self.writer.save_itinerary(state.itinerary_id, itinerary)
+            else:
+                with metrics.span('db.itinerary_save'):
+                    self._save_row(None, state.itinerary_id, itinerary_data, version)
+            state.itinerary_version = version
+        state.itinerary_data = itinerary_data
+
+    def commit_itinerary(self, itinerary, itinerary_data, base_version, edit=None, **fields):
+        """Save an edit made outside chat right away, as the version after base_version
+
+        The ItineraryEdit record, if given, is saved in the same transaction,
+        as are any other itinerary fields passed. Raises ItineraryConflict
+        like save_itinerary.
+        """
+        version = base_version + 1
+        if self.write_behind:
+            self._claim(itinerary.pk, version)
+        try:
+            self._save_row(itinerary, itinerary.pk, itinerary_data, version, edit=edit, **fields)
+        except Exception:
+            if self.write_behind:
+                cache.delete(VERSION_KEY.format(itinerary.pk, version))
+            raise
+
+    def delete_itinerary(self, itinerary, attempts=3):
+        """Soft-delete an itinerary as a new version, so holders of the old one reload it"""
+        for attempt in range(attempts):
+            current = self.itinerary(itinerary.pk)
+            try:
+                self.commit_itinerary(itinerary, current['data'], current['version'], is_active=False)
+                break
+            except ItineraryConflict:
+                # An edit landed first; the delete still wins, one version later
+                if attempt == attempts - 1:
+                    raise
+        cache.delete(ITINERARY_KEY.format(itinerary.pk))
+
+    def _save_row(self, itinerary, itinerary_id, itinerary_data, version, edit=None, **fields):
+        # The conditional UPDATE claims the version in the row itself, so it
+        # holds across processes; a queued older edit then finds it superseded
+        with transaction.atomic():
+            claimed = Itinerary.objects.filter(pk=itinerary_id, version__lt=version) \
+                .update(version=version, **fields)
+            if not claimed:
+                self._conflict(itinerary_id, version)
+            if itinerary is None:
+                itinerary = Itinerary.objects.get(pk=itinerary_id)
+            if edit is not None:
+                edit.save()
+            itinerary.itinerary_data = itinerary_data
+            itinerary.version = version
+            for name, value in fields.items():
+                setattr(itinerary, name, value)
+            itinerary.save(update_fields=['itinerary_data', 'version', 'updated_at', *fields])
+        cache.set(ITINERARY_KEY.format(itinerary_id), {'data': itinerary_data, 'version': version}, self.ttl)
+        return itinerary
+
+    def _claim(self, itinerary_id, version):
+        # cache.add is atomic in every backend, so one writer wins each version
+        if not cache.add(VERSION_KEY.format(itinerary_id, version), True, self.ttl):
+            self._conflict(itinerary_id, version)
+
+    def _conflict(self, itinerary_id, version):
+        CHAT_WRITES.inc(kind='itinerary', outcome='conflict')
+        cached = cache.get(ITINERARY_KEY.format(itinerary_id))
+        if cached is not None and cached['version'] < version:
+            # The cached copy is behind whoever won; reload it on the next read
+            cache.delete(ITINERARY_KEY.format(itinerary_id))
+        raise ItineraryConflict(itinerary_id, version - 1)
+
+    def forget(self, session_id):
+        cache.delete(SESSION_KEY.format(session_id))
+
+    def _load(self, session_id):
+        with metrics.span('db.session_lookup'):
+            session = ChatSession.objects.select_related('itinerary') \
+                .filter(session_id=session_id, is_active=True).first()
+        if session is None:
+            return None
+        itinerary = session.itinerary
+        row = {
+            'pk': session.pk,
+            'itinerary_id': itinerary.pk if itinerary else None,
+            'destination': itinerary.destination if itinerary else '',
+        }
+        entries = {SESSION_KEY.format(session_id): row}
+        cached = None
+        if itinerary is not None:
+            # A newer edit may still be waiting for its flush
+            cached = cache.get(ITINERARY_KEY.format(itinerary.pk))
+            if cached is None or cached['version'] < itinerary.version:
+                cached = {'data': itinerary.itinerary_data, 'version': itinerary.version}
+                entries[ITINERARY_KEY.format(itinerary.pk)] = cached
+        cache.set_many(entries, self.ttl)
+        return SessionState(session_id, itinerary=cached, **row)
+
+
+class MessageWriter:
+    """Buffers chat writes, journals them, and flushes them in batches"""
+
+    def __init__(self, journal_dir=None, interval=None, batch_size=None, fsync=None):
+        self.journal_dir = str(journal_dir or settings.CHAT_JOURNAL_DIR)
+        self.interval = getattr(settings, 'CHAT_FLUSH_INTERVAL', 0.5) if interval is None else interval
+        self.batch_size = batch_size or getattr(settings, 'CHAT_FLUSH_BATCH_SIZE', 200)
+        self.fsync = getattr(settings, 'CHAT_JOURNAL_FSYNC', True) if fsync is None else fsync
+        self.token = uuid.uuid4().hex[:8]
+        self._messages = []
+        self._itineraries = {}
+        self._segment = None
+        self._segment_count = 0
+        self._committing = []  # Closed segments whose writes are not committed yet
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def add_message(self, session_pk, message_type, content, metadata=None):
+        """Queue a chat message; returns the unsaved instance"""
+        message = ChatMessage(
+            session_id=session_pk,
+            message_type=message_type,
+            content=content,
+            metadata=metadata or {},
+            write_id=uuid.uuid4(),
+            created_at=timezone.now()
+        )
+        with self._lock:
+            self._journal({
+                'kind': 'message',
+                'write_id': message.write_id,
+                'session': session_pk,
+                'message_type': message_type,
+                'content': content,
+                'metadata': message.metadata,
+                'created_at': message.created_at,
+            })
+            self._messages.append(message)
+            full = len(self._messages) >= self.batch_size
+        if self.interval <= 0:
+            self.flush()
+        elif full:
+            self._wakeup.set()
+        return message
+
+    def save_itinerary(self, itinerary_id, itinerary):
+        """Queue a save of {'data', 'version'}; later saves replace earlier ones"""
+        with self._lock:
+            self._journal({'kind': 'itinerary', 'id': itinerary_id, **itinerary})
+            self._itineraries[itinerary_id] = itinerary
+        if self.interval <= 0:
+            self.flush()
+
+    def has_pending(self, session_pk):
+        with self._lock:
+            return any(message.session_id == session_pk for message in self._messages)
+
+    def pending(self, session_pk):
+        """Queued messages of a session in every worker sharing the journal
+
+        Some may have been committed since their segment was read; callers
+        drop those by write_id.
+        """
+        messages = {}
+        for name in _segment_names(self.journal_dir):
+            for record in _read_segment(os.path.join(self.journal_dir, name)):
+                if record['kind'] == 'message' and record['session'] == session_pk:
+                    messages[record['write_id']] = _message(record)
+        return sorted(messages.values(), key=lambda message: message.created_at)
+
+    def flush(self):
+        """Write everything queued so far; returns the number of messages written"""
+        with self._flush_lock:
+            with self._lock:
+                messages, itineraries = self._messages, self._itineraries
+                self._messages, self._itineraries = [], {}
+                self._close_segment()
+                segments = list(self._committing)
+            if not messages and not itineraries:
+                return 0
+            try:
+                self._write(messages, itineraries)
+            except Exception:
+                # Keep the writes (and their journal segments) for the next flush
+                logger.exception("Chat write-behind flush failed; will retry")
+                CHAT_WRITES.inc(len(messages), kind='message', outcome='failed')
+                with self._lock:
+                    self._messages[:0] = messages
+                    for itinerary_id, itinerary in itineraries.items():
+                        self._itineraries.setdefault(itinerary_id, itinerary)
+                return 0
+            finally:
+                close_old_connections()
+            with self._lock:
+                self._committing = [path for path in self._committing if path not in segments]
+            for path in segments:
+                _remove(path)
+            CHAT_WRITES.inc(len(messages), kind='message', outcome='flushed')
+            CHAT_WRITES.inc(len(itineraries), kind='itinerary', outcome='flushed')
+            FLUSH_SIZE.observe(len(messages))
+            return len(messages)
+
+    def close(self):
+        """Stop the flusher and write out whatever is still queued"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=max(5.0, self.interval * 2))
+        self.flush()
+
+    def recover(self):
+        """Replay journal segments left behind by processes that died
+
+        Returns (messages written, itineraries saved).
+        """
+        messages, itineraries, segments = {}, {}, []
+        for name in _segment_names(self.journal_dir):
+            if self._orphaned(name):
+                path = os.path.join(self.journal_dir, name)
+                segments.append(path)
+                for record in _read_segment(path):
+                    if record['kind'] == 'message':
+                        messages[record['write_id']] = record
+                    elif record['kind'] == 'itinerary':
+                        itineraries[record['id']] = {'data': record['data'], 'version': record['version']}
+        if not segments:
+            return 0, 0
+
+        existing = {str(write_id) for write_id in ChatMessage.objects.filter(
+            write_id__in=list(messages)).values_list('write_id', flat=True)}
+        live_sessions = set(ChatSession.objects.filter(
+            pk__in={record['session'] for record in messages.values()}).values_list('pk', flat=True))
+        rows = [
+            _message(record)
+            for write_id, record in messages.items()
+            if write_id not in existing and record['session'] in live_sessions
+        ]
+        self._write(sorted(rows, key=lambda message: message.created_at), itineraries)
+        for path in segments:
+            _remove(path)
+        CHAT_WRITES.inc(len(rows), kind='message', outcome='recovered')
+        CHAT_WRITES.inc(len(itineraries), kind='itinerary', outcome='recovered')
+        return len(rows), len(itineraries)
+
+    def _write(self, messages, itineraries):
+        if messages:
+            with metrics.span('db.chat_flush'):
+                try:
+                    with transaction.atomic():
+                        created = ChatMessage.objects.bulk_create(messages)
+                except IntegrityError:
+                    # One bad row (e.g. its session was deleted) must not hold back the rest
+                    created = self._insert_each(messages)
+            messages_bulk_created.send(sender=ChatMessage, messages=created)
+
+        for itinerary_id, queued in itineraries.items():
+            # Save what later turns see, which may be newer than what was queued
+            latest = cache.get(ITINERARY_KEY.format(itinerary_id))
+            if latest is None or latest['version'] < queued['version']:
+                latest = queued
+            with metrics.span('db.itinerary_save'), transaction.atomic():
+                itinerary = Itinerary.objects.select_for_update().filter(pk=itinerary_id).first()
+                if itinerary is None or itinerary.version >= latest['version']:
+                    # Versions are claimed in turn, so a newer row already contains this edit
+                    CHAT_WRITES.inc(kind='itinerary', outcome='superseded')
+                    continue
+                itinerary.itinerary_data = latest['data']
+                itinerary.version = latest['version']
+                itinerary._write_behind = True
+                itinerary.save(update_fields=['itinerary_data', 'version', 'updated_at'])
+
+    def _insert_each(self, messages):
+        created = []
+        for message in messages:
+            try:
+                with transaction.atomic():
+                    ChatMessage.objects.bulk_create([message])
+                created.append(message)
+            except IntegrityError:
+                logger.warning("Dropping chat message %s for session %s", message.write_id, message.session_id)
+                CHAT_WRITES.inc(kind='message', outcome='dropped')
+        return created
+
+    def _journal(self, record):
+        # Called with self._lock held
+        if self._segment is None:
+            self._segment_count += 1
+            path = os.path.join(self.journal_dir, f"{os.getpid()}-{self.token}-{self._segment_count:06d}.jsonl")
+            self._segment = open(path, 'a', encoding='utf-8')
+        self._segment.write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+        self._segment.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+
+    def _close_segment(self):
+        # Called with self._lock held
+        if self._segment is not None:
+            self._segment.close()
+            self._committing.append(self._segment.name)
+            self._segment = None
+
+    def _orphaned(self, name):
+        pid, token = name.split('-', 2)[:2]
+        if token == self.token:
+            return False
+        if not pid.isdigit() or int(pid) == os.getpid():
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Chat write-behind flusher error")
+
+
+def shared_cache():
+    """Whether the default cache is shared by all worker processes"""
+    backend = settings.CACHES['default']['BACKEND']
+    return not backend.endswith(('.LocMemCache', '.DummyCache'))
+
+
+def itinerary_saved(sender, instance, raw=False, **kwargs):
+    """Refresh the cached copy when an itinerary is saved outside of chat"""
+    if not raw and not getattr(instance, '_write_behind', False):
+        # Keep a cached edit that is newer than the row and still waiting for its flush
+        cached = cache.get(ITINERARY_KEY.format(instance.pk))
+        if cached is None or cached['version'] <= instance.version:
+            cache.delete(ITINERARY_KEY.format(instance.pk))
+
+
+def _segment_names(journal_dir):
+    return sorted(name for name in os.listdir(journal_dir) if name.endswith('.jsonl')) \
+        if os.path.isdir(journal_dir) else []
+
+
+def _read_segment(path):
+    try:
+        f = open(path, encoding='utf-8')
+    except FileNotFoundError:
+        # Committed and removed by its writer since the directory was listed
+        return
+    with f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A torn final line from a crash mid-write was never acknowledged
+                continue
+
+
+def _message(record):
+    return ChatMessage(
+        session_id=record['session'],
+        message_type=record['message_type'],
+        content=record['content'],
+        metadata=record['metadata'],
+        write_id=uuid.UUID(record['write_id']),
+        created_at=parse_datetime(record['created_at'])
+    )
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_writer = None
+_store = None
+_lock = threading.Lock()
+
+
+def get_message_writer():
+    """Return the process-wide writer, replaying orphaned journal segments on first use"""
+    global _writer
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                writer = MessageWriter().start()
+                try:
+                    writer.recover()
+                except Exception:
+                    logger.exception("Chat journal replay failed; run replay_chat_journal")
+                _writer = writer
+    return _writer
+
+
+def get_session_store():
+    """Return the process-wide session state store"""
+    global _store
+    if _store is None:
+        _store = SessionStore(get_message_writer())
+    return _store
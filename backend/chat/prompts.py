@@ -0,0 +1,58 @@
+"""
+Prompt templates for the TripMate chat assistant
+"""
+from trip_mate.prompts import PromptTemplate
+
+
+INTENT = PromptTemplate("""
+    Analyze this user message about their travel itinerary and determine the intent:
+
+    User message: "{message}"
+
+    Current itinerary summary: {summary}
+
+    Respond with JSON only:
+    {{
+        "type": "edit_request|question|general_chat|unknown",
+        "confidence": 0.0-1.0,
+        "details": {{
+            "edit_type": "add|remove|modify|move|reschedule",
+            "target_day": "day number the user named, or null",
+            "target_activity": "activity name or index",
+            "new_content": "what they want to change to",
+            "question_type": "cost|timing|location|general"
+        }}
+    }}
+""")
+
+QUESTION = PromptTemplate("""
+    You are TripMate, a friendly travel assistant. Answer this question about the itinerary:
+
+    Question: "{message}"
+
+    Itinerary data: {itinerary}
+
+    Rules:
+    - Be helpful and conversational
+    - Keep responses under 3 sentences
+    - Use simple language
+    - Be specific about costs, times, and locations when available
+    - If you don't know something, say so politely
+""")
+
+ACTIVITY = PromptTemplate("""
+    Based on this user request: "{message}"
+
+    Generate a new activity in this JSON format:
+    {{
+        "time": "HH:MM",
+        "activity": "Activity name",
+        "type": "cultural|dining|sightseeing|entertainment|shopping|outdoor",
+        "duration": "Xh",
+        "cost_estimate": 0,
+        "location": {{"lat": 0.0, "lng": 0.0}},
+        "notes": "Helpful notes"
+    }}
+
+    Make it realistic and detailed.
+""")
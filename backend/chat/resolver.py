@@ -0,0 +1,271 @@
+"""
+Resolve chat references such as "the museum", "lunch on Tuesday" or "the 3pm
+thing" to an activity position in the itinerary, without an LLM call
+
+An index of every activity (name tokens and trigrams, type, hour, day number
+and weekday) is built once per itinerary version and cached. A reference is
+split into day, time and text constraints (a day the intent model picked
+applies when the reference names none); candidates on that day are scored on
+the rest, and the caller is asked to clarify only when the best matches are
+too close to call. Name tokens are accent-folded and lightly stemmed, so
+"museum" matches "Musée".
+"""
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+ORDINALS = {'first': 1, '1st': 1, 'second': 2, '2nd': 2, 'third': 3, '3rd': 3, 'fourth': 4, '4th': 4, 'fifth': 5, '5th': 5}
+STOPWORDS = {
+    'a', 'an', 'the', 'on', 'in', 'at', 'of', 'to', 'for', 'and', 'my', 'our', 'that', 'this', 'thing',
+    'activity', 'one', 'day', 'visit', 'trip', 'please', 'change', 'remove', 'delete', 'move', 'cancel',
+    'replace', 'swap', 'instead', 'with', 'it', 'we', 'i', 'do', 'go', 'get', 'rid', 'skip', 'from', 'last',
+}
+# Words that imply an activity type and/or a time of day
+HINTS = {
+    'breakfast': ('dining', (5, 11)),
+    'brunch': ('dining', (9, 13)),
+    'lunch': ('dining', (11, 15)),
+    'dinner': ('dining', (17, 24)),
+    'supper': ('dining', (17, 24)),
+    'meal': ('dining', None),
+    'restaurant': ('dining', None),
+    'museum': ('cultural', None),
+    'gallery': ('cultural', None),
+    'shopping': ('shopping', None),
+    'show': ('entertainment', None),
+    'hike': ('outdoor', None),
+    'park': ('outdoor', None),
+    'morning': (None, (5, 12)),
+    'afternoon': (None, (12, 17)),
+    'evening': (None, (17, 24)),
+    'night': (None, (18, 24)),
+}
+TIME = re.compile(r'\b(\d{1,2})(?::(\d{2}))?\s*(am|pm)\b|\b(\d{1,2}):(\d{2})\b')
+DAY_NUMBER = re.compile(r'\bday\s*(\d+)\b')
+WORD = re.compile(r'[a-z0-9]+')
+# Endings dropped before comparing name tokens ("museum", "musee" and "museo" all become "muse")
+SUFFIXES = ('ums', 'um', 'es', 's', 'e', 'o', 'a')
+
+AMBIGUITY_MARGIN = 0.1
+MIN_SCORE = 0.3
+
+
+class Resolution:
+    def __init__(self, status, day=None, index=None, candidates=None):
+        self.status = status  # 'resolved', 'ambiguous' or 'not_found'
+        self.day = day
+        self.index = index
+        self.candidates = candidates or []  # [(day, index, activity name)]
+
+
+class Entry:
+    __slots__ = ('day', 'index', 'name', 'tokens', 'trigrams', 'type', 'hour', 'weekday')
+
+    def __init__(self, day, index, activity, weekday):
+        self.day = day
+        self.index = index
+        self.name = activity.get('activity', '')
+        self.tokens = _tokens(_words(self.name))
+        self.trigrams = _trigrams(' '.join(sorted(self.tokens)))
+        self.type = activity.get('type')
+        self.hour = _parse_hour(activity.get('time', ''))
+        self.weekday = weekday
+
+
+class ActivityIndex:
+    """Lookup structure over one version of an itinerary"""
+
+    def __init__(self, itinerary_data):
+        self.entries = []
+        self.days = []
+        for position, day in enumerate(itinerary_data.get('days', []), start=1):
+            number = day.get('day', position)
+            self.days.append(number)
+            weekday = _weekday(day.get('date'))
+            for index, activity in enumerate(day.get('schedule', [])):
+                if isinstance(activity, dict):
+                    self.entries.append(Entry(number, index, activity, weekday))
+
+    def resolve(self, reference, target_day=None):
+        """Map a free-text (or numeric) reference to a Resolution
+
+        target_day, when given, limits the candidates to that day unless the
+        reference itself names a day.
+        """
+        text = str(reference if reference is not None else '').lower()
+
+        day = self._day_constraint(text)
+        if day is None and target_day in self.days:
+            day = target_day
+        entries = [e for e in self.entries if e.day == day] if day is not None else self.entries
+
+        # A bare number is a position in the schedule (zero-based, as before)
+        if text.strip().isdigit():
+            return self._by_position(int(text), day)
+        # The day reference is not part of the position ("the 2nd activity on day 2")
+        rest = _without_day(text)
+        ordinal = next((ORDINALS[w] for w in rest if w in ORDINALS), None)
+        if ordinal is not None and not (set(rest) - STOPWORDS - set(ORDINALS)):
+            return self._by_position(ordinal - 1, day)
+
+        hour = _parse_hour(text)
+        words = [w for w in _words(text) if w not in WEEKDAYS and w not in ORDINALS and not w.isdigit()
+                 and w not in ('am', 'pm')]
+        hinted_types = {HINTS[w][0] for w in words if w in HINTS and HINTS[w][0]}
+        hinted_hours = [HINTS[w][1] for w in words if w in HINTS and HINTS[w][1]]
+        tokens = _tokens(words)
+        trigrams = _trigrams(' '.join(sorted(tokens)))
+
+        if not tokens and hour is None and not hinted_types and not hinted_hours:
+            if day is not None and len(entries) == 1:
+                return Resolution('resolved', entries[0].day, entries[0].index)
+            return Resolution('ambiguous' if entries else 'not_found', candidates=_candidates(entries[:5]))
+
+        scored = []
+        for entry in entries:
+            score = 0.0
+            if tokens:
+                overlap = len(tokens & entry.tokens) / len(tokens)
+                similarity = _jaccard(trigrams, entry.trigrams)
+                score += max(overlap, similarity)
+            if entry.type in hinted_types:
+                score += 0.5
+            if hour is not None and entry.hour is not None:
+                score += 0.6 if entry.hour == hour else -0.3 * min(1, abs(entry.hour - hour) / 3)
+            if hinted_hours and entry.hour is not None:
+                score += 0.3 if any(low <= entry.hour < high for low, high in hinted_hours) else -0.2
+            scored.append((score, entry))
+
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        if not scored or scored[0][0] < MIN_SCORE:
+            return Resolution('not_found', candidates=_candidates(entries[:5]))
+        best_score, best = scored[0]
+        close = [entry for score, entry in scored if best_score - score < AMBIGUITY_MARGIN]
+        if len(close) > 1:
+            return Resolution('ambiguous', candidates=_candidates(close[:5]))
+        return Resolution('resolved', best.day, best.index)
+
+    def _day_constraint(self, text):
+        match = DAY_NUMBER.search(text)
+        if match and int(match.group(1)) in self.days:
+            return int(match.group(1))
+        for word in _words(text):
+            if word in WEEKDAYS:
+                days = {e.day for e in self.entries if e.weekday == word}
+                if len(days) == 1:
+                    return days.pop()
+        words = _words(text)
+        for position, word in enumerate(words[:-1]):
+            if words[position + 1] == 'day' and self.days:
+                if word in ORDINALS and ORDINALS[word] in self.days:
+                    return ORDINALS[word]
+                if word == 'last':
+                    return self.days[-1]
+        return None
+
+    def _by_position(self, index, day):
+        day = day if day in self.days else (self.days[0] if self.days else None)
+        for entry in self.entries:
+            if entry.day == day and entry.index == index:
+                return Resolution('resolved', day, index)
+        return Resolution('not_found', candidates=_candidates([e for e in self.entries if e.day == day][:5]))
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_SIZE = 256
+
+
+def get_index(itinerary_data):
+    """Return the cached ActivityIndex for this version of the itinerary"""
+    key = _fingerprint(itinerary_data)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is not None:
+            _cache.move_to_end(key)
+            return index
+    index = ActivityIndex(itinerary_data)
+    with _cache_lock:
+        _cache[key] = index
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+def resolve_target(itinerary_data, reference, target_day=None):
+    return get_index(itinerary_data).resolve(reference, target_day)
+
+
+def _fingerprint(itinerary_data):
+    return tuple(
+        (day.get('day'), day.get('date'), tuple(
+            (a.get('activity'), a.get('time'), a.get('type')) if isinstance(a, dict) else None
+            for a in day.get('schedule', [])
+        ))
+        for day in itinerary_data.get('days', [])
+    )
+
+
+def _candidates(entries):
+    return [(e.day, e.index, e.name) for e in entries]
+
+
+def _words(text):
+    folded = unicodedata.normalize('NFKD', str(text).lower())
+    return WORD.findall(''.join(c for c in folded if not unicodedata.combining(c)))
+
+
+def _tokens(words):
+    return {_stem(word) for word in words if word not in STOPWORDS}
+
+
+def _stem(word):
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)} if text else set()
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _parse_hour(text):
+    match = TIME.search(str(text).lower())
+    if not match:
+        return None
+    if match.group(1):
+        hour = int(match.group(1)) % 12
+        return hour + 12 if match.group(3) == 'pm' else hour
+    return int(match.group(4)) % 24
+
+
+def _without_day(text):
+    """Words of a reference minus its day part: "day 2", "second day", weekdays and digits"""
+    words = _words(DAY_NUMBER.sub(' ', text))
+    kept = []
+    for position, word in enumerate(words):
+        if word in WEEKDAYS or word.isdigit():
+            continue
+        if position + 1 < len(words) and words[position + 1] == 'day' and (word in ORDINALS or word == 'last'):
+            continue
+        kept.append(word)
+    return kept
+
+
+def _weekday(date):
+    try:
+        return WEEKDAYS[datetime.strptime(str(date), '%Y-%m-%d').weekday()]
+    except (TypeError, ValueError):
+        return None
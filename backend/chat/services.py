@@ -1,25 +1,63 @@
 """
 TripMate conversational AI service
 """
-import openai
 import json
-from django.conf import settings
-from itinerary.services import PlanEngine
+import threading
+from itinerary.parsing import is_complete_activity, parse_json, record_outcome
+from itinerary.services import get_plan_engine
+from trip_mate import metrics
+from trip_mate.llm import get_router
+from . import prompts
+from .resolver import resolve_target
+
+
+QUESTION_FALLBACK = "I'd be happy to help with your itinerary! Could you be more specific about what you'd like to know?"
+
+# Chat intent edit types -> PlanEngine edit operations
+EDIT_TYPES = {
+    'add': 'add_activity',
+    'remove': 'remove_activity',
+    'modify': 'modify_activity',
+    'reschedule': 'modify_activity',
+    'move': 'move_activity',
+}
 
 
 class TripMateService:
     """Conversational AI service for itinerary editing"""
     
     def __init__(self):
-        self.openai_client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-        self.plan_engine = PlanEngine()
+        self.router = get_router()
+        self.plan_engine = get_plan_engine()
     
     def process_message(self, message, itinerary_data, session_history=None):
         """Process user message and return TripMate response"""
         
         # Analyze the user's intent
         intent = self._analyze_intent(message, itinerary_data)
+        return self._dispatch(message, itinerary_data, intent)
+    
+    def stream_message(self, message, itinerary_data):
+        """Process a user message, yielding events as the reply is produced
         
+        Yields ``token`` events with pieces of the reply, an ``edit`` event as
+        soon as an edit has been applied, and finally a ``result`` event with
+        the same fields process_message returns.
+        """
+        intent = self._analyze_intent(message, itinerary_data)
+        
+        if intent['type'] == 'question':
+            result = yield from self._stream_question(message, itinerary_data)
+        else:
+            result = self._dispatch(message, itinerary_data, intent)
+            if result['edit_applied']:
+                yield {'type': 'edit', 'updated_itinerary': result['updated_itinerary']}
+            yield {'type': 'token', 'text': result['response']}
+        
+        yield {'type': 'result', **result}
+    
+    def _dispatch(self, message, itinerary_data, intent):
+        """Route a message to the handler for its intent"""
         if intent['type'] == 'edit_request':
             return self._handle_edit_request(message, itinerary_data, intent)
         elif intent['type'] == 'question':
@@ -32,54 +70,55 @@ class TripMateService:
     def _analyze_intent(self, message, itinerary_data):
         """Analyze user message to determine intent"""
         
-        prompt = f"""
-        Analyze this user message about their travel itinerary and determine the intent:
-        
-        User message: "{message}"
-        
-        Current itinerary summary: {itinerary_data.get('trip_summary', 'No summary available')}
-        
-        Respond with JSON only:
-        {{
-            "type": "edit_request|question|general_chat|unknown",
-            "confidence": 0.0-1.0,
-            "details": {{
-                "edit_type": "add|remove|modify|move|reschedule",
-                "target_day": 1-7,
-                "target_activity": "activity name or index",
-                "new_content": "what they want to change to",
-                "question_type": "cost|timing|location|general"
-            }}
-        }}
-        """
+        prompt = prompts.INTENT.render(
+            message=message, summary=itinerary_data.get('trip_summary', 'No summary available')
+        )
         
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
+            response = self.router.complete(
+                'intent',
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.3,
-                max_tokens=200
+                max_tokens=200,
+                json_response=True
             )
             
-            content = response.choices[0].message.content.strip()
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0]
-            
-            return json.loads(content)
+            return self._parse_completion(
+                'intent', response, lambda data: isinstance(data, dict) and 'type' in data
+            )
         except:
+            metrics.record_fallback('intent')
             return {"type": "unknown", "confidence": 0.0, "details": {}}
     
     def _handle_edit_request(self, message, itinerary_data, intent):
         """Handle requests to edit the itinerary"""
         details = intent.get('details', {})
         edit_type = details.get('edit_type', 'modify')
+        # Only set when the user named a day; it narrows the activities to look at
+        day = _as_int(details.get('target_day'), None)
+        activity_index = 0
         
-        # Generate the edit
+        # Find the activity the user means; adding needs no target
+        if edit_type != 'add':
+            target = details.get('target_activity')
+            with metrics.span('chat.resolve_target'):
+                resolution = resolve_target(
+                    itinerary_data, message if target in (None, '') else target, target_day=day
+                )
+            if resolution.status != 'resolved':
+                return {
+                    'response': self._clarification(resolution),
+                    'updated_itinerary': itinerary_data,
+                    'edit_applied': False
+                }
+            day, activity_index = resolution.day, resolution.index
+        
+        # Generate the edit; removals don't need a new activity
         edit_request = {
-            'edit_type': edit_type,
-            'day': details.get('target_day', 1),
-            'activity_index': details.get('target_activity', 0),
-            'new_activity': self._generate_activity_from_request(message, details),
+            'edit_type': EDIT_TYPES.get(edit_type, 'modify_activity'),
+            'day': day if day is not None else 1,
+            'activity_index': activity_index,
+            'new_activity': self._generate_activity_from_request(message, details) if edit_type != 'remove' else {},
             'edit_reason': message
         }
         
@@ -95,28 +134,22 @@ class TripMateService:
             'edit_applied': True
         }
     
+    def _clarification(self, resolution):
+        """Ask which activity was meant when a reference can't be resolved"""
+        options = "; ".join(f"day {day}: {name}" for day, index, name in resolution.candidates)
+        if resolution.status == 'ambiguous' and options:
+            return f"Which one do you mean? I found a few matches: {options}."
+        if options:
+            return f"I couldn't find that activity. Did you mean one of these? {options}."
+        return "I couldn't find that activity in your itinerary. Could you tell me the day and the activity name?"
+    
     def _handle_question(self, message, itinerary_data):
         """Handle questions about the itinerary"""
         
-        prompt = f"""
-        You are TripMate, a friendly travel assistant. Answer this question about the itinerary:
-        
-        Question: "{message}"
-        
-        Itinerary data: {json.dumps(itinerary_data, indent=2)}
-        
-        Rules:
-        - Be helpful and conversational
-        - Keep responses under 3 sentences
-        - Use simple language
-        - Be specific about costs, times, and locations when available
-        - If you don't know something, say so politely
-        """
-        
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
+            response = self.router.complete(
+                'qa',
+                messages=[{"role": "user", "content": self._question_prompt(message, itinerary_data)}],
                 temperature=0.7,
                 max_tokens=150
             )
@@ -128,12 +161,43 @@ class TripMateService:
                 'edit_applied': False
             }
         except:
+            metrics.record_fallback('qa')
             return {
-                'response': "I'd be happy to help with your itinerary! Could you be more specific about what you'd like to know?",
+                'response': QUESTION_FALLBACK,
                 'updated_itinerary': itinerary_data,
                 'edit_applied': False
             }
     
+    def _stream_question(self, message, itinerary_data):
+        """Answer a question, yielding token events as the answer streams in"""
+        parts = []
+        try:
+            for text in self.router.stream(
+                'qa',
+                messages=[{"role": "user", "content": self._question_prompt(message, itinerary_data)}],
+                temperature=0.7,
+                max_tokens=150
+            ):
+                parts.append(text)
+                yield {'type': 'token', 'text': text}
+        except Exception:
+            metrics.record_fallback('qa')
+            if not parts:
+                parts.append(QUESTION_FALLBACK)
+                yield {'type': 'token', 'text': QUESTION_FALLBACK}
+        
+        return {
+            'response': ''.join(parts).strip(),
+            'updated_itinerary': itinerary_data,
+            'edit_applied': False
+        }
+    
+    def _question_prompt(self, message, itinerary_data):
+        # Compact JSON: the whole itinerary goes into the prompt on every question
+        return prompts.QUESTION.render(
+            message=message, itinerary=json.dumps(itinerary_data, separators=(',', ':'))
+        )
+    
     def _handle_general_chat(self, message, itinerary_data):
         """Handle general conversation"""
         
@@ -163,37 +227,20 @@ class TripMateService:
     def _generate_activity_from_request(self, message, details):
         """Generate a new activity based on user request"""
         
-        prompt = f"""
-        Based on this user request: "{message}"
-        
-        Generate a new activity in this JSON format:
-        {{
-            "time": "HH:MM",
-            "activity": "Activity name",
-            "type": "cultural|dining|sightseeing|entertainment|shopping|outdoor",
-            "duration": "Xh",
-            "cost_estimate": 0,
-            "location": {{"lat": 0.0, "lng": 0.0}},
-            "notes": "Helpful notes"
-        }}
-        
-        Make it realistic and detailed.
-        """
+        prompt = prompts.ACTIVITY.render(message=message)
         
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
+            response = self.router.complete(
+                'activity',
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.7,
-                max_tokens=200
+                max_tokens=200,
+                json_response=True
             )
             
-            content = response.choices[0].message.content.strip()
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0]
-            
-            return json.loads(content)
+            return self._parse_completion('activity', response, is_complete_activity)
         except:
+            metrics.record_fallback('activity')
             return {
                 "time": "14:00",
                 "activity": "Custom Activity",
@@ -204,6 +251,20 @@ class TripMateService:
                 "notes": "Added based on your request"
             }
     
+    def _parse_completion(self, task, response, is_valid):
+        """Parse and validate a JSON completion, repairing it where possible"""
+        try:
+            with metrics.span('json.parse'):
+                result = parse_json(response.choices[0].message.content or '')
+            if not is_valid(result.data):
+                raise ValueError(f"Completion does not match the {task} schema")
+        except ValueError:
+            record_outcome(task, 'failed', response)
+            raise
+        
+        record_outcome(task, 'repaired' if result.repaired else 'clean')
+        return result.data
+    
     def _generate_edit_response(self, message, edit_type, details, updated_itinerary):
         """Generate a friendly response about the edit made"""
         
@@ -216,3 +277,24 @@ class TripMateService:
         }
         
         return responses.get(edit_type, "I've made that change to your itinerary! Is there anything else you'd like to adjust?")
+
+
+def _as_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+_trip_mate = None
+_trip_mate_lock = threading.Lock()
+
+
+def get_trip_mate():
+    """Return the process-wide TripMateService (it holds no per-request state)"""
+    global _trip_mate
+    if _trip_mate is None:
+        with _trip_mate_lock:
+            if _trip_mate is None:
+                _trip_mate = TripMateService()
+    return _trip_mate
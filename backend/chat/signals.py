@@ -0,0 +1,8 @@
+"""
+Custom signals for chat writes that bypass post_save
+"""
+from django.dispatch import Signal
+
+# Sent after a write-behind flush bulk-creates chat messages; ``messages`` is
+# the list of saved instances (with primary keys).
+messages_bulk_created = Signal()
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+from django.core.cache import cache
+from django.test import TestCase
+from itinerary.models import Itinerary
+from .models import ChatMessage, ChatSession
+from .persistence import ItineraryConflict, MessageWriter, SessionStore
+
+DAY_1 = {'day': 1, 'date': '2025-06-02', 'schedule': []}
+DAY_2 = {'day': 2, 'date': '2025-06-03', 'schedule': []}
+
+
+class JournalRecoveryTests(TestCase):
+    """Writes journaled by a writer that died are replayed exactly once"""
+
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, True)
+        self.itinerary = Itinerary.objects.create(
+            title='Paris', destination='Paris', start_date='2025-06-02', end_date='2025-06-04',
+            budget=1000, itinerary_data={'days': []}
+        )
+        self.session = ChatSession.objects.create(session_id='s1', itinerary=self.itinerary)
+
+    def writer(self):
+        # No flusher thread: nothing reaches the database until flush() or recover()
+        writer = MessageWriter(journal_dir=self.journal_dir, interval=3600, fsync=False)
+        os.makedirs(writer.journal_dir, exist_ok=True)
+        return writer
+
+    def kill(self, writer):
+        # What a crash leaves behind: the journal, and none of the queued writes
+        with writer._lock:
+            writer._close_segment()
+
+    def test_replays_every_write_once(self):
+        writer = self.writer()
+        flushed = [writer.add_message(self.session.pk, 'user', f'flushed {i}') for i in range(3)]
+        writer.flush()
+        queued = [writer.add_message(self.session.pk, 'assistant', f'queued {i}') for i in range(4)]
+        writer.save_itinerary(self.itinerary.pk, {'data': {'days': [DAY_1]}, 'version': 2})
+        writer.save_itinerary(self.itinerary.pk, {'data': {'days': [DAY_1, DAY_2]}, 'version': 3})
+        self.kill(writer)
+
+        recovered = self.writer().recover()
+
+        self.assertEqual(recovered, (4, 1))
+        write_ids = list(ChatMessage.objects.values_list('write_id', flat=True))
+        self.assertCountEqual(write_ids, [message.write_id for message in flushed + queued])
+        self.itinerary.refresh_from_db()
+        self.assertEqual((self.itinerary.version, self.itinerary.itinerary_data), (3, {'days': [DAY_1, DAY_2]}))
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_segment_committed_before_crash_is_not_duplicated(self):
+        writer = self.writer()
+        messages = [writer.add_message(self.session.pk, 'user', f'message {i}') for i in range(3)]
+        with writer._lock:
+            segment = writer._segment.name
+        shutil.copy(segment, segment + '.copy')
+        writer.flush()
+        # The process died after committing but before removing its segment
+        os.rename(segment + '.copy', segment)
+        writer.add_message(self.session.pk, 'user', 'after the flush')
+        self.kill(writer)
+
+        self.assertEqual(self.writer().recover(), (1, 0))
+        self.assertEqual(self.writer().recover(), (0, 0))
+        self.assertEqual(ChatMessage.objects.count(), 4)
+        self.assertEqual(ChatMessage.objects.filter(write_id__in=[m.write_id for m in messages]).count(), 3)
+
+    def test_skips_messages_of_deleted_sessions(self):
+        writer = self.writer()
+        writer.add_message(self.session.pk, 'user', 'hello')
+        self.kill(writer)
+        self.session.delete()
+
+        self.assertEqual(self.writer().recover(), (0, 0))
+        self.assertFalse(ChatMessage.objects.exists())
+
+    def test_pending_reads_other_writers_journal(self):
+        other = self.writer()
+        message = other.add_message(self.session.pk, 'user', 'not flushed yet')
+
+        pending = self.writer().pending(self.session.pk)
+
+        self.assertEqual([m.write_id for m in pending], [message.write_id])
+        self.assertFalse(ChatMessage.objects.exists())
+
+
+class VersionClaimTests(TestCase):
+    """Without a shared cache, versions are claimed in the itinerary row"""
+
+    def setUp(self):
+        self.itinerary = Itinerary.objects.create(
+            title='Paris', destination='Paris', start_date='2025-06-02', end_date='2025-06-04',
+            budget=1000, itinerary_data={'days': [DAY_1]}
+        )
+        self.session = ChatSession.objects.create(session_id='s1', itinerary=self.itinerary)
+        self.addCleanup(cache.clear)
+
+    def store(self):
+        # Each worker has its own cache; clearing it stands in for another process
+        cache.clear()
+        return SessionStore(writer=None, write_behind=False)
+
+    def test_second_writer_from_the_same_version_conflicts(self):
+        first, second = self.store().get('s1'), self.store().get('s1')
+
+        self.store().save_itinerary(first, {'days': [DAY_1, DAY_2]})
+        with self.assertRaises(ItineraryConflict):
+            self.store().save_itinerary(second, {'days': []})
+
+        self.itinerary.refresh_from_db()
+        self.assertEqual((self.itinerary.version, self.itinerary.itinerary_data), (2, {'days': [DAY_1, DAY_2]}))
+
+    def test_rest_edit_after_chat_edit_conflicts_on_stale_base(self):
+        state = self.store().get('s1')
+        self.store().save_itinerary(state, {'days': [DAY_2]})
+
+        with self.assertRaises(ItineraryConflict):
+            self.store().commit_itinerary(self.itinerary, {'days': []}, base_version=1)
+        self.store().commit_itinerary(self.itinerary, {'days': []}, base_version=2)
+
+        self.itinerary.refresh_from_db()
+        self.assertEqual(self.itinerary.version, 3)
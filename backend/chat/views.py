@@ -1,10 +1,18 @@
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from .models import ChatSession, ChatMessage
-from .services import TripMateService
-from itinerary.models import Itinerary
+from .persistence import CONFLICT_RESPONSE, ItineraryConflict, get_message_writer, get_session_store
+from .services import get_trip_mate
+from .websocket import hub, itinerary_event
+from itinerary.geocoding import apply_locations, get_geocoder
+from itinerary.patch import delta
+from trip_mate.admission import admission_control
+from trip_mate.idempotency import idempotent
+from trip_mate.metrics import span
+import copy
 import uuid
 import json
 
@@ -23,8 +31,8 @@ def start_chat_session(request):
     )
     
     # Add welcome message
-    welcome_message = ChatMessage.objects.create(
-        session=session,
+    welcome_message = get_message_writer().add_message(
+        session.pk,
         message_type='assistant',
         content="Hi! I'm TripMate, your personal travel assistant. I can help you edit your itinerary, answer questions, or suggest improvements. What would you like to do?",
         metadata={'type': 'welcome'}
@@ -36,36 +44,63 @@ def start_chat_session(request):
     }, status=status.HTTP_201_CREATED)
 
 
+@idempotent('chat_send')
+@admission_control('chat_send')
 @api_view(['POST'])
 def send_message(request):
     """Send a message to TripMate and get response"""
     session_id = request.data.get('session_id')
     message = request.data.get('message', '').strip()
+    # Version of the itinerary the client holds; edits then come back as a patch
+    known_version = request.data.get('itinerary_version')
     
     if not session_id or not message:
         return Response({'error': 'Session ID and message are required'}, 
                        status=status.HTTP_400_BAD_REQUEST)
     
-    # Get chat session
-    session = get_object_or_404(ChatSession, session_id=session_id, is_active=True)
+    # Session row and itinerary come from the state cache (one read on a miss)
+    store = get_session_store()
+    state = store.get(session_id)
+    if state is None:
+        raise Http404
     
-    # Save user message
-    user_message = ChatMessage.objects.create(
-        session=session,
-        message_type='user',
-        content=message
-    )
-    
-    # Get itinerary data
-    itinerary_data = session.itinerary.itinerary_data if session.itinerary else {}
+    # Queue user message; it is written with the next flush
+    writer = get_message_writer()
+    writer.add_message(state.pk, message_type='user', content=message)
     
     # Process message with TripMate
-    trip_mate = TripMateService()
-    result = trip_mate.process_message(message, itinerary_data)
-    
-    # Save assistant response
-    assistant_message = ChatMessage.objects.create(
-        session=session,
+    # Edits change the itinerary in place; keep the version the patch starts from
+    before = copy.deepcopy(state.itinerary_data)
+    with span('trip_mate.process_message'):
+        trip_mate = get_trip_mate()
+        result = trip_mate.process_message(message, state.itinerary_data)
+    
+    # Locate activities the edit added or changed, and move their map pins
+    if result['edit_applied'] and state.itinerary_id:
+        with span('chat.geocode'):
+            apply_locations(result['updated_itinerary'], state.destination, get_geocoder(), previous=before)
+    
+    base_version = state.itinerary_version
+    if result['edit_applied'] and state.itinerary_id:
+        try:
+            # Later turns see the edit at once; the database row follows with the flush
+            store.save_itinerary(state, result['updated_itinerary'])
+        except ItineraryConflict:
+            # Someone else changed the itinerary during this turn; theirs stands
+            current = store.itinerary(state.itinerary_id)
+            writer.add_message(state.pk, message_type='assistant', content=CONFLICT_RESPONSE,
+                               metadata={'edit_applied': False, 'updated_itinerary': None})
+            return Response({
+                'error': CONFLICT_RESPONSE,
+                'response': CONFLICT_RESPONSE,
+                'edit_applied': False,
+                'itinerary_version': current['version'],
+                'updated_itinerary': current['data']
+            }, status=status.HTTP_409_CONFLICT)
+    
+    # Queue assistant response
+    writer.add_message(
+        state.pk,
         message_type='assistant',
         content=result['response'],
         metadata={
@@ -78,14 +113,23 @@ def send_message(request):
         'response': result['response'],
         'edit_applied': result['edit_applied']
     }
+    if state.itinerary_id:
+        response_data['itinerary_version'] = state.itinerary_version
     
-    # If itinerary was updated, include the new data
+    # If itinerary was updated, include the new data (or a patch to it)
     if result['edit_applied']:
-        response_data['updated_itinerary'] = result['updated_itinerary']
-        # Update the itinerary in the database
-        if session.itinerary:
-            session.itinerary.itinerary_data = result['updated_itinerary']
-            session.itinerary.save()
+        if state.itinerary_id:
+            with span('chat.diff'):
+                patch = delta(before, result['updated_itinerary'])
+            response_data['itinerary_version'] = state.itinerary_version
+            # Sockets open on this session see the edit straight away
+            hub.publish(session_id, itinerary_event(
+                base_version, state.itinerary_version, patch, result['updated_itinerary']
+            ))
+            if patch is not None and str(known_version) == str(base_version):
+                response_data['itinerary_patch'] = patch
+        if 'itinerary_patch' not in response_data:
+            response_data['updated_itinerary'] = result['updated_itinerary']
     
     return Response(response_data)
 
@@ -93,13 +137,25 @@ def send_message(request):
 @api_view(['GET'])
 def get_chat_history(request, session_id):
     """Get chat history for a session"""
-    session = get_object_or_404(ChatSession, session_id=session_id, is_active=True)
-    messages = session.messages.all()
+    with span('db.session_lookup'):
+        session = get_object_or_404(ChatSession, session_id=session_id, is_active=True)
+    # Read this process's own queued writes back
+    writer = get_message_writer()
+    if writer.has_pending(session.pk):
+        writer.flush()
+    # Turns other workers have not flushed yet are only in their journal
+    # segments; read those first so a flush in between cannot hide a message
+    pending = writer.pending(session.pk)
+    with span('db.history_load'):
+        messages = list(session.messages.all())
+    saved = {message.write_id for message in messages}
+    messages = sorted(messages + [message for message in pending if message.write_id not in saved],
+                      key=lambda message: message.created_at)
     
     chat_history = []
     for message in messages:
         chat_history.append({
-            'id': message.id,
+            'id': message.id if message.id is not None else str(message.write_id),
             'type': message.message_type,
             'content': message.content,
             'timestamp': message.created_at.isoformat(),
@@ -116,6 +172,7 @@ def end_chat_session(request):
     session = get_object_or_404(ChatSession, session_id=session_id)
     session.is_active = False
     session.save()
+    get_session_store().forget(session_id)
     
     return Response({'message': 'Chat session ended successfully'})
 
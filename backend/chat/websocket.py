@@ -0,0 +1,366 @@
+"""
+WebSocket chat channel served directly by the ASGI application
+
+A connection to /ws/chat/<session_id>/ keeps its chat session and itinerary
+loaded for its whole life, so a turn costs no HTTP or session lookup
+overhead. Assistant replies stream to the client token by token, and
+itinerary edits are pushed to every socket on the session as soon as they
+are saved.
+
+Client -> server: {"type": "message", "content": "..."}, {"type": "ping"},
+{"type": "pong"}.
+Server -> client: ready, token, itinerary_updated, itinerary_patch,
+message_complete, error, ping and pong events, each a JSON object with a
+"type". An edit arrives as itinerary_patch (RFC 6902 operations from the
+version the socket last received) when that is smaller, and as a full
+itinerary_updated otherwise.
+
+Each turn goes through the same admission control (concurrency slot and
+per-client rate limit) as POST /api/chat/send/; a rejected turn gets an
+error event with the reason and retry_after seconds.
+
+Outgoing events pass through a bounded queue: a turn waits for a slow client
+to drain it, and a client that stops reading for WEBSOCKET_SEND_TIMEOUT is
+disconnected. Clients must answer the server's heartbeat pings (or send
+anything else) within WEBSOCKET_IDLE_TIMEOUT.
+"""
+import asyncio
+import copy
+import json
+import re
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from itinerary.geocoding import apply_locations, get_geocoder
+from itinerary.patch import delta
+from trip_mate import metrics
+from trip_mate.admission import ADMISSION_TOTAL, Rejected, get_controller, scope_identity
+from .persistence import CONFLICT_RESPONSE, ItineraryConflict, get_message_writer, get_session_store
+from .services import get_trip_mate
+
+
+PATH = re.compile(r'^/ws/chat/(?P<session_id>[\w-]+)/?$')
+
+CLOSE_NOT_FOUND = 4404
+CLOSE_IDLE = 4408
+CLOSE_SLOW_CONSUMER = 4429
+
+WEBSOCKET_EVENTS = metrics.registry.counter(
+    'tripmate_websocket_events_total', 'WebSocket connection lifecycle events', ['event'])
+
+
+class Disconnected(Exception):
+    """The socket closed while a turn was still producing events"""
+
+
+class SessionHub:
+    """Process-local registry of open sockets per chat session"""
+
+    def __init__(self):
+        self._sockets = {}
+        self._lock = threading.Lock()
+
+    def register(self, session_id, socket):
+        with self._lock:
+            self._sockets.setdefault(session_id, set()).add(socket)
+
+    def unregister(self, session_id, socket):
+        with self._lock:
+            sockets = self._sockets.get(session_id, set())
+            sockets.discard(socket)
+            if not sockets:
+                self._sockets.pop(session_id, None)
+
+    def publish(self, session_id, event):
+        """Push an event to every socket on the session; safe from any thread"""
+        with self._lock:
+            sockets = list(self._sockets.get(session_id, ()))
+        for socket in sockets:
+            socket.push(event)
+
+
+hub = SessionHub()
+
+
+def itinerary_event(base_version, version, patch, itinerary):
+    """Hub event for an edit; each socket picks the patch or the full itinerary"""
+    return {
+        'type': 'itinerary_updated',
+        'base_version': base_version,
+        'version': version,
+        'patch': patch,
+        'itinerary': itinerary,
+    }
+
+
+class ChatSocket:
+    """One WebSocket connection bound to a chat session"""
+
+    def __init__(self, scope, receive, send, session_id):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.session_id = session_id
+        self.session = None
+        self.loop = None
+        self.outbox = asyncio.Queue(maxsize=getattr(settings, 'WEBSOCKET_SEND_QUEUE', 256))
+        self.send_timeout = getattr(settings, 'WEBSOCKET_SEND_TIMEOUT', 10.0)
+        self.heartbeat = getattr(settings, 'WEBSOCKET_HEARTBEAT', 20.0)
+        self.idle_timeout = getattr(settings, 'WEBSOCKET_IDLE_TIMEOUT', 60.0)
+        self.last_seen = time.monotonic()
+        self.turn = None
+        self.closed = False
+        self.sent_version = None
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        await self.send({'type': 'websocket.accept'})
+
+        self.session = await sync_to_async(self._load_session, thread_sensitive=False)()
+        if self.session is None:
+            await self.send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+            return
+
+        self.loop = asyncio.get_running_loop()
+        self.sent_version = self.session.itinerary_version
+        hub.register(self.session_id, self)
+        WEBSOCKET_EVENTS.inc(event='connected')
+        sender = asyncio.create_task(self._sender())
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            await self._emit({
+                'type': 'ready',
+                'session_id': self.session_id,
+                'itinerary_id': self.session.itinerary_id,
+                'itinerary_version': self.session.itinerary_version,
+            })
+            await self._receiver()
+        finally:
+            self.closed = True
+            hub.unregister(self.session_id, self)
+            WEBSOCKET_EVENTS.inc(event='disconnected')
+            heartbeat.cancel()
+            sender.cancel()
+            if self.turn is not None:
+                # The turn finishes in its worker thread; its events go nowhere
+                self.turn.cancel()
+
+    async def _receiver(self):
+        while True:
+            message = await self.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            if message['type'] != 'websocket.receive':
+                continue
+            self.last_seen = time.monotonic()
+
+            try:
+                event = json.loads(message.get('text') or message.get('bytes') or b'')
+            except ValueError:
+                await self._emit({'type': 'error', 'error': 'Messages must be JSON objects'})
+                continue
+            kind = event.get('type') if isinstance(event, dict) else None
+
+            if kind == 'ping':
+                await self._emit({'type': 'pong'})
+            elif kind == 'message':
+                content = str(event.get('content', '')).strip()
+                if not content:
+                    await self._emit({'type': 'error', 'error': 'Message content is required'})
+                elif self.turn is not None and not self.turn.done():
+                    # One turn at a time per connection; the client retries
+                    WEBSOCKET_EVENTS.inc(event='busy')
+                    await self._emit({'type': 'error', 'error': 'Still answering the previous message'})
+                else:
+                    self.turn = asyncio.create_task(self._run_turn(content))
+
+    async def _run_turn(self, content):
+        try:
+            await sync_to_async(self._process, thread_sensitive=False)(content)
+        except Disconnected:
+            await self._close(CLOSE_SLOW_CONSUMER)
+        except Rejected as rejection:
+            await self._emit({
+                'type': 'error',
+                'error': 'Too many requests, please retry shortly' if rejection.status == 429
+                else 'Service is busy, please retry shortly',
+                'reason': rejection.reason,
+                'retry_after': rejection.retry_after,
+            })
+        except Exception:
+            await self._emit({'type': 'error', 'error': 'Something went wrong, please try again'})
+
+    async def _sender(self):
+        while not self.closed:
+            event = await self.outbox.get()
+            if self.closed:
+                return
+            try:
+                await self.send({'type': 'websocket.send', 'text': json.dumps(event, default=str)})
+            except Exception:
+                # The connection is gone; stop queueing and free any blocked producers
+                WEBSOCKET_EVENTS.inc(event='send_failed')
+                self.closed = True
+                while not self.outbox.empty():
+                    self.outbox.get_nowait()
+                return
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            if time.monotonic() - self.last_seen > self.idle_timeout:
+                WEBSOCKET_EVENTS.inc(event='idle_timeout')
+                await self._close(CLOSE_IDLE)
+                return
+            await self._emit({'type': 'ping'})
+
+    async def _emit(self, event):
+        if self.closed:
+            return
+        try:
+            await asyncio.wait_for(self.outbox.put(event), self.send_timeout)
+        except asyncio.TimeoutError:
+            WEBSOCKET_EVENTS.inc(event='slow_consumer')
+            await self._close(CLOSE_SLOW_CONSUMER)
+
+    async def _close(self, code):
+        if not self.closed:
+            self.closed = True
+            await self.send({'type': 'websocket.close', 'code': code})
+
+    def emit_threadsafe(self, event):
+        """Queue an event from a worker thread, waiting while the outbox is full"""
+        if self.closed:
+            raise Disconnected()
+        future = asyncio.run_coroutine_threadsafe(self.outbox.put(event), self.loop)
+        try:
+            future.result(self.send_timeout)
+        except TimeoutError:
+            future.cancel()
+            WEBSOCKET_EVENTS.inc(event='slow_consumer')
+            raise Disconnected()
+
+    def push(self, event):
+        """Deliver a hub event without blocking the publisher"""
+        if not self.closed and self.loop is not None:
+            self.loop.call_soon_threadsafe(self._push_nowait, event)
+
+    def _push_nowait(self, event):
+        if event['type'] == 'itinerary_updated':
+            event = self._itinerary_form(event)
+        try:
+            self.outbox.put_nowait(event)
+        except asyncio.QueueFull:
+            WEBSOCKET_EVENTS.inc(event='slow_consumer')
+            asyncio.ensure_future(self._close(CLOSE_SLOW_CONSUMER))
+
+    def _itinerary_form(self, event):
+        # Runs on the event loop, so sent_version follows the outbox order
+        if event['patch'] is not None and self.sent_version == event['base_version']:
+            form = {'type': 'itinerary_patch', 'base_version': event['base_version'], 'patch': event['patch']}
+        else:
+            form = {'type': 'itinerary_updated', 'itinerary': event['itinerary']}
+        self.sent_version = form['version'] = event['version']
+        return form
+
+    def _load_session(self):
+        try:
+            return get_session_store().get(self.session_id)
+        finally:
+            close_old_connections()
+
+    def _process(self, content):
+        """Run one chat turn in a worker thread, streaming events to the client"""
+        # Socket turns call the LLM like POST /api/chat/send/ and share its limits
+        controller = get_controller('chat_send')
+        if controller is None:
+            return self._turn(content)
+        try:
+            controller.admit_client(scope_identity(self.scope))
+        except Rejected as rejection:
+            ADMISSION_TOTAL.inc(endpoint='chat_send', outcome=rejection.reason)
+            raise
+        ADMISSION_TOTAL.inc(endpoint='chat_send', outcome='admitted')
+        try:
+            return self._turn(content)
+        finally:
+            controller.release()
+
+    def _turn(self, content):
+        token = metrics.start_request('chat_socket')
+        started = time.perf_counter()
+        try:
+            # Picks up edits made through other sockets, workers or the REST API
+            self.session = get_session_store().get(self.session_id) or self.session
+            writer = get_message_writer()
+            writer.add_message(self.session.pk, message_type='user', content=content)
+
+            # Edits change the itinerary in place; keep the version the patch starts from
+            before = copy.deepcopy(self.session.itinerary_data)
+            result = None
+            conflict = False
+            for event in get_trip_mate().stream_message(content, self.session.itinerary_data):
+                if event['type'] == 'token':
+                    self.emit_threadsafe(event)
+                elif event['type'] == 'edit':
+                    try:
+                        self._save_edit(before, event['updated_itinerary'])
+                    except ItineraryConflict:
+                        conflict = True
+                elif event['type'] == 'result':
+                    result = event
+            if conflict:
+                # Someone else changed the itinerary during this turn; theirs stands
+                result = {'response': CONFLICT_RESPONSE, 'edit_applied': False, 'updated_itinerary': None}
+                current = get_session_store().itinerary(self.session.itinerary_id)
+                self.push(itinerary_event(None, current['version'], None, current['data']))
+
+            assistant_message = writer.add_message(
+                self.session.pk,
+                message_type='assistant',
+                content=result['response'],
+                metadata={
+                    'edit_applied': result['edit_applied'],
+                    'updated_itinerary': result['updated_itinerary'] if result['edit_applied'] else None
+                }
+            )
+            self.emit_threadsafe({
+                'type': 'message_complete',
+                'message_id': str(assistant_message.write_id),
+                'response': result['response'],
+                'edit_applied': result['edit_applied'],
+            })
+        finally:
+            metrics.finish_request(token)
+            metrics.REQUEST_SECONDS.observe(
+                time.perf_counter() - started, endpoint='chat_socket', method='WS', status=200
+            )
+            close_old_connections()
+
+    def _save_edit(self, before, updated_itinerary):
+        """Locate, persist and broadcast an edited itinerary"""
+        if self.session.itinerary_id is not None:
+            with metrics.span('chat.geocode'):
+                apply_locations(updated_itinerary, self.session.destination, get_geocoder(), previous=before)
+        base_version = self.session.itinerary_version
+        get_session_store().save_itinerary(self.session, updated_itinerary)
+        with metrics.span('chat.diff'):
+            patch = delta(before, updated_itinerary)
+        hub.publish(self.session_id, itinerary_event(
+            base_version, self.session.itinerary_version, patch, updated_itinerary
+        ))
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI entry point for WebSocket connections"""
+    match = PATH.match(scope['path'])
+    if match is None:
+        # Rejecting before accept makes the server answer with HTTP 403
+        await receive()
+        await send({'type': 'websocket.close'})
+        return
+    await ChatSocket(scope, receive, send, match.group('session_id')).run()
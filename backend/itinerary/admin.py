@@ -1,18 +1,44 @@
 from django.contrib import admin
-from .models import Itinerary, ItineraryEdit
+from search.admin import FullTextSearchMixin
+from .models import GenerationBatch, GenerationBatchItem, GeocodedPlace, Itinerary, ItineraryEdit
 
 
 @admin.register(Itinerary)
-class ItineraryAdmin(admin.ModelAdmin):
+class ItineraryAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['title', 'destination', 'start_date', 'end_date', 'budget', 'created_at']
     list_filter = ['destination', 'start_date', 'created_at']
     search_fields = ['title', 'destination']
+    search_kind = 'itinerary'
     readonly_fields = ['created_at', 'updated_at']
 
 
 @admin.register(ItineraryEdit)
-class ItineraryEditAdmin(admin.ModelAdmin):
+class ItineraryEditAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['itinerary', 'edit_type', 'created_at']
     list_filter = ['edit_type', 'created_at']
     search_fields = ['itinerary__title', 'edit_reason']
+    search_kind = 'edit'
+    readonly_fields = ['created_at']
+
+
+@admin.register(GenerationBatch)
+class GenerationBatchAdmin(admin.ModelAdmin):
+    list_display = ['batch_id', 'user', 'status', 'total_items', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['batch_id']
+    readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(GenerationBatchItem)
+class GenerationBatchItemAdmin(admin.ModelAdmin):
+    list_display = ['batch', 'index', 'status', 'itinerary']
+    list_filter = ['status']
+    search_fields = ['batch__batch_id']
+
+
+@admin.register(GeocodedPlace)
+class GeocodedPlaceAdmin(admin.ModelAdmin):
+    list_display = ['query', 'lat', 'lng', 'provider', 'looked_up_at']
+    list_filter = ['provider']
+    search_fields = ['query', 'name']
     readonly_fields = ['created_at']
@@ -1,6 +1,40 @@
+import threading
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ItineraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'itinerary'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from . import clustering, reuse
+        from .models import Itinerary
+        from .signals import itineraries_bulk_created
+
+        post_save.connect(reuse.itinerary_saved, sender=Itinerary, dispatch_uid='reuse_itinerary_saved')
+        post_delete.connect(reuse.itinerary_deleted, sender=Itinerary, dispatch_uid='reuse_itinerary_deleted')
+        itineraries_bulk_created.connect(
+            reuse.itineraries_bulk_created, sender=Itinerary, dispatch_uid='reuse_itineraries_bulk_created'
+        )
+        post_save.connect(clustering.itinerary_saved, sender=Itinerary, dispatch_uid='map_itinerary_saved')
+        post_delete.connect(clustering.itinerary_deleted, sender=Itinerary, dispatch_uid='map_itinerary_deleted')
+        itineraries_bulk_created.connect(
+            clustering.itineraries_bulk_created, sender=Itinerary, dispatch_uid='map_itineraries_bulk_created'
+        )
+        if settings.WARM_UP_ON_START:
+            threading.Thread(target=warm_up, name='itinerary-warm-up', daemon=True).start()
+
+
+def warm_up():
+    """Build the PlanEngine and its LLM client ahead of the first request"""
+    from trip_mate import metrics
+    from .geocoding import get_geocoder
+    from .services import get_plan_engine
+    from .weather import get_forecast_service
+
+    with metrics.span('startup.itinerary'):
+        get_plan_engine().router.client
+        get_forecast_service()
+        get_geocoder()
@@ -0,0 +1,229 @@
+"""
+Bulk itinerary generation for agency workloads
+
+Identical requests in a batch are generated once, PlanEngine runs over a
+bounded worker pool, finished itineraries are inserted with bulk_create as
+they complete, and per-item results are streamed back as NDJSON. Every item's
+outcome is stored against the batch, so an interrupted batch can be resumed
+by its batch_id without regenerating the items that already succeeded. A run
+claims the items it generates, so two resumes of the same batch never
+generate one item twice; items another run holds are reported as in
+progress.
+"""
+import contextvars
+import hashlib
+import json
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from trip_mate import metrics
+from .models import GenerationBatch, GenerationBatchItem, Itinerary
+from .serializers import ItinerarySerializer, ItineraryGenerationRequestSerializer
+from .services import get_plan_engine
+from .signals import itineraries_bulk_created
+
+
+def request_key(serializer):
+    """Stable hash of a validated generation request"""
+    canonical = json.dumps(serializer.data, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def create_batch(items, user=None):
+    """Validate and store a new batch; invalid items are marked failed up front"""
+    batch = GenerationBatch.objects.create(
+        batch_id=str(uuid.uuid4()),
+        user=user,
+        total_items=len(items)
+    )
+
+    rows = []
+    for index, payload in enumerate(items):
+        serializer = ItineraryGenerationRequestSerializer(data=payload)
+        if serializer.is_valid():
+            rows.append(GenerationBatchItem(
+                batch=batch, index=index, request_key=request_key(serializer), payload=serializer.data
+            ))
+        else:
+            rows.append(GenerationBatchItem(
+                batch=batch, index=index, request_key='', payload=payload if isinstance(payload, dict) else {},
+                status='failed', error=serializer.errors
+            ))
+    GenerationBatchItem.objects.bulk_create(rows)
+    return batch
+
+
+def item_result(item, itinerary=None):
+    """NDJSON line describing one item's outcome"""
+    result = {'type': 'item', 'index': item.index, 'status': item.status}
+    if item.status == 'pending' and item.claimed_by:
+        result['in_progress'] = True
+    if item.status == 'succeeded':
+        result['itinerary_id'] = item.itinerary_id
+        if itinerary is not None:
+            result['itinerary'] = ItinerarySerializer(itinerary).data
+    elif item.status == 'failed':
+        result['error'] = item.error
+    return result
+
+
+def batch_summary(batch):
+    counts = {'pending': 0, 'succeeded': 0, 'failed': 0}
+    for status in batch.items.values_list('status', flat=True):
+        counts[status] += 1
+    return {'type': 'summary', 'batch_id': batch.batch_id, 'status': batch.status, **counts}
+
+
+class BulkGenerator:
+    """Runs the pending items of a batch and yields NDJSON result lines"""
+
+    def __init__(self, batch, workers=None, insert_chunk=None):
+        self.batch = batch
+        self.workers = workers or getattr(settings, 'BULK_GENERATION_WORKERS', 4)
+        self.insert_chunk = insert_chunk or getattr(settings, 'BULK_GENERATION_INSERT_CHUNK', 25)
+        self.claim_ttl = getattr(settings, 'BULK_GENERATION_CLAIM_TTL', 600)
+        self.token = uuid.uuid4().hex
+
+    def stream(self):
+        for line in self.run():
+            yield json.dumps(line, default=str) + "\n"
+
+    def run(self):
+        claimed = self._claim()
+        items = list(self.batch.items.all())
+        pending, elsewhere = {}, []
+        for item in items:
+            if item.pk in claimed:
+                pending.setdefault(item.request_key, []).append(item)
+            elif item.status == 'pending' or (item.status == 'failed' and item.request_key):
+                elsewhere.append(item)
+
+        yield {
+            'type': 'batch',
+            'batch_id': self.batch.batch_id,
+            'total': len(items),
+            'pending': sum(len(group) for group in pending.values()),
+            'in_progress': len(elsewhere),
+            'unique_requests': len(pending),
+        }
+
+        # Results from an earlier run of this batch are replayed as-is
+        for item in items:
+            if item.status == 'succeeded' or (item.status == 'failed' and not item.request_key):
+                yield item_result(item)
+        for item in elsewhere:
+            yield item_result(item)
+
+        if pending:
+            yield from self._generate(pending)
+
+        if self.batch.items.filter(status='pending').exists():
+            # Another run may finish the batch meanwhile; the condition is
+            # checked in the UPDATE itself so its final status is not overwritten
+            GenerationBatch.objects.filter(pk=self.batch.pk, items__status='pending') \
+                .update(status='running', updated_at=timezone.now())
+            self.batch.refresh_from_db(fields=['status', 'updated_at'])
+        else:
+            self.batch.status = 'partial' if self.batch.items.filter(status='failed').exists() else 'completed'
+            self.batch.save(update_fields=['status', 'updated_at'])
+        yield batch_summary(self.batch)
+
+    def _claim(self):
+        """Take the unfinished items no other live run holds; returns their pks"""
+        now = timezone.now()
+        unfinished = Q(status='pending') | (Q(status='failed') & ~Q(request_key=''))
+        free = Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - timedelta(seconds=self.claim_ttl))
+        # One conditional UPDATE, so of two concurrent runs each item goes to exactly one
+        self.batch.items.filter(unfinished & free).update(claimed_by=self.token, claimed_at=now)
+        return set(self.batch.items.filter(claimed_by=self.token).values_list('pk', flat=True))
+
+    def _generate(self, pending):
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        futures = {
+            pool.submit(contextvars.copy_context().run, _generate_one, group[0].payload): key
+            for key, group in pending.items()
+        }
+        ready = []  # Completed but not stored yet
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ready.append((pending[futures.pop(future)], future))
+                # Insert whatever has completed together, in bounded chunks
+                while ready:
+                    chunk, ready = ready[:self.insert_chunk], ready[self.insert_chunk:]
+                    yield from self._store(chunk)
+        finally:
+            # Reached early when the client disconnects: requests that have not
+            # started are dropped (their items stay pending for a resume), and
+            # those already running are stored so a resume does not pay again
+            pool.shutdown(wait=True, cancel_futures=True)
+            ready += [(pending[key], future) for future, key in futures.items() if not future.cancelled()]
+            for start in range(0, len(ready), self.insert_chunk):
+                for _ in self._store(ready[start:start + self.insert_chunk]):
+                    pass
+            # Whatever was not generated is free for the next resume straight away
+            GenerationBatchItem.objects.filter(batch=self.batch, claimed_by=self.token) \
+                .update(claimed_by='', claimed_at=None)
+
+    def _store(self, finished):
+        """Insert itineraries for completed requests and record item outcomes"""
+        new_itineraries, succeeded, failed = [], [], []
+        for group, future in finished:
+            try:
+                itinerary_json = future.result()
+            except Exception as e:
+                for item in group:
+                    item.status, item.error = 'failed', {'generation': [str(e)]}
+                    item.claimed_by, item.claimed_at = '', None
+                    failed.append(item)
+                continue
+            for item in group:
+                serializer = ItineraryGenerationRequestSerializer(data=item.payload)
+                serializer.is_valid(raise_exception=True)
+                new_itineraries.append(build_itinerary(serializer.validated_data, itinerary_json))
+                succeeded.append(item)
+
+        with metrics.span('db.itinerary_bulk_insert'):
+            created = Itinerary.objects.bulk_create(new_itineraries)
+            for item, itinerary in zip(succeeded, created):
+                item.status, item.itinerary, item.error = 'succeeded', itinerary, None
+                item.claimed_by, item.claimed_at = '', None
+            GenerationBatchItem.objects.bulk_update(
+                succeeded + failed, ['status', 'itinerary', 'error', 'claimed_by', 'claimed_at']
+            )
+        if created:
+            itineraries_bulk_created.send(sender=Itinerary, itineraries=created)
+
+        for item, itinerary in zip(succeeded, created):
+            yield item_result(item, itinerary)
+        for item in failed:
+            yield item_result(item)
+
+
+def build_itinerary(request_data, itinerary_json):
+    """Unsaved Itinerary row for a validated generation request"""
+    return Itinerary(
+        title=f"{request_data['destination']} Trip",
+        destination=request_data['destination'],
+        start_date=request_data['start_date'],
+        end_date=request_data['end_date'],
+        budget=request_data['budget'],
+        interests=request_data.get('interests', []),
+        constraints=request_data.get('constraints', {}),
+        itinerary_data=itinerary_json
+    )
+
+
+def _generate_one(payload):
+    serializer = ItineraryGenerationRequestSerializer(data=payload)
+    serializer.is_valid(raise_exception=True)
+    try:
+        return get_plan_engine().generate_itinerary(serializer.validated_data)
+    finally:
+        # Worker threads must not hold on to database connections
+        connections.close_all()
@@ -0,0 +1,325 @@
+"""
+Server-side clustering of itinerary map points
+
+Every located activity and map point of an active itinerary is stored as a
+MapPoint, and counted in a pyramid of MapCell aggregates: one grid per zoom
+level, where a cell is a Web Mercator tile cut four by four (64 px square
+on screen). A viewport query reads only the cells of its zoom level that
+overlap the bounding box, so its cost and response size depend on the
+viewport, not on how many itineraries there are. Cells holding a single
+point are returned as that point.
+
+Once a transaction that saved or deleted an itinerary commits, the
+itinerary's points are replaced from the committed row and only the
+difference is applied to the pyramid, as count and coordinate-sum
+increments. Each update is a short transaction of its own, with cells
+written in a fixed order, so itinerary saves never wait on the busy
+low-zoom cells and two updates cannot deadlock. Lock errors are retried.
+An update that still fails marks its itinerary in MapRepair; it is
+repaired after this process's next successful update or by
+rebuild_map_pyramid --repair. Plain rebuild_map_pyramid recomputes both
+tables from scratch.
+"""
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.db.models import Q
+from trip_mate import metrics
+from .fanout import dedupe_map_points, has_coordinates
+from .models import Itinerary, MapCell, MapPoint, MapRepair
+
+logger = logging.getLogger(__name__)
+
+MAP_UPDATES = metrics.registry.counter(
+    'tripmate_map_pyramid_updates_total', 'Map pyramid updates after itinerary writes, by outcome', ['outcome'])
+
+MAX_ZOOM = 16     # Deepest clustered zoom level; deeper viewports use its cells
+CELL_SHIFT = 2    # Cells are tiles of zoom + 2, four by four per tile
+FINEST = MAX_ZOOM + CELL_SHIFT
+MAX_LAT = 85.05112878
+BATCH = 100
+RETRIES = 4
+RETRY_DELAY = 0.05  # Seconds, doubled after each lock error
+
+
+def cell(lat, lng, level=FINEST):
+    """Web Mercator tile (x, y) containing a position at a tile zoom level"""
+    n = 1 << level
+    lat = min(max(lat, -MAX_LAT), MAX_LAT)
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def itinerary_points(itinerary):
+    """(name, day, lat, lng) of located activities, then of map points they do not repeat"""
+    if not itinerary.is_active:
+        return []
+    data = itinerary.itinerary_data if isinstance(itinerary.itinerary_data, dict) else {}
+    points = []
+    for day in data.get('days') or []:
+        if not isinstance(day, dict):
+            continue
+        for activity in day.get('schedule') or []:
+            if isinstance(activity, dict) and has_coordinates(activity.get('location')):
+                points.append({
+                    'name': activity.get('activity', ''),
+                    'day': day.get('day') if isinstance(day.get('day'), int) else None,
+                    **activity['location'],
+                })
+    # Deduplication keeps the first of points at the same place, so activities win
+    days = {(round(p['lat'], 3), round(p['lng'], 3)): p['day'] for p in points}
+    extra = [p for p in data.get('map_points') or [] if isinstance(p, dict)]
+    return [
+        (str(p['name'])[:255], days.get((round(p['lat'], 3), round(p['lng'], 3))), float(p['lat']), float(p['lng']))
+        for p in dedupe_map_points(points + extra)
+    ]
+
+
+class MapPyramid:
+    """Keeps MapPoint rows and MapCell aggregates in step with itineraries"""
+
+    def sync(self, itinerary_id):
+        """Match an itinerary's points to its committed row; returns False when nothing moved"""
+        itinerary = Itinerary.objects.filter(pk=itinerary_id).first()
+        if itinerary is None:
+            return self.remove(itinerary_id)
+        return self.update(itinerary)
+
+    def repair(self):
+        """Re-sync every itinerary marked after a failed update; returns how many were repaired"""
+        repaired = 0
+        for itinerary_id in MapRepair.objects.values_list('itinerary_id', flat=True):
+            self.sync(itinerary_id)
+            MapRepair.objects.filter(itinerary_id=itinerary_id).delete()
+            repaired += 1
+        return repaired
+
+    def update(self, itinerary):
+        """Replace an itinerary's points; returns False when nothing moved"""
+        new = itinerary_points(itinerary)
+        current = MapPoint.objects.filter(itinerary_id=itinerary.pk).values_list('name', 'day', 'lat', 'lng')
+        if sorted(new, key=repr) == sorted(current, key=repr):
+            return False
+        with transaction.atomic():
+            old = self._take_points(itinerary.pk)
+            MapPoint.objects.bulk_create([
+                MapPoint(itinerary_id=itinerary.pk, name=name, day=day, lat=lat, lng=lng, x=x, y=y)
+                for name, day, lat, lng in new
+                for x, y in [cell(lat, lng)]
+            ])
+            deltas = _contributions(new)
+            for key, (count, lat_sum, lng_sum) in _contributions(old).items():
+                delta = deltas.setdefault(key, [0, 0.0, 0.0])
+                delta[0] -= count
+                delta[1] -= lat_sum
+                delta[2] -= lng_sum
+            self._apply(deltas)
+        return True
+
+    def remove(self, itinerary_id):
+        with transaction.atomic():
+            old = self._take_points(itinerary_id)
+            if not old:
+                return False
+            self._apply({key: [-count, -lat_sum, -lng_sum] for key, (count, lat_sum, lng_sum)
+                         in _contributions(old).items()})
+        return True
+
+    def _take_points(self, itinerary_id):
+        """Delete an itinerary's points, returning them
+
+        Opening the transaction with a write makes SQLite wait for the write
+        lock, where a read first would fail at once on the lock upgrade.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {MapPoint._meta.db_table} WHERE itinerary_id = %s RETURNING name, day, lat, lng",
+                [itinerary_id]
+            )
+            return cursor.fetchall()
+
+    def rebuild(self):
+        """Recompute every point and cell from the active itineraries"""
+        totals = {}
+        points = 0
+        with transaction.atomic():
+            MapPoint.objects.all().delete()
+            MapCell.objects.all().delete()
+            MapRepair.objects.all().delete()
+            batch = []
+            for itinerary in Itinerary.objects.filter(is_active=True).order_by('pk').iterator(chunk_size=500):
+                located = itinerary_points(itinerary)
+                for key, (count, lat_sum, lng_sum) in _contributions(located).items():
+                    total = totals.setdefault(key, [0, 0.0, 0.0])
+                    total[0] += count
+                    total[1] += lat_sum
+                    total[2] += lng_sum
+                batch.extend(
+                    MapPoint(itinerary_id=itinerary.pk, name=name, day=day, lat=lat, lng=lng, x=x, y=y)
+                    for name, day, lat, lng in located
+                    for x, y in [cell(lat, lng)]
+                )
+                if len(batch) >= 2000:
+                    points += len(MapPoint.objects.bulk_create(batch))
+                    batch = []
+            points += len(MapPoint.objects.bulk_create(batch))
+            MapCell.objects.bulk_create([
+                MapCell(zoom=zoom, x=x, y=y, count=count, lat_sum=lat_sum, lng_sum=lng_sum)
+                for (zoom, x, y), (count, lat_sum, lng_sum) in totals.items()
+            ], batch_size=2000)
+        return {'points': points, 'cells': len(totals)}
+
+    def query(self, west, south, east, north, zoom):
+        """Clusters and single points inside a bounding box at a zoom level
+
+        Raises ValueError when the box covers more cells than
+        MAP_VIEWPORT_MAX_CELLS at that zoom.
+        """
+        zoom = min(max(int(zoom), 0), MAX_ZOOM)
+        level = zoom + CELL_SHIFT
+        x0, y0 = cell(north, west, level)
+        x1, y1 = cell(south, east, level)
+        # A box crossing the antimeridian has west > east
+        x_ranges = [(x0, x1)] if west <= east else [(x0, (1 << level) - 1), (0, x1)]
+        cells = sum(high - low + 1 for low, high in x_ranges) * (y1 - y0 + 1)
+        if cells > getattr(settings, 'MAP_VIEWPORT_MAX_CELLS', 4096):
+            raise ValueError(f"The bounding box covers {cells} cells at zoom {zoom}; zoom in or shrink it")
+
+        in_box = Q()
+        for low, high in x_ranges:
+            in_box |= Q(x__range=(low, high))
+        with metrics.span('db.map_cells'):
+            rows = list(MapCell.objects.filter(in_box, zoom=zoom, y__range=(y0, y1), count__gt=0)
+                        .values_list('x', 'y', 'count', 'lat_sum', 'lng_sum'))
+
+        clusters = []
+        singles = []
+        for x, y, count, lat_sum, lng_sum in rows:
+            if count == 1:
+                singles.append((x, y))
+            else:
+                clusters.append({
+                    'lat': round(lat_sum / count, 6),
+                    'lng': round(lng_sum / count, 6),
+                    'count': count,
+                    'cell': f"{zoom}/{x}/{y}",
+                })
+        return {'zoom': zoom, 'clusters': clusters, 'points': self._points_in(singles, FINEST - level)}
+
+    def _points_in(self, cells, shift):
+        points = []
+        for start in range(0, len(cells), BATCH):
+            in_cells = Q()
+            for x, y in cells[start:start + BATCH]:
+                in_cells |= Q(x__range=(x << shift, ((x + 1) << shift) - 1),
+                              y__range=(y << shift, ((y + 1) << shift) - 1))
+            with metrics.span('db.map_points'):
+                points.extend(MapPoint.objects.filter(in_cells).values('itinerary_id', 'name', 'day', 'lat', 'lng'))
+        return points
+
+    def _apply(self, deltas):
+        """Add count and coordinate-sum deltas to their cells, dropping emptied ones"""
+        # Sorted, so concurrent updates lock shared cells in the same order
+        rows = sorted((zoom, x, y, *delta) for (zoom, x, y), delta in deltas.items() if any(delta))
+        table = MapCell._meta.db_table
+        with connection.cursor() as cursor:
+            # Increments rather than writes, so concurrent updates of a cell add up
+            cursor.executemany(
+                f"INSERT INTO {table} (zoom, x, y, count, lat_sum, lng_sum) VALUES (%s, %s, %s, %s, %s, %s) "
+                f"ON CONFLICT (zoom, x, y) DO UPDATE SET count = {table}.count + excluded.count, "
+                f"lat_sum = {table}.lat_sum + excluded.lat_sum, lng_sum = {table}.lng_sum + excluded.lng_sum",
+                rows
+            )
+            cursor.executemany(
+                f"DELETE FROM {table} WHERE zoom = %s AND x = %s AND y = %s AND count <= 0",
+                [row[:3] for row in rows if row[3] < 0]
+            )
+
+
+def _contributions(points):
+    """{(zoom, x, y): [count, lat sum, lng sum]} of points on every pyramid level"""
+    totals = {}
+    for _, _, lat, lng in points:
+        x, y = cell(lat, lng)
+        for zoom in range(MAX_ZOOM + 1):
+            shift = MAX_ZOOM - zoom
+            total = totals.setdefault((zoom, x >> shift, y >> shift), [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += lat
+            total[2] += lng
+    return totals
+
+
+_pending = set()  # Itineraries whose update failed in this process
+_pending_lock = threading.Lock()
+
+
+def sync(itinerary_id):
+    """Update the pyramid for one itinerary, retrying lock errors
+
+    Returns False after marking the itinerary for repair. Like search
+    indexing, a pyramid update never fails the write it follows.
+    """
+    for attempt in range(RETRIES):
+        try:
+            MapPyramid().sync(itinerary_id)
+            return True
+        except OperationalError as e:
+            # SQLite refuses to upgrade a read lock while another writer is active
+            error = e
+            if attempt + 1 == RETRIES:
+                break
+            MAP_UPDATES.inc(outcome='retried')
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+        except DatabaseError as e:
+            error = e
+            break
+    logger.error("Map pyramid update of itinerary %s failed; marked for repair", itinerary_id, exc_info=error)
+    MAP_UPDATES.inc(outcome='failed')
+    with _pending_lock:
+        _pending.add(itinerary_id)
+    try:
+        MapRepair.objects.get_or_create(itinerary_id=itinerary_id)
+    except DatabaseError:
+        logger.warning("Could not record map repair of itinerary %s", itinerary_id)
+    return False
+
+
+def _after_commit(itinerary_id):
+    if not sync(itinerary_id):
+        return
+    MAP_UPDATES.inc(outcome='applied')
+    with _pending_lock:
+        pending = list(_pending)
+        _pending.clear()
+    for failed_id in pending:
+        if sync(failed_id):
+            MAP_UPDATES.inc(outcome='repaired')
+            try:
+                MapRepair.objects.filter(itinerary_id=failed_id).delete()
+            except DatabaseError:
+                pass
+
+
+def schedule(itinerary_id):
+    """Update the pyramid once the current transaction commits (at once outside one)"""
+    transaction.on_commit(lambda: _after_commit(itinerary_id))
+
+
+def itinerary_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule(instance.pk)
+
+
+def itineraries_bulk_created(sender, itineraries, **kwargs):
+    for itinerary in itineraries:
+        schedule(itinerary.pk)
+
+
+def itinerary_deleted(sender, instance, **kwargs):
+    # Points are not cascaded, so the update after commit can subtract them
+    schedule(instance.pk)
@@ -0,0 +1,186 @@
+"""
+Parallel fan-out generation for long trips
+
+A single completion for a 10-14 day trip runs into max_tokens and its latency
+grows with every day. The fan-out planner first asks for a lightweight
+skeleton (day themes, neighbourhoods and a budget split), then plans every
+day concurrently with bounded parallelism and merges the results into the
+standard itinerary schema. Wall-clock time stays close to that of one day.
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from django.conf import settings
+from trip_mate import metrics
+from . import prompts
+from .parsing import is_complete_activity, parse_json, record_outcome, schedule_cost
+
+
+class FanOutPlanner:
+    """Skeleton-first itinerary generation with concurrent day planning"""
+
+    def __init__(self, router, fallback_days):
+        self.router = router
+        # Callable returning template days when a day cannot be generated
+        self.fallback_days = fallback_days
+        self.max_parallel = getattr(settings, 'FANOUT_MAX_PARALLEL', 8)
+
+    def generate(self, destination, start_date, end_date, budget, interests_str, constraints_str, duration):
+        start = datetime.strptime(str(start_date), '%Y-%m-%d')
+        skeleton = self._generate_skeleton(
+            destination, start_date, end_date, budget, interests_str, constraints_str, duration
+        )
+
+        themes = "; ".join(f"Day {d['day']}: {d['theme']}" for d in skeleton['days'])
+        jobs = [
+            (day, (start + timedelta(days=day['day'] - 1)).strftime('%Y-%m-%d'))
+            for day in skeleton['days']
+        ]
+
+        # Each worker runs in a copy of the caller's context so spans and
+        # token counts are attributed to the request's endpoint.
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(jobs))) as pool:
+            futures = [
+                pool.submit(
+                    contextvars.copy_context().run, self._generate_day,
+                    destination, day, date, interests_str, constraints_str, themes
+                )
+                for day, date in jobs
+            ]
+            schedules = [future.result() for future in futures]
+
+        return self._merge(destination, start_date, end_date, budget, duration, skeleton, jobs, schedules)
+
+    def _generate_skeleton(self, destination, start_date, end_date, budget, interests_str, constraints_str, duration):
+        """Ask for day themes and a budget split; fall back to a local skeleton"""
+        prompt = prompts.SKELETON.render(
+            duration=duration, destination=destination, start_date=start_date, end_date=end_date,
+            budget=budget, interests=interests_str, constraints=constraints_str
+        )
+
+        daily_budget = round(budget / duration, 2)
+        skeleton_days = {}
+        summary, warnings = f"{duration}-day trip to {destination}", []
+        try:
+            response = self.router.complete(
+                'skeleton',
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=150 + 40 * duration,
+                json_response=True
+            )
+            with metrics.span('json.parse'):
+                data = parse_json(response.choices[0].message.content or '').data
+            summary = data.get('trip_summary') or summary
+            warnings = [w for w in data.get('warnings') or [] if isinstance(w, str)]
+            for day in data.get('days') or []:
+                if isinstance(day, dict) and isinstance(day.get('day'), int) and 1 <= day['day'] <= duration:
+                    skeleton_days.setdefault(day['day'], day)
+            record_outcome('skeleton', 'clean')
+        except Exception:
+            record_outcome('skeleton', 'failed')
+
+        days = []
+        for number in range(1, duration + 1):
+            day = skeleton_days.get(number, {})
+            day_budget = day.get('budget')
+            days.append({
+                'day': number,
+                'theme': day.get('theme') or f"Explore {destination}",
+                'neighbourhood': day.get('neighbourhood') or '',
+                'budget': day_budget if isinstance(day_budget, (int, float)) and day_budget > 0 else daily_budget,
+            })
+        return {'trip_summary': summary, 'days': days, 'warnings': warnings}
+
+    def _generate_day(self, destination, day, date, interests_str, constraints_str, themes):
+        """Plan one day's schedule; returns (schedule, map_points) or None"""
+        neighbourhood = f" around {day['neighbourhood']}" if day['neighbourhood'] else ''
+        prompt = prompts.DAY_PLAN.render(
+            day=day['day'], date=date, destination=destination, neighbourhood=neighbourhood,
+            theme=day['theme'], day_budget=day['budget'], interests=interests_str,
+            constraints=constraints_str, themes=themes
+        )
+
+        try:
+            response = self.router.complete(
+                'day_plan',
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=600,
+                json_response=True
+            )
+            with metrics.span('json.parse'):
+                result = parse_json(response.choices[0].message.content or '')
+            data = result.data if isinstance(result.data, dict) else {}
+            schedule = [a for a in data.get('schedule') or [] if is_complete_activity(a)]
+            if not schedule:
+                raise ValueError("Day plan has no complete activities")
+        except Exception:
+            record_outcome('day_plan', 'failed')
+            return None
+
+        record_outcome('day_plan', 'repaired' if result.repaired else 'clean')
+        return schedule, [p for p in data.get('map_points') or [] if isinstance(p, dict)]
+
+    def _merge(self, destination, start_date, end_date, budget, duration, skeleton, jobs, schedules):
+        """Assemble day plans into the standard schema"""
+        days, map_points, failed = [], [], []
+        for (day, date), planned in zip(jobs, schedules):
+            if planned is None:
+                failed.append(day['day'])
+                continue
+            schedule, points = planned
+            days.append({'day': day['day'], 'date': date, 'theme': day['theme'], 'schedule': schedule})
+            map_points.extend(points)
+            map_points.extend(
+                {'name': a['activity'], 'lat': a['location']['lat'], 'lng': a['location']['lng']}
+                for a in schedule if has_coordinates(a.get('location'))
+            )
+
+        warnings = list(skeleton['warnings'])
+        if failed:
+            template_days = self.fallback_days(destination, start_date, end_date, budget, duration)
+            days.extend(day for day in template_days if day['day'] in failed)
+            days.sort(key=lambda day: day['day'])
+            warnings.append(
+                f"Days {', '.join(map(str, failed))} use a template schedule. Please customize them."
+            )
+
+        total_cost = schedule_cost(days)
+        if total_cost > budget:
+            warnings.append(f"Estimated cost ${total_cost} exceeds the budget of ${budget}.")
+
+        return {
+            'trip_summary': skeleton['trip_summary'],
+            'days': days,
+            'total_estimated_cost': total_cost,
+            'map_points': dedupe_map_points(map_points),
+            'adjustment_reasons': [],
+            'booking_links': [],
+            'warnings': warnings,
+        }
+
+
+def has_coordinates(location):
+    return (
+        isinstance(location, dict)
+        and isinstance(location.get('lat'), (int, float))
+        and isinstance(location.get('lng'), (int, float))
+        and (location['lat'], location['lng']) != (0, 0)
+    )
+
+
+def dedupe_map_points(points):
+    """Drop map points repeating a name or (to ~100 m) a position already listed"""
+    seen_names, seen_positions, unique = set(), set(), []
+    for point in points:
+        if not has_coordinates(point):
+            continue
+        name = str(point.get('name', '')).strip().lower()
+        position = (round(point['lat'], 3), round(point['lng'], 3))
+        if (name and name in seen_names) or position in seen_positions:
+            continue
+        seen_names.add(name)
+        seen_positions.add(position)
+        unique.append({'name': point.get('name', ''), 'lat': point['lat'], 'lng': point['lng']})
+    return unique
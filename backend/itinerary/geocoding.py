@@ -0,0 +1,256 @@
+"""
+Geocoding of activity locations
+
+Activities often come back from the model (and always from the template
+fallback) with {"lat": 0.0, "lng": 0.0}. After generation and after chat
+edits, every activity without real coordinates is geocoded: place names are
+deduplicated across the itinerary, looked up in an in-process LRU, then in
+the GeocodedPlace table, and only the remaining misses go to the provider in
+batches. Results are stored, so a popular POI is resolved once for every
+user; misses are stored too, but asked again after GEOCODING_MISS_TTL
+seconds in case they came from a bad spell at the provider.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from trip_mate import metrics
+from .fanout import dedupe_map_points, has_coordinates
+from .models import GeocodedPlace
+
+
+PROVIDER_LOOKUPS = metrics.registry.counter(
+    'tripmate_geocoding_provider_lookups_total', 'Place names sent to the geocoding provider', ['provider'])
+
+LEADING_VERBS = re.compile(r'^(visit|explore|see|tour|tour of|walk through|lunch at|dinner at|breakfast at)\s+', re.I)
+DAY_SUFFIX = re.compile(r'\s*-\s*day\s*\d+$', re.I)
+
+
+class LocalGeocodingProvider:
+    """Deterministic stand-in for tests and benchmarks
+
+    Places land within a few kilometres of a stable point derived from the
+    destination (the text after the last comma of the query).
+    """
+
+    name = 'local'
+
+    def geocode(self, queries):
+        results = {}
+        for query in queries:
+            destination = query.rsplit(',', 1)[-1].strip()
+            centre = _digest(destination)
+            offset = _digest(query)
+            results[query] = {
+                'name': query,
+                'lat': round(-50 + (centre % 10000) / 100 + (offset % 1000 - 500) / 10000, 6),
+                'lng': round(-170 + (centre // 10000 % 34000) / 100 + (offset // 1000 % 1000 - 500) / 10000, 6),
+            }
+        return results
+
+
+class MapboxGeocodingProvider:
+    """Mapbox batch forward geocoding"""
+
+    name = 'mapbox'
+    url = 'https://api.mapbox.com/search/geocode/v6/batch'
+
+    def __init__(self, access_token, timeout=10):
+        self.access_token = access_token
+        self.timeout = timeout
+
+    def geocode(self, queries):
+        import requests
+
+        response = requests.post(
+            self.url,
+            params={'access_token': self.access_token},
+            json=[{'q': query, 'limit': 1} for query in queries],
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+        results = {}
+        for query, result in zip(queries, response.json().get('batch', [])):
+            features = result.get('features') or []
+            if not features:
+                continue
+            lng, lat = features[0]['geometry']['coordinates'][:2]
+            name = features[0].get('properties', {}).get('full_address') or query
+            results[query] = {'name': name, 'lat': lat, 'lng': lng}
+        return results
+
+
+class Geocoder:
+    """LRU in front of the GeocodedPlace table in front of a batch provider"""
+
+    def __init__(self, provider, lru_size=None, batch_size=None):
+        self.provider = provider
+        self.lru_size = lru_size or getattr(settings, 'GEOCODING_LRU_SIZE', 4096)
+        self.batch_size = batch_size or getattr(settings, 'GEOCODING_BATCH_SIZE', 50)
+        self.miss_ttl = getattr(settings, 'GEOCODING_MISS_TTL', 7 * 24 * 60 * 60)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def geocode(self, queries):
+        """Return {query: {'name', 'lat', 'lng'} or None} for normalized queries"""
+        results, misses = {}, []
+        with self._lock:
+            for query in dict.fromkeys(queries):
+                if query in self._lru:
+                    self._lru.move_to_end(query)
+                    results[query] = self._lru[query]
+                else:
+                    misses.append(query)
+        for query in results:
+            metrics.record_cache('geocoding_lru', True)
+
+        if misses:
+            retry_before = timezone.now() - timedelta(seconds=self.miss_ttl)
+            with metrics.span('db.geocode_lookup'):
+                stored = {
+                    place.query: place for place in GeocodedPlace.objects.filter(query__in=misses)
+                    if place.lat is not None or place.looked_up_at >= retry_before
+                }
+            for query in misses:
+                metrics.record_cache('geocoding_db', query in stored)
+            found = {query: _place_result(place) for query, place in stored.items()}
+            remaining = [query for query in misses if query not in stored]
+            if remaining:
+                found.update(self._lookup(remaining))
+            self._remember(found)
+            results.update(found)
+        return results
+
+    def _lookup(self, queries):
+        """Resolve queries with the provider in batches and store every outcome"""
+        found = {}
+        for start in range(0, len(queries), self.batch_size):
+            batch = queries[start:start + self.batch_size]
+            PROVIDER_LOOKUPS.inc(len(batch), provider=self.provider.name)
+            try:
+                with metrics.span('geocoding.provider'):
+                    located = self.provider.geocode(batch)
+            except Exception:
+                # Provider outages are not cached; the next request tries again
+                continue
+            rows = []
+            for query in batch:
+                place = located.get(query)
+                rows.append(GeocodedPlace(
+                    query=query,
+                    name=(place or {}).get('name', '')[:255],
+                    lat=place['lat'] if place else None,
+                    lng=place['lng'] if place else None,
+                    provider=self.provider.name
+                ))
+                found[query] = _place_result(rows[-1])
+            with metrics.span('db.geocode_insert'):
+                # Replaces expired misses; another process may have stored a query meanwhile
+                GeocodedPlace.objects.bulk_create(
+                    rows, update_conflicts=True, unique_fields=['query'],
+                    update_fields=['name', 'lat', 'lng', 'provider', 'looked_up_at']
+                )
+        return found
+
+    def _remember(self, found):
+        with self._lock:
+            for query, result in found.items():
+                if result is None:
+                    # Misses expire, which only the table keeps track of
+                    continue
+                self._lru[query] = result
+                self._lru.move_to_end(query)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+
+def place_query(activity_name, destination):
+    """Normalized lookup key for an activity, scoped to the destination"""
+    name = DAY_SUFFIX.sub('', LEADING_VERBS.sub('', ' '.join(str(activity_name).split())))
+    destination = ' '.join(destination.split())
+    if name.lower() != destination.lower():
+        name = f"{name}, {destination}"
+    return name.lower()[:255]
+
+
+def apply_locations(itinerary, destination, geocoder, previous=None):
+    """Fill missing activity coordinates and rebuild map_points
+
+    Activity pins are rebuilt from the current schedule. Other map points
+    (hotels, landmarks) are kept unless they stand for an activity of the
+    schedule now or of ``previous``, the itinerary before an edit, so pins
+    of removed or moved activities go. With no geocoder only the pins are
+    rebuilt.
+    """
+    pending = {}
+    for day in itinerary.get('days', []):
+        for activity in day.get('schedule', []):
+            if isinstance(activity, dict) and activity.get('activity') and not has_coordinates(activity.get('location')):
+                pending.setdefault(place_query(activity['activity'], destination), []).append(activity)
+
+    if pending and geocoder is not None:
+        located = geocoder.geocode(list(pending))
+        for query, activities in pending.items():
+            place = located.get(query)
+            if place:
+                for activity in activities:
+                    activity['location'] = {'lat': place['lat'], 'lng': place['lng']}
+
+    names, positions = set(), set()
+    for activity in _activities(itinerary) + _activities(previous):
+        names.add(str(activity['activity']).strip().lower())
+        if has_coordinates(activity.get('location')):
+            positions.add((round(activity['location']['lat'], 3), round(activity['location']['lng'], 3)))
+    points = [
+        point for point in itinerary.get('map_points') or []
+        if isinstance(point, dict) and has_coordinates(point)
+        and str(point.get('name', '')).strip().lower() not in names
+        and (round(point['lat'], 3), round(point['lng'], 3)) not in positions
+    ]
+    points.extend(
+        {'name': a['activity'], 'lat': a['location']['lat'], 'lng': a['location']['lng']}
+        for a in _activities(itinerary) if has_coordinates(a.get('location'))
+    )
+    itinerary['map_points'] = dedupe_map_points(points)
+    return itinerary
+
+
+def _activities(itinerary):
+    if not isinstance(itinerary, dict):
+        return []
+    return [
+        activity for day in itinerary.get('days') or [] if isinstance(day, dict)
+        for activity in day.get('schedule') or [] if isinstance(activity, dict) and activity.get('activity')
+    ]
+
+
+def _place_result(place):
+    if place.lat is None or place.lng is None:
+        return None
+    return {'name': place.name, 'lat': place.lat, 'lng': place.lng}
+
+
+def _digest(text):
+    return int(hashlib.md5(text.lower().encode()).hexdigest(), 16)
+
+
+_geocoder = None
+
+
+def get_geocoder():
+    """Return the process-wide geocoder, or None when geocoding is disabled"""
+    global _geocoder
+    if _geocoder is None:
+        provider_name = getattr(settings, 'GEOCODING_PROVIDER', '')
+        if provider_name == 'local':
+            provider = LocalGeocodingProvider()
+        elif provider_name == 'mapbox' and settings.MAPBOX_API_KEY:
+            provider = MapboxGeocodingProvider(settings.MAPBOX_API_KEY)
+        else:
+            return None
+        _geocoder = Geocoder(provider)
+    return _geocoder
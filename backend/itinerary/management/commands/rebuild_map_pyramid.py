@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from itinerary.clustering import MapPyramid
+
+
+class Command(BaseCommand):
+    help = 'Recompute the map points and clustering pyramid of all active itineraries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Only re-sync itineraries marked after a failed pyramid update')
+
+    def handle(self, *args, **options):
+        if options['repair']:
+            repaired = MapPyramid().repair()
+            self.stdout.write(self.style.SUCCESS(f"Repaired the map points of {repaired} itineraries"))
+            return
+        counts = MapPyramid().rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Stored {counts['points']} map points in {counts['cells']} cells"))
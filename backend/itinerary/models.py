@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 import json
 
@@ -14,12 +15,22 @@ class Itinerary(models.Model):
     interests = models.JSONField(default=list)
     constraints = models.JSONField(default=dict)
     itinerary_data = models.JSONField(default=dict)  # Stores the full JSON structure
+    # Bumped on every change to itinerary_data; clients send it back to get patches
+    version = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Hot listing query only ever looks at active rows
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='itinerary_active_created'),
+            # Reuse index refresh picks up rows saved since its last pass
+            models.Index(fields=['updated_at'], name='itinerary_updated'),
+            # Retention job scan of soft-deleted rows
+            models.Index(fields=['updated_at'], condition=models.Q(is_active=False), name='itinerary_inactive_updated'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.destination}"
@@ -36,6 +47,121 @@ class ItineraryEdit(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='itineraryedit_created'),
+        ]
 
     def __str__(self):
         return f"Edit to {self.itinerary.title} - {self.edit_type}"
+
+
+class GenerationBatch(models.Model):
+    """A bulk generation request, resumable by its batch_id"""
+    STATUSES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('partial', 'Partially failed'),
+    ]
+
+    batch_id = models.CharField(max_length=100, unique=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default='running')
+    total_items = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Generation batch {self.batch_id}"
+
+
+class GenerationBatchItem(models.Model):
+    """One itinerary request within a generation batch"""
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    batch = models.ForeignKey(GenerationBatch, on_delete=models.CASCADE, related_name='items')
+    index = models.PositiveIntegerField()
+    request_key = models.CharField(max_length=64)  # Hash shared by identical requests
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUSES, default='pending')
+    itinerary = models.ForeignKey(Itinerary, on_delete=models.SET_NULL, null=True, blank=True)
+    error = models.JSONField(null=True, blank=True)
+    # The run generating this item, so a concurrent resume leaves it alone
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['index']
+        unique_together = [('batch', 'index')]
+
+    def __str__(self):
+        return f"Item {self.index} of {self.batch.batch_id}"
+
+
+class GeocodedPlace(models.Model):
+    """Persistent geocoding result for a normalized place query"""
+    query = models.CharField(max_length=255, unique=True)
+    name = models.CharField(max_length=255, blank=True)
+    lat = models.FloatField(null=True, blank=True)  # Null when the provider found nothing
+    lng = models.FloatField(null=True, blank=True)
+    provider = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Misses are asked again GEOCODING_MISS_TTL seconds after this
+    looked_up_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.query
+
+
+class MapPoint(models.Model):
+    """A located activity or map point of an active itinerary"""
+    # Not cascaded: the pyramid update that runs after a delete commits subtracts these points
+    itinerary = models.ForeignKey(
+        Itinerary, on_delete=models.DO_NOTHING, db_constraint=False, related_name='map_locations'
+    )
+    name = models.CharField(max_length=255, blank=True)
+    day = models.PositiveIntegerField(null=True, blank=True)  # Null for map points that are not activities
+    lat = models.FloatField()
+    lng = models.FloatField()
+    # Cell on the finest grid of the clustering pyramid
+    x = models.IntegerField()
+    y = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['x', 'y'], name='mappoint_cell'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class MapCell(models.Model):
+    """Number and coordinate sums of the map points in one cell of one zoom level"""
+    zoom = models.PositiveSmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    count = models.IntegerField(default=0)
+    lat_sum = models.FloatField(default=0.0)
+    lng_sum = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = [('zoom', 'x', 'y')]
+
+    def __str__(self):
+        return f"{self.zoom}/{self.x}/{self.y}"
+
+
+class MapRepair(models.Model):
+    """An itinerary whose map points may be out of date after a failed pyramid update"""
+    itinerary_id = models.BigIntegerField(unique=True)
+    failed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Itinerary {self.itinerary_id}"
@@ -0,0 +1,183 @@
+"""
+Tolerant parsing and validation of LLM JSON output
+
+Models wrap JSON in prose or code fences, leave trailing commas and get cut
+off at max_tokens. Rather than throwing the whole completion away, the
+parser repairs what it can, closes truncated containers at the last complete
+value, and the validator keeps every complete day so only the missing tail
+has to be requested again.
+"""
+import json
+from datetime import datetime, timedelta
+from trip_mate import metrics
+
+
+COMPLETIONS = metrics.registry.counter(
+    'tripmate_llm_completions_total', 'LLM completions by parse outcome', ['task', 'outcome'])
+WASTED_TOKENS = metrics.registry.counter(
+    'tripmate_llm_wasted_tokens_total', 'Completion tokens discarded because output was unusable', ['task'])
+
+ITINERARY_DEFAULTS = {
+    'trip_summary': '',
+    'days': [],
+    'total_estimated_cost': 0,
+    'map_points': [],
+    'adjustment_reasons': [],
+    'booking_links': [],
+    'warnings': [],
+}
+
+
+class ParseResult:
+    def __init__(self, data, repaired=False, truncated=False):
+        self.data = data
+        self.repaired = repaired
+        self.truncated = truncated
+
+
+def extract_json_text(content):
+    """Strip code fences and any prose before the first JSON container"""
+    if "```" in content:
+        fenced = content.split("```", 2)[1]
+        if fenced.startswith('json'):
+            fenced = fenced[4:]
+        if '{' in fenced or '[' in fenced:
+            content = fenced
+    starts = [i for i in (content.find('{'), content.find('[')) if i != -1]
+    return content[min(starts):] if starts else content
+
+
+def parse_json(content):
+    """Parse model output, repairing it if needed; raises ValueError if hopeless"""
+    text = extract_json_text(content.strip())
+    try:
+        data, end = json.JSONDecoder().raw_decode(text)
+        return ParseResult(data)
+    except ValueError:
+        pass
+
+    repaired, truncated = repair_json(text)
+    return ParseResult(json.loads(repaired), repaired=True, truncated=truncated)
+
+
+def repair_json(text):
+    """Remove trailing commas and close a truncated document
+
+    Returns (text, truncated). A truncated document is cut back to the last
+    point where every value was complete, then its open containers are closed.
+    """
+    out = []
+    stack = []
+    in_string = False
+    escaped = False
+    safe_point = None  # (output length, open containers) at the last clean boundary
+
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+            out.append(char)
+        elif char in '{[':
+            stack.append(char)
+            out.append(char)
+            safe_point = (len(out), list(stack))
+        elif char in '}]':
+            _strip_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(char)
+            safe_point = (len(out), list(stack))
+            if not stack:
+                return ''.join(out), False
+        elif char == ',':
+            safe_point = (len(out), list(stack))
+            out.append(char)
+        else:
+            out.append(char)
+
+    if not stack and not in_string:
+        return ''.join(out), False
+    if safe_point is None:
+        raise ValueError("No complete JSON value to salvage")
+
+    length, open_containers = safe_point
+    out = out[:length]
+    _strip_trailing_comma(out)
+    closers = ''.join('}' if c == '{' else ']' for c in reversed(open_containers))
+    return ''.join(out) + closers, True
+
+
+def _strip_trailing_comma(out):
+    while out and out[-1] in ' \t\r\n':
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+
+def record_outcome(task, outcome, response=None):
+    """Count a parse outcome, and the tokens thrown away when it failed"""
+    COMPLETIONS.inc(task=task, outcome=outcome)
+    if outcome == 'failed' and response is not None:
+        usage = getattr(response, 'usage', None)
+        WASTED_TOKENS.inc(getattr(usage, 'completion_tokens', 0) or 0, task=task)
+
+
+def is_complete_activity(activity):
+    return isinstance(activity, dict) and isinstance(activity.get('activity'), str) and activity['activity']
+
+
+def normalize_itinerary(data, start_date, duration, drop_last_day=False):
+    """Validate an itinerary against the schema, keeping only complete days
+
+    Returns (itinerary, missing_day_numbers). ``drop_last_day`` discards the
+    final day of a truncated completion, since its schedule may be cut short.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Itinerary must be a JSON object")
+
+    start = datetime.strptime(str(start_date), '%Y-%m-%d')
+    raw_days = [d for d in data.get('days') or [] if isinstance(d, dict)]
+    if drop_last_day and raw_days:
+        raw_days = raw_days[:-1]
+
+    days = {}
+    for position, day in enumerate(raw_days, start=1):
+        number = day.get('day', position)
+        if not isinstance(number, int) or not 1 <= number <= duration or number in days:
+            continue
+        schedule = [a for a in day.get('schedule') or [] if is_complete_activity(a)]
+        if not schedule:
+            continue
+        days[number] = {
+            **day,
+            'day': number,
+            'date': (start + timedelta(days=number - 1)).strftime('%Y-%m-%d'),
+            'schedule': schedule,
+        }
+
+    itinerary = {key: data.get(key, default) for key, default in ITINERARY_DEFAULTS.items()}
+    for key in ('map_points', 'adjustment_reasons', 'booking_links', 'warnings'):
+        if not isinstance(itinerary[key], list):
+            itinerary[key] = []
+    itinerary['days'] = [days[number] for number in sorted(days)]
+    missing = [number for number in range(1, duration + 1) if number not in days]
+    return itinerary, missing
+
+
+def schedule_cost(days):
+    total = 0
+    for day in days:
+        for activity in day.get('schedule', []):
+            cost = activity.get('cost_estimate', 0)
+            if isinstance(cost, (int, float)):
+                total += cost
+    return total
@@ -0,0 +1,129 @@
+"""
+RFC 6902 JSON Patch deltas between itinerary versions
+
+An edit usually touches one activity, yet responses used to carry the whole
+itinerary. Clients that send the version they hold get back a patch from
+that version to the new one instead. The diff is structural: dictionaries
+are compared key by key, and lists keep their common head and tail so that
+appending, inserting or removing one activity is a single operation.
+Only add, remove and replace operations are produced.
+"""
+import json
+
+
+def diff(old, new, path=''):
+    """Patch operations that turn ``old`` into ``new``"""
+    ops = []
+    _diff(old, new, path, ops)
+    return ops
+
+
+def apply_patch(document, ops):
+    """Apply add/remove/replace operations to a JSON document in place"""
+    for op in ops:
+        tokens = _parse_pointer(op['path'])
+        if not tokens:
+            if op['op'] in ('add', 'replace'):
+                document = op['value']
+                continue
+            raise ValueError("Cannot remove the document root")
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+        if isinstance(parent, list):
+            index = len(parent) if last == '-' else int(last)
+            if op['op'] == 'add':
+                parent.insert(index, op['value'])
+            elif op['op'] == 'remove':
+                del parent[index]
+            elif op['op'] == 'replace':
+                parent[index] = op['value']
+            else:
+                raise ValueError(f"Unsupported patch operation '{op['op']}'")
+        else:
+            if op['op'] in ('add', 'replace'):
+                if op['op'] == 'replace' and last not in parent:
+                    raise ValueError(f"No value at {op['path']}")
+                parent[last] = op['value']
+            elif op['op'] == 'remove':
+                del parent[last]
+            else:
+                raise ValueError(f"Unsupported patch operation '{op['op']}'")
+    return document
+
+
+def delta(old, new):
+    """Patch from ``old`` to ``new``, or None when the full document is smaller"""
+    ops = diff(old, new)
+    if len(_dumps(ops)) >= len(_dumps(new)):
+        return None
+    return ops
+
+
+def _diff(old, new, path, ops):
+    if _same(old, new):
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({'op': 'add', 'path': f"{path}/{_escape(key)}", 'value': value})
+            else:
+                _diff(old[key], value, f"{path}/{_escape(key)}", ops)
+    elif isinstance(old, list) and isinstance(new, list):
+        _diff_list(old, new, path, ops)
+    else:
+        ops.append({'op': 'replace', 'path': path, 'value': new})
+
+
+def _diff_list(old, new, path, ops):
+    # Common head and tail are left alone
+    head = 0
+    while head < len(old) and head < len(new) and _same(old[head], new[head]):
+        head += 1
+    tail = 0
+    while tail < len(old) - head and tail < len(new) - head and _same(old[-1 - tail], new[-1 - tail]):
+        tail += 1
+
+    old_middle = old[head:len(old) - tail]
+    new_middle = new[head:len(new) - tail]
+    shared = min(len(old_middle), len(new_middle))
+    for offset in range(shared):
+        _diff(old_middle[offset], new_middle[offset], f"{path}/{head + offset}", ops)
+    # Remove from the back so earlier indices stay valid
+    for offset in reversed(range(shared, len(old_middle))):
+        ops.append({'op': 'remove', 'path': f"{path}/{head + offset}"})
+    for offset in range(shared, len(new_middle)):
+        ops.append({'op': 'add', 'path': f"{path}/{head + offset}", 'value': new_middle[offset]})
+
+
+def _same(a, b):
+    if a != b:
+        return False
+    # Python equality treats True as 1; JSON does not (1 and 1.0 are the same number)
+    if type(a) is not type(b):
+        return not isinstance(a, (bool, dict, list)) and not isinstance(b, (bool, dict, list))
+    if isinstance(a, dict):
+        return all(_same(value, b[key]) for key, value in a.items())
+    if isinstance(a, list):
+        return all(map(_same, a, b))
+    return True
+
+
+def _escape(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _parse_pointer(pointer):
+    if not pointer:
+        return []
+    if not pointer.startswith('/'):
+        raise ValueError(f"Invalid JSON pointer '{pointer}'")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), default=str)
@@ -0,0 +1,166 @@
+"""
+Prompt templates for itinerary generation
+"""
+from trip_mate.prompts import PromptTemplate
+
+
+GENERATION = PromptTemplate("""
+    Generate a {duration}-day travel itinerary for {destination} starting {start_date} ending {end_date}.
+
+    Budget: ${budget}
+    Interests: {interests}
+    Constraints: {constraints}
+
+    Return ONLY valid JSON in this exact schema:
+    {{
+      "trip_summary": "2-line overview",
+      "days": [
+        {{
+          "day": 1,
+          "date": "YYYY-MM-DD",
+          "schedule": [
+            {{
+              "time": "09:00",
+              "activity": "Visit Louvre Museum",
+              "type": "cultural",
+              "duration": "3h",
+              "cost_estimate": 20,
+              "location": {{"lat": 48.8606, "lng": 2.3376}},
+              "notes": "Book skip-the-line tickets online."
+            }}
+          ]
+        }}
+      ],
+      "total_estimated_cost": 0,
+      "map_points": [
+        {{"name": "Louvre Museum", "lat": 48.8606, "lng": 2.3376}}
+      ],
+      "adjustment_reasons": [],
+      "booking_links": [],
+      "warnings": []
+    }}
+
+    Rules:
+    - Max 4-5 activities per day
+    - Include realistic costs
+    - Add GPS coordinates for major attractions
+    - Include practical notes
+    - Ensure total cost fits budget
+""")
+
+CONTINUATION = PromptTemplate("""
+    Continue a travel itinerary for {destination} from {start_date} to {end_date}.
+
+    Budget: ${budget}
+    Interests: {interests}
+    Already planned (do not repeat these): {planned}
+
+    Return ONLY valid JSON with the schedules for days {missing}:
+    {{
+      "days": [
+        {{
+          "day": {first_missing},
+          "schedule": [
+            {{
+              "time": "09:00",
+              "activity": "Activity name",
+              "type": "cultural",
+              "duration": "2h",
+              "cost_estimate": 20,
+              "location": {{"lat": 0.0, "lng": 0.0}},
+              "notes": "Practical notes"
+            }}
+          ]
+        }}
+      ]
+    }}
+
+    Rules:
+    - Max 4-5 activities per day
+    - Include realistic costs and GPS coordinates
+""")
+
+SKELETON = PromptTemplate("""
+    Outline a {duration}-day trip to {destination} from {start_date} to {end_date}.
+
+    Budget: ${budget}
+    Interests: {interests}
+    Constraints: {constraints}
+
+    Return ONLY valid JSON:
+    {{
+      "trip_summary": "2-line overview",
+      "days": [
+        {{"day": 1, "theme": "Old town and museums", "neighbourhood": "Centre", "budget": 120}}
+      ],
+      "warnings": []
+    }}
+
+    Rules:
+    - One entry per day, {duration} days in total
+    - Day budgets must add up to no more than the total budget
+    - Vary neighbourhoods to limit travel time
+""")
+
+DAY_PLAN = PromptTemplate("""
+    Plan day {day} ({date}) of a trip to {destination}{neighbourhood}.
+
+    Theme: {theme}
+    Day budget: ${day_budget}
+    Interests: {interests}
+    Constraints: {constraints}
+    Other days (avoid repeating them): {themes}
+
+    Return ONLY valid JSON:
+    {{
+      "schedule": [
+        {{
+          "time": "09:00",
+          "activity": "Visit Louvre Museum",
+          "type": "cultural",
+          "duration": "3h",
+          "cost_estimate": 20,
+          "location": {{"lat": 48.8606, "lng": 2.3376}},
+          "notes": "Book skip-the-line tickets online."
+        }}
+      ],
+      "map_points": [
+        {{"name": "Louvre Museum", "lat": 48.8606, "lng": 2.3376}}
+      ]
+    }}
+
+    Rules:
+    - Max 4-5 activities
+    - Include realistic costs within the day budget
+    - Add GPS coordinates and practical notes
+""")
+
+ADAPTATION = PromptTemplate("""
+    Adapt a travel itinerary for {destination}: {duration} days from {start_date}, budget ${budget}.
+
+    Interests: {interests}
+    Constraints: {constraints}
+
+    Current plan (day.index time activity [type, $cost]):
+    {plan}
+
+    Replace at most {max_changes} activities that do not fit the interests, constraints or budget; keep the rest.
+    Return ONLY valid JSON:
+    {{
+      "replace": [
+        {{
+          "day": 1,
+          "index": 0,
+          "activity": {{
+            "time": "09:00",
+            "activity": "Activity name",
+            "type": "cultural",
+            "duration": "2h",
+            "cost_estimate": 20,
+            "location": {{"lat": 0.0, "lng": 0.0}},
+            "notes": "Practical notes"
+          }}
+        }}
+      ]
+    }}
+""")
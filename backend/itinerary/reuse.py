@@ -0,0 +1,325 @@
+"""
+Similarity-based reuse of stored itineraries
+
+Requests rarely repeat exactly, but the Itinerary table already holds many
+good plans per popular destination. Every active itinerary that is still
+as it was generated (never edited through chat or the edit endpoint, and
+generated without user constraints) is indexed by its destination and a
+small feature set (interests, plus duration and daily
+budget bands that overlap with their neighbours). MinHash signatures of the
+feature sets are split into LSH bands, so looking up the nearest prior plan
+touches only the few itineraries that share a band.
+
+A close match is adapted locally (re-dated, trimmed or extended, costs
+fitted to the budget); a looser one is sent to the LLM as a short edit
+prompt instead of a full generation.
+"""
+import copy
+import math
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.utils import timezone
+from trip_mate import metrics
+from .fanout import dedupe_map_points, has_coordinates
+from .models import Itinerary
+from .parsing import schedule_cost
+
+
+REUSE = metrics.registry.counter(
+    'tripmate_itinerary_reuse_total', 'Generation requests served from a similar stored itinerary', ['outcome'])
+SECONDS_SAVED = metrics.registry.counter(
+    'tripmate_itinerary_reuse_seconds_saved_total', 'Estimated generation time saved by reusing itineraries')
+
+NUM_PERM = 32
+BAND_ROWS = 2  # 16 bands of 2 rows: pairs above ~0.25 Jaccard usually share a band
+PRIME = (1 << 61) - 1
+ADAPTED_REASON = 'Adapted from a similar itinerary'
+REFRESH_OVERLAP = timedelta(minutes=1)  # Rows saved just before a refresh may commit after it
+
+_rng = random.Random(20240601)
+PERMUTATIONS = [(_rng.randrange(1, PRIME), _rng.randrange(0, PRIME)) for _ in range(NUM_PERM)]
+
+
+def destination_key(destination):
+    return ' '.join(str(destination).lower().split())
+
+
+def plan_features(interests, duration, budget):
+    """Feature set of a plan; neighbouring durations and budgets share tokens"""
+    # Three tokens per interest so that interests outweigh length and budget
+    features = {
+        f"interest:{' '.join(str(i).lower().split())}:{n}" for i in interests or [] for n in range(3)
+    }
+    features.update(f"days:{d}" for d in range(duration - 1, duration + 2))
+    band = budget_band(budget, duration)
+    features.update(f"budget:{b}" for b in range(band - 1, band + 2))
+    return frozenset(features)
+
+
+def budget_band(budget, duration):
+    """Daily budget on a log2 scale ($25/day is band 0, $50/day band 1, ...)"""
+    daily = max(float(budget) / max(duration, 1), 1.0)
+    return round(math.log2(daily / 25))
+
+
+def minhash(features):
+    hashes = [zlib.crc32(feature.encode()) for feature in features] or [0]
+    return tuple(min((a * h + b) % PRIME for h in hashes) for a, b in PERMUTATIONS)
+
+
+def _band_keys(key, features):
+    signature = minhash(features)
+    return [(key, band, signature[band * BAND_ROWS:(band + 1) * BAND_ROWS]) for band in range(NUM_PERM // BAND_ROWS)]
+
+
+def is_source(is_active, version, constraints):
+    """Whether an itinerary may seed other users' plans
+
+    Edited plans carry their owner's changes and notes, and plans made under
+    constraints are fitted to needs the next request may not share.
+    """
+    return is_active and version == 1 and not constraints
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SimilarityIndex:
+    """MinHash/LSH index of active itineraries, partitioned by destination
+
+    Feature sets repeat a lot (same interests, similar lengths and budgets),
+    so itineraries are grouped by (destination, features) and the LSH
+    buckets hold groups: a lookup scores a few distinct groups rather than
+    every itinerary.
+    """
+
+    def __init__(self, refresh_seconds=None):
+        self.refresh_seconds = getattr(settings, 'ITINERARY_REUSE_REFRESH', 30) if refresh_seconds is None \
+            else refresh_seconds
+        self._entries = {}  # itinerary id -> group
+        self._groups = {}   # (destination key, features) -> {itinerary ids}
+        self._bands = {}    # group -> its LSH band keys
+        self._buckets = {}  # (destination key, band, band hash) -> {groups}
+        self._since = None  # updated_at watermark of the last refresh
+        self._refreshed = None
+        self._lock = threading.Lock()
+
+    def add(self, itinerary_id, destination, interests, start_date, end_date, budget):
+        duration = (_as_date(end_date) - _as_date(start_date)).days + 1
+        group = (destination_key(destination), plan_features(interests, duration, budget))
+        with self._lock:
+            self._discard(itinerary_id)
+            if group not in self._groups:
+                self._groups[group] = set()
+                self._bands[group] = _band_keys(*group)
+                for band in self._bands[group]:
+                    self._buckets.setdefault(band, set()).add(group)
+            self._groups[group].add(itinerary_id)
+            self._entries[itinerary_id] = group
+
+    def remove(self, itinerary_id):
+        with self._lock:
+            self._discard(itinerary_id)
+
+    def query(self, destination, interests, duration, budget, limit=5):
+        """Closest indexed plans as [(similarity, itinerary id)], best first"""
+        self.refresh()
+        key, features = destination_key(destination), plan_features(interests, duration, budget)
+        with self._lock:
+            candidates = set()
+            for band in _band_keys(key, features):
+                candidates.update(self._buckets.get(band, ()))
+            scored = sorted(((jaccard(features, group[1]), group) for group in candidates),
+                            key=lambda pair: pair[0], reverse=True)
+            matches = []
+            for similarity, group in scored:
+                # Newer plans first within a group
+                matches.extend((similarity, i) for i in sorted(self._groups[group], reverse=True)[:limit - len(matches)])
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def refresh(self):
+        """Pick up itineraries other processes created, edited or deleted since the last refresh
+
+        Goes by updated_at rather than by id: ids are handed out before
+        commit, so rows of other workers can appear below ones already seen.
+        """
+        if self._refreshed is not None and time.monotonic() - self._refreshed < self.refresh_seconds:
+            return
+        self._refreshed = time.monotonic()
+        started = timezone.now()
+        if self._since is None:
+            rows = Itinerary.objects.filter(is_active=True, version=1)
+        else:
+            rows = Itinerary.objects.filter(updated_at__gte=self._since)
+        with metrics.span('db.similarity_refresh'):
+            rows = list(rows.values_list('pk', 'is_active', 'version', 'constraints',
+                                         'destination', 'interests', 'start_date', 'end_date', 'budget'))
+        self._since = started - REFRESH_OVERLAP
+        for pk, is_active, version, constraints, *fields in rows:
+            if is_source(is_active, version, constraints):
+                self.add(pk, *fields)
+            else:
+                self.remove(pk)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, itinerary_id):
+        # Called with self._lock held
+        group = self._entries.pop(itinerary_id, None)
+        if group is None:
+            return
+        self._groups[group].discard(itinerary_id)
+        if not self._groups[group]:
+            del self._groups[group]
+            for band in self._bands.pop(group):
+                self._buckets[band].discard(group)
+                if not self._buckets[band]:
+                    del self._buckets[band]
+
+
+class ReuseTracker:
+    """Running estimate of fresh generation time, to report the time reuse saves"""
+
+    def __init__(self):
+        self.generation_seconds = None
+        self._lock = threading.Lock()
+
+    def generated(self, seconds):
+        with self._lock:
+            self.generation_seconds = seconds if self.generation_seconds is None \
+                else 0.9 * self.generation_seconds + 0.1 * seconds
+        REUSE.inc(outcome='miss')
+
+    def reused(self, outcome, seconds):
+        REUSE.inc(outcome=outcome)
+        if self.generation_seconds is not None:
+            SECONDS_SAVED.inc(max(0.0, self.generation_seconds - seconds))
+
+    def stats(self):
+        counts = {outcome: REUSE.value(outcome=outcome) for outcome in ('adapted', 'edited', 'miss')}
+        total = sum(counts.values())
+        return {
+            **counts,
+            'reuse_rate': round((counts['adapted'] + counts['edited']) / total, 4) if total else 0.0,
+            'seconds_saved': round(SECONDS_SAVED.value(), 3),
+            'generation_seconds': round(self.generation_seconds or 0.0, 3),
+        }
+
+
+def find_similar(index, destination, interests, duration, budget, min_similarity):
+    """Best reusable stored plan as (similarity, Itinerary), or None"""
+    for similarity, itinerary_id in index.query(destination, interests, duration, budget):
+        if similarity < min_similarity:
+            break
+        itinerary = Itinerary.objects.filter(pk=itinerary_id).first()
+        if itinerary is None or not is_source(itinerary.is_active, itinerary.version, itinerary.constraints):
+            index.remove(itinerary_id)
+            continue
+        if is_reusable(itinerary.itinerary_data):
+            return similarity, itinerary
+    return None
+
+
+def is_reusable(itinerary_data):
+    """Only plans the model generated from scratch are worth copying"""
+    if not isinstance(itinerary_data, dict) or not itinerary_data.get('days'):
+        return False
+    if any('template' in str(warning).lower() for warning in itinerary_data.get('warnings') or []):
+        return False
+    return not any(str(reason).startswith(ADAPTED_REASON) for reason in itinerary_data.get('adjustment_reasons') or [])
+
+
+def adapt_itinerary(source, destination, start_date, duration, budget, template_days):
+    """Fit a stored plan to new dates, length and budget without an LLM call
+
+    ``template_days(n)`` returns template days for a trip of n days; they fill
+    days the stored plan does not have.
+    """
+    data = copy.deepcopy(source.itinerary_data)
+    start = _as_date(start_date)
+    days = [day for day in data['days'] if isinstance(day, dict)][:duration]
+    if len(days) < duration:
+        data.setdefault('warnings', []).append(
+            f"Days {len(days) + 1}-{duration} use a template schedule. Please customize them."
+        )
+        days.extend(template_days(duration)[len(days):])
+    for number, day in enumerate(days, start=1):
+        day['day'] = number
+        day['date'] = (start + timedelta(days=number - 1)).strftime('%Y-%m-%d')
+
+    fit_budget(days, budget)
+    if duration != len(source.itinerary_data['days']):
+        data['trip_summary'] = f"{duration}-day trip to {destination}"
+    data['days'] = days
+    data['total_estimated_cost'] = round(schedule_cost(days), 2)
+    data['map_points'] = dedupe_map_points(
+        {'name': a['activity'], **a['location']}
+        for day in days for a in day.get('schedule', [])
+        if isinstance(a, dict) and a.get('activity') and has_coordinates(a.get('location'))
+    )
+    data['adjustment_reasons'] = [f"{ADAPTED_REASON} (#{source.pk})"]
+    data.setdefault('booking_links', [])
+    data.setdefault('warnings', [])
+    return data
+
+
+def fit_budget(days, budget):
+    """Scale activity costs down so the schedule fits the budget"""
+    total = schedule_cost(days)
+    if total > budget > 0:
+        factor = budget / total
+        for day in days:
+            for activity in day.get('schedule', []):
+                if isinstance(activity.get('cost_estimate'), (int, float)):
+                    activity['cost_estimate'] = math.floor(activity['cost_estimate'] * factor * 100) / 100
+
+
+def _as_date(value):
+    return value if hasattr(value, 'year') else datetime.strptime(str(value), '%Y-%m-%d').date()
+
+
+_index = None
+_index_lock = threading.Lock()
+tracker = ReuseTracker()
+
+
+def get_similarity_index():
+    """Return the process-wide index, or None when reuse is disabled"""
+    global _index
+    if not getattr(settings, 'ITINERARY_REUSE', False):
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SimilarityIndex()
+    return _index
+
+
+def itinerary_saved(sender, instance, raw=False, **kwargs):
+    if raw or _index is None:
+        return
+    if is_source(instance.is_active, instance.version, instance.constraints):
+        _index.add(instance.pk, instance.destination, instance.interests,
+                   instance.start_date, instance.end_date, instance.budget)
+    else:
+        _index.remove(instance.pk)
+
+
+def itineraries_bulk_created(sender, itineraries, **kwargs):
+    for itinerary in itineraries:
+        itinerary_saved(sender, itinerary)
+
+
+def itinerary_deleted(sender, instance, **kwargs):
+    if _index is not None:
+        _index.remove(instance.pk)
@@ -7,10 +7,10 @@ class ItinerarySerializer(serializers.ModelSerializer):
         model = Itinerary
         fields = [
             'id', 'title', 'destination', 'start_date', 'end_date', 
-            'budget', 'interests', 'constraints', 'itinerary_data',
+            'budget', 'interests', 'constraints', 'itinerary_data', 'version',
             'created_at', 'updated_at', 'is_active'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'version', 'created_at', 'updated_at']
 
 
 class ItineraryEditSerializer(serializers.ModelSerializer):
@@ -39,3 +39,5 @@ class ItineraryEditRequestSerializer(serializers.Serializer):
     activity_index = serializers.IntegerField(required=False)
     new_activity = serializers.DictField(required=False)
     edit_reason = serializers.CharField(required=False, allow_blank=True)
+    # Version the client holds; a matching version gets a JSON patch back
+    known_version = serializers.IntegerField(required=False)
@@ -1,18 +1,25 @@
 """
 PlanEngine service for generating structured itineraries
 """
-import json
-import openai
-from django.conf import settings
+import threading
+import time
 from datetime import datetime, timedelta
-import requests
+from django.conf import settings
+from trip_mate import metrics
+from trip_mate.llm import get_router
+from . import prompts
+from .fanout import FanOutPlanner
+from .geocoding import apply_locations, get_geocoder
+from .parsing import is_complete_activity, normalize_itinerary, parse_json, record_outcome, schedule_cost
+from .reuse import adapt_itinerary, find_similar, fit_budget, get_similarity_index, tracker
+from .weather import apply_weather, get_forecast_service
 
 
 class PlanEngine:
     """AI service for generating and maintaining structured itineraries"""
     
     def __init__(self):
-        self.openai_client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+        self.router = get_router()
     
     def generate_itinerary(self, request_data):
         """Generate a complete itinerary based on user input"""
@@ -28,85 +35,216 @@ class PlanEngine:
         end = datetime.strptime(str(end_date), '%Y-%m-%d')
         duration = (end - start).days + 1
         
-        # Generate itinerary using OpenAI
-        itinerary_json = self._generate_with_ai(
-            destination, start_date, end_date, budget, 
-            interests, constraints, duration
+        # Start from a similar stored plan when there is one
+        itinerary_json = self._generate_from_similar(
+            destination, start_date, end_date, budget, interests, constraints, duration
         )
         
+        # Generate itinerary using OpenAI; long trips are planned day by day in parallel
+        if itinerary_json is None:
+            started = time.monotonic()
+            with metrics.span('plan_engine.generate'):
+                if duration >= settings.FANOUT_MIN_DAYS:
+                    itinerary_json = self._generate_fanout(
+                        destination, start_date, end_date, budget,
+                        interests, constraints, duration
+                    )
+                else:
+                    itinerary_json = self._generate_with_ai(
+                        destination, start_date, end_date, budget, 
+                        interests, constraints, duration
+                    )
+            if get_similarity_index() is not None:
+                tracker.generated(time.monotonic() - started)
+        
+        # Move outdoor plans off days with a poor forecast
+        forecast_service = get_forecast_service()
+        if forecast_service is not None:
+            with metrics.span('plan_engine.weather'):
+                apply_weather(itinerary_json, destination, forecast_service)
+        
+        # Replace placeholder coordinates and rebuild the map points
+        geocoder = get_geocoder()
+        if geocoder is not None:
+            with metrics.span('plan_engine.geocode'):
+                apply_locations(itinerary_json, destination, geocoder)
+        
         return itinerary_json
     
+    def _generate_from_similar(self, destination, start_date, end_date, budget, interests, constraints, duration):
+        """Adapt the closest stored itinerary, or return None to generate from scratch"""
+        index = get_similarity_index()
+        if index is None:
+            return None
+        
+        started = time.monotonic()
+        with metrics.span('plan_engine.similarity'):
+            match = find_similar(
+                index, destination, interests, duration, budget, settings.ITINERARY_REUSE_EDIT_SIMILARITY
+            )
+        if match is None:
+            return None
+        similarity, source = match
+        
+        with metrics.span('plan_engine.adapt'):
+            itinerary = adapt_itinerary(
+                source, destination, start_date, duration, budget,
+                lambda days: self._generate_fallback_itinerary(destination, start_date, end_date, budget, days)['days']
+            )
+        # Constraints are free text, so only the model can check a plan against them
+        if similarity >= settings.ITINERARY_REUSE_ADAPT_SIMILARITY and not constraints:
+            tracker.reused('adapted', time.monotonic() - started)
+            return itinerary
+        
+        self._refine_adapted(itinerary, destination, start_date, budget, interests, constraints, duration)
+        tracker.reused('edited', time.monotonic() - started)
+        return itinerary
+    
+    def _refine_adapted(self, itinerary, destination, start_date, budget, interests, constraints, duration):
+        """Ask the model to swap the activities of an adapted plan that do not fit"""
+        plan = "\n".join(
+            f"{day['day']}.{index} {a.get('time', '')} {a.get('activity', '')} [{a.get('type', '')}, ${a.get('cost_estimate', 0)}]"
+            for day in itinerary['days'] for index, a in enumerate(day.get('schedule', []))
+        )
+        prompt = prompts.ADAPTATION.render(
+            destination=destination, duration=duration, start_date=start_date, budget=budget,
+            interests=", ".join(interests) if interests else "general sightseeing",
+            constraints=self._format_constraints(constraints), plan=plan, max_changes=max(2, duration)
+        )
+        
+        try:
+            response = self.router.complete(
+                'adaptation',
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=150 + 120 * max(2, duration),
+                json_response=True
+            )
+            with metrics.span('json.parse'):
+                replacements = parse_json(response.choices[0].message.content or '').data.get('replace') or []
+        except Exception:
+            # The adapted plan stands on its own
+            record_outcome('adaptation', 'failed')
+            return itinerary
+        
+        days = {day['day']: day for day in itinerary['days']}
+        for change in replacements:
+            if not isinstance(change, dict) or not is_complete_activity(change.get('activity')):
+                continue
+            schedule = days.get(change.get('day'), {}).get('schedule')
+            index = change.get('index')
+            if schedule is not None and isinstance(index, int) and 0 <= index < len(schedule):
+                schedule[index] = change['activity']
+        fit_budget(itinerary['days'], budget)
+        itinerary['total_estimated_cost'] = round(schedule_cost(itinerary['days']), 2)
+        record_outcome('adaptation', 'clean')
+        return itinerary
+    
+    def _generate_fanout(self, destination, start_date, end_date, budget, interests, constraints, duration):
+        """Generate a skeleton first, then every day's schedule concurrently"""
+        planner = FanOutPlanner(
+            self.router,
+            lambda *args: self._generate_fallback_itinerary(*args)['days']
+        )
+        return planner.generate(
+            destination, start_date, end_date, budget,
+            ", ".join(interests) if interests else "general sightseeing",
+            self._format_constraints(constraints), duration
+        )
+    
     def _generate_with_ai(self, destination, start_date, end_date, budget, interests, constraints, duration):
         """Use OpenAI to generate structured itinerary"""
         
         interests_str = ", ".join(interests) if interests else "general sightseeing"
         constraints_str = self._format_constraints(constraints)
         
-        prompt = f"""
-        Generate a {duration}-day travel itinerary for {destination} starting {start_date} ending {end_date}.
-        
-        Budget: ${budget}
-        Interests: {interests_str}
-        Constraints: {constraints_str}
-        
-        Return ONLY valid JSON in this exact schema:
-        {{
-          "trip_summary": "2-line overview",
-          "days": [
-            {{
-              "day": 1,
-              "date": "YYYY-MM-DD",
-              "schedule": [
-                {{
-                  "time": "09:00",
-                  "activity": "Visit Louvre Museum",
-                  "type": "cultural",
-                  "duration": "3h",
-                  "cost_estimate": 20,
-                  "location": {{"lat": 48.8606, "lng": 2.3376}},
-                  "notes": "Book skip-the-line tickets online."
-                }}
-              ]
-            }}
-          ],
-          "total_estimated_cost": 0,
-          "map_points": [
-            {{"name": "Louvre Museum", "lat": 48.8606, "lng": 2.3376}}
-          ],
-          "adjustment_reasons": [],
-          "booking_links": [],
-          "warnings": []
-        }}
-        
-        Rules:
-        - Max 4-5 activities per day
-        - Include realistic costs
-        - Add GPS coordinates for major attractions
-        - Include practical notes
-        - Ensure total cost fits budget
-        """
+        prompt = prompts.GENERATION.render(
+            duration=duration, destination=destination, start_date=start_date, end_date=end_date,
+            budget=budget, interests=interests_str, constraints=constraints_str
+        )
         
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
+            response = self.router.complete(
+                'generation',
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.7,
-                max_tokens=2000
+                max_tokens=2000,
+                json_response=True
             )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Extract JSON from response
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0]
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0]
-            
-            return json.loads(content)
-            
         except Exception as e:
             # Fallback to template itinerary
+            metrics.record_fallback('generation')
             return self._generate_fallback_itinerary(destination, start_date, end_date, budget, duration)
+        
+        try:
+            with metrics.span('json.parse'):
+                result = parse_json(response.choices[0].message.content or '')
+                # A cut that happened before the keys that follow "days" may
+                # have left the last day's schedule incomplete.
+                cut_in_days = result.truncated and 'total_estimated_cost' not in result.data
+                itinerary, missing = normalize_itinerary(result.data, start_date, duration, drop_last_day=cut_in_days)
+            if not itinerary['days']:
+                raise ValueError("No complete days in completion")
+        except ValueError:
+            record_outcome('generation', 'failed', response)
+            metrics.record_fallback('generation')
+            return self._generate_fallback_itinerary(destination, start_date, end_date, budget, duration)
+        
+        if not missing:
+            record_outcome('generation', 'repaired' if result.repaired else 'clean')
+            return itinerary
+        
+        # Keep the complete days and only ask for the missing tail
+        record_outcome('generation', 'salvaged')
+        itinerary['days'].extend(self._generate_missing_days(
+            destination, start_date, end_date, budget, interests_str, itinerary, missing
+        ))
+        
+        present = {day['day'] for day in itinerary['days']}
+        still_missing = [number for number in missing if number not in present]
+        if still_missing:
+            template = self._generate_fallback_itinerary(destination, start_date, end_date, budget, duration)
+            itinerary['days'].extend(day for day in template['days'] if day['day'] in still_missing)
+            itinerary['warnings'].append(
+                f"Days {', '.join(map(str, still_missing))} use a template schedule. Please customize them."
+            )
+        
+        itinerary['days'].sort(key=lambda day: day['day'])
+        itinerary['total_estimated_cost'] = schedule_cost(itinerary['days'])
+        return itinerary
+    
+    def _generate_missing_days(self, destination, start_date, end_date, budget, interests_str, itinerary, missing):
+        """Request only the days a truncated completion did not deliver"""
+        planned = "; ".join(
+            f"Day {day['day']}: " + ", ".join(a['activity'] for a in day['schedule'])
+            for day in itinerary['days']
+        )
+        
+        prompt = prompts.CONTINUATION.render(
+            destination=destination, start_date=start_date, end_date=end_date, budget=budget,
+            interests=interests_str, planned=planned,
+            missing=', '.join(map(str, missing)), first_missing=missing[0]
+        )
+        
+        try:
+            response = self.router.complete(
+                'generation',
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=min(2000, 400 * len(missing)),
+                json_response=True
+            )
+            with metrics.span('json.parse'):
+                result = parse_json(response.choices[0].message.content or '')
+                continuation, _ = normalize_itinerary(
+                    result.data, start_date, max(missing), drop_last_day=result.truncated
+                )
+        except Exception:
+            record_outcome('continuation', 'failed')
+            return []
+        
+        record_outcome('continuation', 'repaired' if result.repaired else 'clean')
+        return [day for day in continuation['days'] if day['day'] in missing]
     
     def _format_constraints(self, constraints):
         """Format constraints for AI prompt"""
@@ -178,6 +316,11 @@ class PlanEngine:
     
     def edit_itinerary(self, itinerary_data, edit_request):
         """Apply edits to an existing itinerary"""
+        with metrics.span('plan_engine.edit'):
+            return self._apply_edit(itinerary_data, edit_request)
+    
+    def _apply_edit(self, itinerary_data, edit_request):
+        """Dispatch an edit request to the matching edit operation"""
         edit_type = edit_request['edit_type']
         
         if edit_type == 'add_activity':
@@ -229,3 +372,17 @@ class PlanEngine:
         """Move an activity to a different day or time"""
         # Implementation for moving activities
         return itinerary_data
+
+
+_plan_engine = None
+_plan_engine_lock = threading.Lock()
+
+
+def get_plan_engine():
+    """Return the process-wide PlanEngine (it holds no per-request state)"""
+    global _plan_engine
+    if _plan_engine is None:
+        with _plan_engine_lock:
+            if _plan_engine is None:
+                _plan_engine = PlanEngine()
+    return _plan_engine
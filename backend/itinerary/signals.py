@@ -0,0 +1,8 @@
+"""
+Custom signals for itinerary writes that bypass post_save
+"""
+from django.dispatch import Signal
+
+# Sent after Itinerary.objects.bulk_create(); ``itineraries`` is the list of
+# saved instances (with primary keys).
+itineraries_bulk_created = Signal()
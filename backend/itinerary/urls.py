@@ -3,8 +3,11 @@ from . import views
 
 urlpatterns = [
     path('generate/', views.generate_itinerary, name='generate_itinerary'),
+    path('generate/bulk/', views.bulk_generate_itineraries, name='bulk_generate_itineraries'),
+    path('generate/bulk/<str:batch_id>/', views.bulk_generation_status, name='bulk_generation_status'),
     path('<int:itinerary_id>/', views.get_itinerary, name='get_itinerary'),
     path('<int:itinerary_id>/edit/', views.edit_itinerary, name='edit_itinerary'),
     path('list/', views.list_itineraries, name='list_itineraries'),
+    path('map/', views.map_clusters, name='map_clusters'),
     path('<int:itinerary_id>/delete/', views.delete_itinerary, name='delete_itinerary'),
 ]
@@ -1,17 +1,30 @@
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Itinerary, ItineraryEdit
+from .bulk import BulkGenerator, batch_summary, build_itinerary, create_batch, item_result
+from .clustering import MapPyramid
+from .geocoding import apply_locations, get_geocoder
+from .models import GenerationBatch, Itinerary, ItineraryEdit
+from .patch import delta
 from .serializers import (
     ItinerarySerializer, 
     ItineraryGenerationRequestSerializer,
     ItineraryEditRequestSerializer
 )
-from .services import PlanEngine
+from .services import get_plan_engine
+from chat.persistence import ItineraryConflict, get_session_store
+from trip_mate.admission import admission_control
+from trip_mate.idempotency import idempotent
+from trip_mate.metrics import span
+import copy
 import json
 
 
+@idempotent('generate')
+@admission_control('generate')
 @api_view(['POST'])
 def generate_itinerary(request):
     """Generate a new itinerary based on user input"""
@@ -21,21 +34,14 @@ def generate_itinerary(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     # Generate itinerary using PlanEngine
-    plan_engine = PlanEngine()
+    plan_engine = get_plan_engine()
     itinerary_json = plan_engine.generate_itinerary(serializer.validated_data)
     
     # Create itinerary record
     itinerary_data = serializer.validated_data
-    itinerary = Itinerary.objects.create(
-        title=f"{itinerary_data['destination']} Trip",
-        destination=itinerary_data['destination'],
-        start_date=itinerary_data['start_date'],
-        end_date=itinerary_data['end_date'],
-        budget=itinerary_data['budget'],
-        interests=itinerary_data.get('interests', []),
-        constraints=itinerary_data.get('constraints', {}),
-        itinerary_data=itinerary_json
-    )
+    with span('db.itinerary_insert'):
+        itinerary = build_itinerary(itinerary_data, itinerary_json)
+        itinerary.save()
     
     return Response({
         'itinerary': ItinerarySerializer(itinerary).data,
@@ -43,10 +49,47 @@ def generate_itinerary(request):
     }, status=status.HTTP_201_CREATED)
 
 
+@admission_control('generate_bulk')
+@api_view(['POST'])
+def bulk_generate_itineraries(request):
+    """Generate many itineraries, streaming per-item results as NDJSON
+
+    Send {"items": [...generation requests...]} to start a batch, or
+    {"batch_id": "..."} to resume one; only unfinished items are generated.
+    """
+    batch_id = request.data.get('batch_id')
+    if batch_id:
+        batch = get_object_or_404(GenerationBatch, batch_id=batch_id)
+    else:
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'A non-empty list of items or a batch_id is required'},
+                           status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.BULK_GENERATION_MAX_ITEMS:
+            return Response({'error': f'At most {settings.BULK_GENERATION_MAX_ITEMS} items per batch'},
+                           status=status.HTTP_400_BAD_REQUEST)
+        batch = create_batch(items, user=request.user if request.user.is_authenticated else None)
+    
+    response = StreamingHttpResponse(BulkGenerator(batch).stream(), content_type='application/x-ndjson')
+    response['X-Batch-Id'] = batch.batch_id
+    return response
+
+
+@api_view(['GET'])
+def bulk_generation_status(request, batch_id):
+    """Get the outcome of every item in a generation batch"""
+    batch = get_object_or_404(GenerationBatch, batch_id=batch_id)
+    return Response({
+        **batch_summary(batch),
+        'items': [item_result(item) for item in batch.items.all()]
+    })
+
+
 @api_view(['GET'])
 def get_itinerary(request, itinerary_id):
     """Get a specific itinerary"""
-    itinerary = get_object_or_404(Itinerary, id=itinerary_id, is_active=True)
+    with span('db.itinerary_lookup'):
+        itinerary = get_object_or_404(Itinerary, id=itinerary_id, is_active=True)
     return Response({
         'itinerary': ItinerarySerializer(itinerary).data,
         'generated_data': itinerary.itinerary_data
@@ -56,29 +99,52 @@ def get_itinerary(request, itinerary_id):
 @api_view(['PUT'])
 def edit_itinerary(request, itinerary_id):
     """Edit an existing itinerary"""
-    itinerary = get_object_or_404(Itinerary, id=itinerary_id, is_active=True)
+    with span('db.itinerary_lookup'):
+        itinerary = get_object_or_404(Itinerary, id=itinerary_id, is_active=True)
     
     edit_serializer = ItineraryEditRequestSerializer(data=request.data)
     if not edit_serializer.is_valid():
         return Response(edit_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    # Apply edits using PlanEngine
-    plan_engine = PlanEngine()
-    original_data = itinerary.itinerary_data.copy()
-    updated_data = plan_engine.edit_itinerary(original_data, edit_serializer.validated_data)
+    # Start from what chat sessions see, which may include edits not flushed yet
+    store = get_session_store()
+    current = store.itinerary(itinerary.pk)
+    base_version = current['version']
+    
+    # Apply edits using PlanEngine; edits change the data in place, so keep a deep copy
+    plan_engine = get_plan_engine()
+    original_data = copy.deepcopy(current['data'])
+    updated_data = plan_engine.edit_itinerary(copy.deepcopy(original_data), edit_serializer.validated_data)
+    with span('itinerary.geocode'):
+        apply_locations(updated_data, itinerary.destination, get_geocoder(), previous=original_data)
     
-    # Save the edit
-    ItineraryEdit.objects.create(
+    # Save the edit and update the itinerary
+    edit = ItineraryEdit(
         itinerary=itinerary,
         edit_type=edit_serializer.validated_data['edit_type'],
         original_data=original_data,
         modified_data=updated_data,
         edit_reason=edit_serializer.validated_data.get('edit_reason', '')
     )
+    try:
+        with span('db.itinerary_save'):
+            store.commit_itinerary(itinerary, updated_data, base_version, edit=edit)
+    except ItineraryConflict:
+        return Response({'error': 'The itinerary was changed by another edit; reload it and try again',
+                         'version': store.itinerary(itinerary.pk)['version']},
+                       status=status.HTTP_409_CONFLICT)
     
-    # Update itinerary
-    itinerary.itinerary_data = updated_data
-    itinerary.save()
+    # A client holding the previous version only needs the changes
+    if edit_serializer.validated_data.get('known_version') == base_version:
+        with span('itinerary.diff'):
+            ops = delta(original_data, updated_data)
+        if ops is not None:
+            return Response({
+                'itinerary_id': itinerary.id,
+                'base_version': base_version,
+                'version': itinerary.version,
+                'patch': ops
+            })
     
     return Response({
         'itinerary': ItinerarySerializer(itinerary).data,
@@ -89,15 +155,41 @@ def edit_itinerary(request, itinerary_id):
 @api_view(['GET'])
 def list_itineraries(request):
     """List all itineraries for a user"""
-    itineraries = Itinerary.objects.filter(is_active=True).order_by('-created_at')
+    with span('db.itinerary_list'):
+        itineraries = list(Itinerary.objects.filter(is_active=True).order_by('-created_at'))
     serializer = ItinerarySerializer(itineraries, many=True)
     return Response(serializer.data)
 
 
+@api_view(['GET'])
+def map_clusters(request):
+    """Clustered map points of all active itineraries inside a viewport"""
+    try:
+        west, south, east, north = (float(v) for v in request.query_params.get('bbox', '').split(','))
+        zoom = int(request.query_params.get('zoom', ''))
+    except ValueError:
+        return Response({'error': 'bbox=west,south,east,north and an integer zoom are required'},
+                       status=status.HTTP_400_BAD_REQUEST)
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180 and zoom >= 0):
+        return Response({'error': 'bbox is outside the map or zoom is negative'},
+                       status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        result = MapPyramid().query(west, south, east, north, zoom)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result)
+
+
 @api_view(['DELETE'])
 def delete_itinerary(request, itinerary_id):
     """Soft delete an itinerary"""
     itinerary = get_object_or_404(Itinerary, id=itinerary_id)
-    itinerary.is_active = False
-    itinerary.save()
+    if itinerary.is_active:
+        try:
+            # Through the session store like every other write, so the version moves on
+            get_session_store().delete_itinerary(itinerary)
+        except ItineraryConflict:
+            return Response({'error': 'The itinerary is being edited; try again'},
+                           status=status.HTTP_409_CONFLICT)
     return Response({'message': 'Itinerary deleted successfully'}, status=status.HTTP_200_OK)
@@ -0,0 +1,298 @@
+"""
+Forecast service for weather-aware itinerary adjustments
+
+Forecasts are cached per (destination, date) in the shared Django cache, so
+every itinerary to the same city reuses them. Missing dates for a destination
+are fetched with a single batched provider call, and concurrent lookups for
+the same destination wait on that call instead of issuing their own, keeping
+provider traffic to at most one call per destination/day per TTL. A failed
+provider call is remembered only for WEATHER_FAILURE_TTL, so an outage
+degrades plans briefly rather than for the whole forecast TTL. Dates outside
+the provider's forecast horizon get no forecast without asking it.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date as Date, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from trip_mate import metrics
+
+logger = logging.getLogger(__name__)
+
+BAD_CONDITIONS = {'rain', 'snow', 'thunderstorm', 'drizzle'}
+OUTDOOR_TYPES = {'outdoor', 'sightseeing'}
+INDOOR_TYPES = {'cultural', 'shopping', 'entertainment'}
+
+UNAVAILABLE = 'unavailable'  # Cached marker for dates the provider cannot forecast
+
+PROVIDER_CALLS = metrics.registry.counter(
+    'tripmate_weather_provider_calls_total', 'Forecast provider calls', ['provider'])
+PROVIDER_ERRORS = metrics.registry.counter(
+    'tripmate_weather_provider_errors_total', 'Forecast provider calls that failed', ['provider'])
+
+
+class FixtureWeatherProvider:
+    """Local provider for tests and benchmarks
+
+    Reads forecasts from WEATHER_FIXTURE_PATH ({"city": {"YYYY-MM-DD": {...}}})
+    when set, otherwise derives a stable forecast from the destination and date.
+    """
+
+    name = 'fixture'
+    horizon_days = None  # Any date
+
+    def __init__(self, path=None):
+        self.fixtures = {}
+        if path:
+            with open(path) as f:
+                self.fixtures = {city.lower(): days for city, days in json.load(f).items()}
+
+    def forecast(self, destination, dates):
+        days = self.fixtures.get(destination.lower())
+        if days is not None:
+            return {date: days[date] for date in dates if date in days}
+
+        forecasts = {}
+        for date in dates:
+            digest = int(hashlib.md5(f"{destination.lower()}|{date}".encode()).hexdigest(), 16)
+            rainy = digest % 4 == 0
+            forecasts[date] = {
+                'condition': 'rain' if rainy else 'clear',
+                'precipitation_probability': 0.8 if rainy else 0.1,
+                'temp_max': 12 + digest % 15,
+                'temp_min': 4 + digest % 8,
+            }
+        return forecasts
+
+
+class OpenWeatherMapProvider:
+    """OpenWeatherMap 5 day / 3 hour forecast, aggregated per day"""
+
+    name = 'openweathermap'
+    url = 'https://api.openweathermap.org/data/2.5/forecast'
+    horizon_days = 5
+
+    def __init__(self, api_key, timeout=5):
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def forecast(self, destination, dates):
+        import requests
+
+        response = requests.get(
+            self.url,
+            params={'q': destination, 'units': 'metric', 'appid': self.api_key},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+        wanted = set(dates)
+        days = {}
+        for entry in response.json().get('list', []):
+            date = entry.get('dt_txt', '')[:10]
+            if date not in wanted:
+                continue
+            day = days.setdefault(date, {
+                'condition': 'clear', 'precipitation_probability': 0.0,
+                'temp_max': float('-inf'), 'temp_min': float('inf')
+            })
+            main = entry.get('main', {})
+            day['temp_max'] = max(day['temp_max'], main.get('temp_max', day['temp_max']))
+            day['temp_min'] = min(day['temp_min'], main.get('temp_min', day['temp_min']))
+            day['precipitation_probability'] = max(day['precipitation_probability'], entry.get('pop', 0.0))
+            for condition in entry.get('weather', []):
+                if condition.get('main', '').lower() in BAD_CONDITIONS:
+                    day['condition'] = condition['main'].lower()
+        return days
+
+
+class ForecastService:
+    """Cached, batched forecasts per destination and date"""
+
+    def __init__(self, provider, ttl=None):
+        self.provider = provider
+        self.ttl = ttl or getattr(settings, 'WEATHER_CACHE_TTL', 3 * 60 * 60)
+        self.failure_ttl = getattr(settings, 'WEATHER_FAILURE_TTL', 60)
+        self._locks = {}  # destination -> (lock, threads using it)
+        self._locks_guard = threading.Lock()
+
+    def get_forecasts(self, destination, dates):
+        """Return {date: forecast or None} for ISO date strings"""
+        destination_key = ' '.join(destination.lower().split())
+        keys = {date: self._key(destination_key, date) for date in dates if self._forecastable(date)}
+        cached = cache.get_many(list(keys.values()))
+        for date, key in keys.items():
+            metrics.record_cache('weather', key in cached)
+
+        missing = [date for date, key in keys.items() if key not in cached]
+        if missing:
+            cached.update(self._fetch(destination, destination_key, missing))
+
+        return {
+            date: None if date not in keys or cached.get(keys[date], UNAVAILABLE) == UNAVAILABLE
+            else cached[keys[date]]
+            for date in dates
+        }
+
+    def _forecastable(self, date):
+        horizon = getattr(self.provider, 'horizon_days', None)
+        if horizon is None:
+            return True
+        try:
+            day = Date.fromisoformat(date)
+        except ValueError:
+            return False
+        today = timezone.localdate()
+        return today <= day <= today + timedelta(days=horizon)
+
+    def _fetch(self, destination, destination_key, dates):
+        """One provider call for every missing date, coalesced across callers"""
+        keys = {date: self._key(destination_key, date) for date in dates}
+        with self._coalesced(destination_key):
+            # Another thread may have filled the cache while we waited
+            cached = cache.get_many(list(keys.values()))
+            remaining = [date for date, key in keys.items() if key not in cached]
+            if not remaining:
+                return cached
+
+            # Other worker processes coordinate through a short cache lock
+            lock_key = f"weather:lock:{destination_key}"
+            locked = cache.add(lock_key, 1, timeout=30)
+            if not locked:
+                cached.update(self._wait_for(keys, remaining))
+                remaining = [date for date, key in keys.items() if key not in cached]
+                if not remaining:
+                    return cached
+
+            ttl = self.ttl
+            try:
+                PROVIDER_CALLS.inc(provider=self.provider.name)
+                with metrics.span('weather.provider'):
+                    forecasts = self.provider.forecast(destination, remaining)
+            except Exception:
+                logger.warning("Forecast provider %s failed for %s", self.provider.name, destination, exc_info=True)
+                PROVIDER_ERRORS.inc(provider=self.provider.name)
+                forecasts, ttl = {}, self.failure_ttl
+            finally:
+                # Only the holder may release; otherwise another process's lock would go
+                if locked:
+                    cache.delete(lock_key)
+
+            fetched = {keys[date]: forecasts.get(date, UNAVAILABLE) for date in remaining}
+            if ttl > 0:
+                cache.set_many(fetched, ttl)
+            cached.update(fetched)
+            return cached
+
+    def _wait_for(self, keys, dates, timeout=5.0, interval=0.1):
+        deadline = time.monotonic() + timeout
+        wanted = [keys[date] for date in dates]
+        found = {}
+        while time.monotonic() < deadline:
+            found = cache.get_many(wanted)
+            if len(found) == len(wanted):
+                break
+            time.sleep(interval)
+        return found
+
+    @contextmanager
+    def _coalesced(self, destination_key):
+        # Locks are shared while in use and dropped after, so the map stays small
+        with self._locks_guard:
+            lock, users = self._locks.get(destination_key, (None, 0))
+            lock = lock or threading.Lock()
+            self._locks[destination_key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_guard:
+                users = self._locks[destination_key][1] - 1
+                if users:
+                    self._locks[destination_key] = (lock, users)
+                else:
+                    del self._locks[destination_key]
+
+    def _key(self, destination_key, date):
+        digest = hashlib.md5(destination_key.encode()).hexdigest()
+        return f"weather:{digest}:{date}"
+
+
+def is_bad_weather(forecast):
+    threshold = getattr(settings, 'WEATHER_BAD_PRECIPITATION', 0.6)
+    return bool(forecast) and (
+        forecast.get('condition') in BAD_CONDITIONS
+        or forecast.get('precipitation_probability', 0) >= threshold
+    )
+
+
+def apply_weather(itinerary, destination, service):
+    """Attach forecasts to days and swap outdoor plans off bad-weather days
+
+    An outdoor activity on a bad-weather day trades places (keeping its time
+    slot) with an indoor activity on a good-weather day.
+    """
+    days = itinerary.get('days', [])
+    dates = [day['date'] for day in days if day.get('date')]
+    if not dates:
+        return itinerary
+
+    forecasts = service.get_forecasts(destination, dates)
+    for day in days:
+        forecast = forecasts.get(day.get('date'))
+        if forecast:
+            day['weather'] = forecast
+
+    bad_days = [day for day in days if is_bad_weather(forecasts.get(day.get('date')))]
+    good_days = [day for day in days if forecasts.get(day.get('date')) and not is_bad_weather(forecasts[day['date']])]
+
+    for bad_day in bad_days:
+        for index, activity in enumerate(bad_day.get('schedule', [])):
+            if activity.get('type') not in OUTDOOR_TYPES:
+                continue
+            swap = _find_indoor(good_days)
+            if swap is None:
+                itinerary.setdefault('warnings', []).append(
+                    f"Day {bad_day['day']} has a poor forecast; consider an indoor alternative to {activity.get('activity')}."
+                )
+                continue
+            good_day, good_index = swap
+            indoor = good_day['schedule'][good_index]
+            bad_day['schedule'][index] = {**indoor, 'time': activity.get('time', indoor.get('time'))}
+            good_day['schedule'][good_index] = {**activity, 'time': indoor.get('time', activity.get('time'))}
+            itinerary.setdefault('adjustment_reasons', []).append(
+                f"Moved {activity.get('activity')} from day {bad_day['day']} to day {good_day['day']} "
+                f"because of the forecast ({forecasts[bad_day['date']].get('condition')})"
+            )
+    return itinerary
+
+
+def _find_indoor(good_days):
+    for day in good_days:
+        for index, activity in enumerate(day.get('schedule', [])):
+            if activity.get('type') in INDOOR_TYPES:
+                return day, index
+    return None
+
+
+_service = None
+
+
+def get_forecast_service():
+    """Return the process-wide forecast service, or None when weather is disabled"""
+    global _service
+    if _service is None:
+        provider_name = getattr(settings, 'WEATHER_PROVIDER', '')
+        if provider_name == 'fixture':
+            provider = FixtureWeatherProvider(getattr(settings, 'WEATHER_FIXTURE_PATH', '') or None)
+        elif provider_name == 'openweathermap' and settings.WEATHER_API_KEY:
+            provider = OpenWeatherMapProvider(settings.WEATHER_API_KEY)
+        else:
+            return None
+        _service = ForecastService(provider)
+    return _service
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from retention.services import RetentionJob
+
+
+class Command(BaseCommand):
+    help = 'Archive rows past their retention period to gzipped JSONL and delete them in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', action='append', choices=['itinerary_edits', 'chat_messages', 'chat_sessions', 'itineraries'],
+                            help='Only process this table (repeatable)')
+        parser.add_argument('--batch-size', type=int, help='Rows archived and deleted per transaction')
+        parser.add_argument('--archive-dir', help='Directory for the compressed archives')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be removed')
+
+    def handle(self, *args, **options):
+        job = RetentionJob(
+            archive_dir=options.get('archive_dir'),
+            batch_size=options.get('batch_size'),
+            dry_run=options['dry_run']
+        )
+        counts = job.run(tables=options.get('table'))
+        verb = 'Would remove' if options['dry_run'] else 'Archived and removed'
+        for table, count in counts.items():
+            self.stdout.write(self.style.SUCCESS(f"{verb} {count} {table} rows"))
+        if not options['dry_run']:
+            self.stdout.write(f"Archives: {job.archive_dir}")
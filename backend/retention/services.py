@@ -0,0 +1,143 @@
+"""
+Retention, archival and compaction of cold rows
+
+Each policy selects cold rows of one table. Rows are handled in small
+primary-key batches: a batch is appended to a gzipped JSONL archive (one
+gzip member per batch, flushed to disk) and then deleted in its own short
+transaction, so no lock is held for longer than one batch. Tables are
+processed children first (edits, messages, sessions, then itineraries), so a
+delete never cascades into rows that were not archived.
+"""
+import gzip
+import json
+import os
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from chat.models import ChatMessage, ChatSession
+from itinerary.models import Itinerary, ItineraryEdit
+from trip_mate import metrics
+
+
+RETENTION_ROWS = metrics.registry.counter(
+    'tripmate_retention_rows_total', 'Rows handled by the retention job', ['table', 'action'])
+
+DEFAULT_POLICIES = {
+    'inactive_itineraries': 90,  # Soft-deleted itineraries, days since last update
+    'ended_chat_sessions': 30,   # Ended chat sessions and their messages, days since last update
+    'chat_messages': 180,        # Messages of ended sessions, days since sent (live transcripts are kept)
+    'itinerary_edits': 180,      # Edit history, days since the edit
+}
+
+
+class RetentionJob:
+    """Archives and deletes rows that are past their retention period"""
+
+    def __init__(self, policies=None, archive_dir=None, batch_size=None, pause=None, dry_run=False):
+        self.policies = {**DEFAULT_POLICIES, **(policies or getattr(settings, 'RETENTION_POLICIES', {}))}
+        self.archive_dir = str(archive_dir or settings.RETENTION_ARCHIVE_DIR)
+        self.batch_size = batch_size or getattr(settings, 'RETENTION_BATCH_SIZE', 500)
+        self.pause = getattr(settings, 'RETENTION_BATCH_PAUSE', 0.1) if pause is None else pause
+        self.dry_run = dry_run
+        self.run_id = f"{timezone.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.now = timezone.now()
+
+    def run(self, tables=None):
+        """Enforce every policy; returns {table: rows archived and deleted}"""
+        steps = [
+            ('itinerary_edits', self.itinerary_edits),
+            ('chat_messages', self.chat_messages),
+            ('chat_sessions', self.chat_sessions),
+            ('itineraries', self.itineraries),
+        ]
+        counts = {}
+        for table, queryset in steps:
+            if tables and table not in tables:
+                continue
+            qs = queryset()
+            counts[table] = qs.count() if self.dry_run else self._purge(table, qs)
+        return counts
+
+    # Cold rows per table. A policy set to None is disabled.
+
+    def itinerary_edits(self):
+        condition = self._older('itinerary_edits', 'created_at') | Q(itinerary__in=self.cold_itineraries())
+        return ItineraryEdit.objects.filter(condition)
+
+    def chat_messages(self):
+        # Active sessions' transcripts feed chat history and edit context, so only
+        # messages of ended sessions are ever cold
+        ended = Q(session__is_active=False)
+        condition = (
+            (ended & self._older('chat_messages', 'created_at'))
+            | (ended & self._older('ended_chat_sessions', 'session__updated_at'))
+            | Q(session__itinerary__in=self.cold_itineraries())
+        )
+        return ChatMessage.objects.filter(condition)
+
+    def chat_sessions(self):
+        condition = (
+            (Q(is_active=False) & self._older('ended_chat_sessions', 'updated_at'))
+            | Q(itinerary__in=self.cold_itineraries())
+        )
+        # Sessions whose messages are still retained stay until those go
+        return ChatSession.objects.filter(condition).filter(messages__isnull=True)
+
+    def itineraries(self):
+        return self.cold_itineraries().filter(edits__isnull=True, chatsession__isnull=True)
+
+    def cold_itineraries(self):
+        return Itinerary.objects.filter(Q(is_active=False) & self._older('inactive_itineraries', 'updated_at'))
+
+    def _older(self, policy, field):
+        days = self.policies.get(policy)
+        if days is None:
+            return Q(pk__in=[])
+        return Q(**{f"{field}__lt": self.now - timedelta(days=days)})
+
+    def _purge(self, table, queryset):
+        model = queryset.model
+        total = 0
+        last_pk = None
+        while True:
+            batch = queryset.order_by('pk')
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            ids = list(batch.values_list('pk', flat=True)[:self.batch_size])
+            if not ids:
+                return total
+            last_pk = ids[-1]
+
+            with metrics.span(f"retention.{table}"):
+                rows = list(model.objects.filter(pk__in=ids).order_by('pk'))
+                self._archive(table, rows)
+                RETENTION_ROWS.inc(len(rows), table=table, action='archived')
+                # Re-check the policy so rows that changed since selection are kept
+                with transaction.atomic():
+                    deleted = queryset.filter(pk__in=[row.pk for row in rows]).delete()[1].get(model._meta.label, 0)
+                RETENTION_ROWS.inc(deleted, table=table, action='deleted')
+            total += deleted
+            if self.pause:
+                # Give other writers a turn between batches
+                time.sleep(self.pause)
+
+    def _archive(self, table, rows):
+        """Append rows to this run's archive for the table as one gzip member"""
+        directory = os.path.join(self.archive_dir, table)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.run_id}.jsonl.gz")
+        lines = [
+            json.dumps(record, cls=DjangoJSONEncoder) + "\n"
+            for record in serializers.serialize('python', rows)
+        ]
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(''.join(lines).encode()))
+            f.flush()
+            os.fsync(f.fileno())
+        return path
@@ -0,0 +1,8 @@
+from celery import shared_task
+from .services import RetentionJob
+
+
+@shared_task(name='retention.enforce')
+def enforce_retention():
+    """Archive and delete rows past their retention period"""
+    return RetentionJob().run()
@@ -0,0 +1,26 @@
+from django.db.models import Q
+
+
+class FullTextSearchMixin:
+    """Admin mixin that answers changelist searches from the full-text index
+
+    ``search_exact_fields`` are matched with indexed equality lookups alongside
+    the ranked full-text hits instead of ``LIKE '%term%'`` scans.
+    """
+
+    search_kind = None
+    search_exact_fields = []
+    search_limit = 500
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+
+        from .services import SearchService
+        ids = SearchService().search_ids(self.search_kind, search_term, limit=self.search_limit)
+
+        condition = Q(pk__in=ids)
+        for field in self.search_exact_fields:
+            condition |= Q(**{field: search_term})
+        return queryset.filter(condition), False
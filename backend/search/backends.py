@@ -0,0 +1,163 @@
+"""
+Full-text search backends
+
+Every backend stores one row per document in a single table keyed by an
+encoded id (object id + kind code), so re-indexing or removing a document is a
+primary key lookup rather than a scan.
+"""
+import re
+from django.conf import settings
+from django.db import connection
+
+
+KIND_CODES = {
+    'itinerary': 1,
+    'message': 2,
+    'edit': 3,  # Itinerary edit history, for the admin
+}
+KIND_SLOTS = 8
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def encode_id(kind, object_id):
+    """Pack a document kind and object id into a single integer key"""
+    return int(object_id) * KIND_SLOTS + KIND_CODES[kind]
+
+
+def decode_id(doc_id):
+    """Return the object id stored in an encoded document key"""
+    return doc_id // KIND_SLOTS
+
+
+class SearchBackend:
+    """Interface shared by the search backends"""
+
+    table = 'search_document'
+    key_column = 'id'
+
+    def install(self):
+        raise NotImplementedError
+
+    def index(self, kind, object_id, title, body):
+        raise NotImplementedError
+
+    def remove(self, kind, object_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE {self.key_column} = %s",
+                [encode_id(kind, object_id)]
+            )
+
+    def clear(self, kind):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE kind = %s", [KIND_CODES[kind]])
+
+    def search(self, kind, query, limit=50):
+        """Return [(object_id, score)] ordered from best to worst match"""
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """SQLite FTS5 backend ranked by bm25"""
+
+    key_column = 'rowid'
+
+    def install(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                "kind UNINDEXED, title, body, tokenize='porter unicode61')"
+            )
+
+    def index(self, kind, object_id, title, body):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {self.table} (rowid, kind, title, body) VALUES (%s, %s, %s, %s)",
+                [encode_id(kind, object_id), KIND_CODES[kind], title, body]
+            )
+
+    def search(self, kind, query, limit=50):
+        match = self._match_expression(query)
+        if not match:
+            return []
+
+        # Title hits weigh more than body hits; bm25 is lower-is-better.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, bm25({self.table}, 0.0, 4.0, 1.0) AS score "
+                f"FROM {self.table} WHERE {self.table} MATCH %s AND kind = %s "
+                "ORDER BY score LIMIT %s",
+                [match, KIND_CODES[kind], limit]
+            )
+            return [(decode_id(row[0]), -row[1]) for row in cursor.fetchall()]
+
+    def _match_expression(self, query):
+        """Quote user terms so FTS5 operators in the input are not interpreted"""
+        tokens = TOKEN_RE.findall(query)
+        if not tokens:
+            return ''
+        terms = [f'"{token}"' for token in tokens[:-1]]
+        terms.append(f'"{tokens[-1]}"*')
+        return ' '.join(terms)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Postgres backend using a stored tsvector column and a GIN index"""
+
+    config = 'english'
+
+    def install(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "id bigint PRIMARY KEY, "
+                "kind smallint NOT NULL, "
+                "title text NOT NULL DEFAULT '', "
+                "body text NOT NULL DEFAULT '', "
+                "document tsvector GENERATED ALWAYS AS ("
+                f"setweight(to_tsvector('{self.config}', title), 'A') || "
+                f"setweight(to_tsvector('{self.config}', body), 'B')"
+                ") STORED)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_document_idx "
+                f"ON {self.table} USING GIN (document)"
+            )
+
+    def index(self, kind, object_id, title, body):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table} (id, kind, title, body) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body",
+                [encode_id(kind, object_id), KIND_CODES[kind], title, body]
+            )
+
+    def search(self, kind, query, limit=50):
+        if not TOKEN_RE.search(query):
+            return []
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id, ts_rank(document, q) AS score "
+                f"FROM {self.table}, websearch_to_tsquery('{self.config}', %s) q "
+                "WHERE kind = %s AND document @@ q "
+                "ORDER BY score DESC LIMIT %s",
+                [query, KIND_CODES[kind], limit]
+            )
+            return [(decode_id(row[0]), row[1]) for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    """Return the search backend matching the configured database"""
+    vendor = getattr(settings, 'SEARCH_BACKEND', '') or connection.vendor
+    backend_class = BACKENDS.get(vendor)
+    if backend_class is None:
+        raise RuntimeError(f"No full-text search backend for database vendor '{vendor}'")
+    return backend_class()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from search.services import SearchService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for itineraries and chat messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['itinerary', 'message', 'edit'], help='Only rebuild one kind')
+
+    def handle(self, *args, **options):
+        counts = SearchService().rebuild(kind=options.get('kind'))
+        for kind, count in counts.items():
+            self.stdout.write(self.style.SUCCESS(f"Indexed {count} {kind} documents"))
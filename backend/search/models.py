@@ -0,0 +1,2 @@
+# Search documents live in backend-specific tables (an FTS5 virtual table on
+# SQLite, a tsvector table on Postgres) created by SearchBackend.install().
@@ -0,0 +1,73 @@
+"""
+Search service for chat transcripts and itineraries
+"""
+from .backends import get_backend
+
+
+class SearchService:
+    """Keeps the full-text index in sync and runs ranked queries against it"""
+
+    def __init__(self):
+        self.backend = get_backend()
+
+    def search(self, kind, query, limit=50):
+        """Return [(object_id, score)] for the best matches of a given kind"""
+        return self.backend.search(kind, query, limit=limit)
+
+    def search_ids(self, kind, query, limit=50):
+        """Return matching object ids ordered by rank"""
+        return [object_id for object_id, score in self.search(kind, query, limit=limit)]
+
+    def index_itinerary(self, itinerary):
+        """Index an itinerary's title, destination and activities"""
+        title = f"{itinerary.title} {itinerary.destination}"
+        self.backend.index('itinerary', itinerary.pk, title, self._itinerary_body(itinerary))
+
+    def index_message(self, message):
+        """Index a chat message's content"""
+        self.backend.index('message', message.pk, '', message.content)
+
+    def index_edit(self, edit):
+        """Index an itinerary edit by its itinerary's title and the edit reason"""
+        self.backend.index('edit', edit.pk, edit.itinerary.title, edit.edit_reason)
+
+    def remove(self, kind, object_id):
+        self.backend.remove(kind, object_id)
+
+    def rebuild(self, kind=None):
+        """Re-index every itinerary, chat message and/or itinerary edit from scratch"""
+        from itinerary.models import Itinerary, ItineraryEdit
+        from chat.models import ChatMessage
+
+        self.backend.install()
+        counts = {}
+        if kind in (None, 'itinerary'):
+            self.backend.clear('itinerary')
+            counts['itinerary'] = 0
+            for itinerary in Itinerary.objects.order_by('pk').iterator(chunk_size=500):
+                self.index_itinerary(itinerary)
+                counts['itinerary'] += 1
+        if kind in (None, 'message'):
+            self.backend.clear('message')
+            counts['message'] = 0
+            for message in ChatMessage.objects.order_by('pk').only('pk', 'content').iterator(chunk_size=2000):
+                self.index_message(message)
+                counts['message'] += 1
+        if kind in (None, 'edit'):
+            self.backend.clear('edit')
+            counts['edit'] = 0
+            edits = ItineraryEdit.objects.select_related('itinerary').only('pk', 'edit_reason', 'itinerary__title')
+            for edit in edits.order_by('pk').iterator(chunk_size=2000):
+                self.index_edit(edit)
+                counts['edit'] += 1
+        return counts
+
+    def _itinerary_body(self, itinerary):
+        """Flatten activity names and notes into a single searchable text"""
+        data = itinerary.itinerary_data or {}
+        parts = [data.get('trip_summary', '')]
+        for day in data.get('days', []):
+            for activity in day.get('schedule', []):
+                parts.append(activity.get('activity', ''))
+                parts.append(activity.get('notes', ''))
+        return "\n".join(part for part in parts if isinstance(part, str) and part)
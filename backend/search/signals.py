@@ -0,0 +1,92 @@
+"""
+Keep the search index in sync with itinerary, chat message and edit writes
+
+Index updates run once the write's transaction commits, so a rolled-back
+write never leaves a document behind.
+"""
+import logging
+from django.db import DatabaseError, connection, transaction
+from django.db.models.signals import post_save, post_delete
+from .backends import get_backend
+from .services import SearchService
+
+logger = logging.getLogger(__name__)
+
+
+def install_index(sender, **kwargs):
+    """Create the backend's search table after migrations run"""
+    get_backend().install()
+
+
+def _safely(operation, *args):
+    # Indexing must never fail the write it follows; inside a transaction the
+    # savepoint keeps an index error from aborting it on Postgres.
+    try:
+        if connection.in_atomic_block:
+            with transaction.atomic():
+                operation(*args)
+        else:
+            operation(*args)
+    except DatabaseError:
+        logger.exception("Search index update failed")
+
+
+def _after_commit(operation, *args):
+    # Arguments are taken now: a deleted instance loses its pk before commit
+    transaction.on_commit(lambda: _safely(operation, *args))
+
+
+def _each_after_commit(operation, instances):
+    instances = list(instances)
+    transaction.on_commit(lambda: [_safely(operation, instance) for instance in instances])
+
+
+def itinerary_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _after_commit(SearchService().index_itinerary, instance)
+
+
+def itineraries_bulk_created(sender, itineraries, **kwargs):
+    _each_after_commit(SearchService().index_itinerary, itineraries)
+
+
+def itinerary_deleted(sender, instance, **kwargs):
+    _after_commit(SearchService().remove, 'itinerary', instance.pk)
+
+
+def message_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _after_commit(SearchService().index_message, instance)
+
+
+def messages_bulk_created(sender, messages, **kwargs):
+    _each_after_commit(SearchService().index_message, messages)
+
+
+def message_deleted(sender, instance, **kwargs):
+    _after_commit(SearchService().remove, 'message', instance.pk)
+
+
+def edit_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _after_commit(SearchService().index_edit, instance)
+
+
+def edit_deleted(sender, instance, **kwargs):
+    _after_commit(SearchService().remove, 'edit', instance.pk)
+
+
+def connect():
+    from itinerary.models import Itinerary, ItineraryEdit
+    from itinerary.signals import itineraries_bulk_created as bulk_created
+    from chat.models import ChatMessage
+    from chat.signals import messages_bulk_created as messages_created
+
+    post_save.connect(itinerary_saved, sender=Itinerary, dispatch_uid='search_itinerary_saved')
+    post_delete.connect(itinerary_deleted, sender=Itinerary, dispatch_uid='search_itinerary_deleted')
+    bulk_created.connect(itineraries_bulk_created, sender=Itinerary, dispatch_uid='search_itineraries_bulk_created')
+    post_save.connect(message_saved, sender=ChatMessage, dispatch_uid='search_message_saved')
+    messages_created.connect(messages_bulk_created, sender=ChatMessage, dispatch_uid='search_messages_bulk_created')
+    post_delete.connect(message_deleted, sender=ChatMessage, dispatch_uid='search_message_deleted')
+    post_save.connect(edit_saved, sender=ItineraryEdit, dispatch_uid='search_edit_saved')
+    post_delete.connect(edit_deleted, sender=ItineraryEdit, dispatch_uid='search_edit_deleted')
@@ -0,0 +1,123 @@
+from unittest import skipUnless
+from django.contrib.admin.sites import site
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase
+from chat.models import ChatMessage, ChatSession
+from itinerary.models import Itinerary, ItineraryEdit
+from .services import SearchService
+
+
+def itinerary_data(*activities):
+    return {
+        'trip_summary': 'A few days away',
+        'days': [{'day': 1, 'date': '2025-06-02', 'schedule': [
+            {'activity': name, 'notes': '', 'type': 'cultural', 'time': '10:00'} for name in activities
+        ]}],
+    }
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 is the test backend')
+class SQLiteFullTextSearchTests(TestCase):
+    """Index maintenance and ranked queries against the FTS5 table"""
+
+    def setUp(self):
+        self.search = SearchService()
+
+    def create(self, title, destination='Kyoto', activities=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Itinerary.objects.create(
+                title=title, destination=destination, start_date='2025-06-02', end_date='2025-06-04',
+                budget=1000, itinerary_data=itinerary_data(*activities)
+            )
+
+    def test_saved_itinerary_is_indexed(self):
+        itinerary = self.create('Temple weekend', activities=['Fushimi Inari shrine'])
+
+        self.assertEqual(self.search.search_ids('itinerary', 'temple'), [itinerary.pk])
+        self.assertEqual(self.search.search_ids('itinerary', 'inari'), [itinerary.pk])
+
+    def test_rolled_back_save_leaves_no_document(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Itinerary.objects.create(
+                        title='Abandoned plan', destination='Oslo', start_date='2025-06-02',
+                        end_date='2025-06-04', budget=1000, itinerary_data=itinerary_data()
+                    )
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertEqual(self.search.search_ids('itinerary', 'abandoned'), [])
+
+    def test_update_replaces_the_document(self):
+        itinerary = self.create('Temple weekend')
+        itinerary.title = 'Garden weekend'
+        with self.captureOnCommitCallbacks(execute=True):
+            itinerary.save()
+
+        self.assertEqual(self.search.search_ids('itinerary', 'garden'), [itinerary.pk])
+        self.assertEqual(self.search.search_ids('itinerary', 'temple'), [])
+
+    def test_delete_removes_the_document(self):
+        itinerary = self.create('Temple weekend')
+        with self.captureOnCommitCallbacks(execute=True):
+            itinerary.delete()
+
+        self.assertEqual(self.search.search_ids('itinerary', 'temple'), [])
+
+    def test_title_matches_rank_above_body_matches(self):
+        in_body = self.create('Food tour', activities=['Nishiki market', 'Tea ceremony'])
+        in_title = self.create('Tea houses of Uji')
+
+        self.assertEqual(self.search.search_ids('itinerary', 'tea'), [in_title.pk, in_body.pk])
+
+    def test_last_term_matches_as_a_prefix(self):
+        itinerary = self.create('Temple weekend')
+
+        self.assertEqual(self.search.search_ids('itinerary', 'weekend temp'), [itinerary.pk])
+
+    def test_operators_in_the_query_are_treated_as_text(self):
+        self.create('Temple weekend')
+
+        self.assertEqual(self.search.search_ids('itinerary', 'NOT "temple" OR'), [])
+
+    def test_messages_and_edits_are_indexed_by_kind(self):
+        itinerary = self.create('Temple weekend')
+        session = ChatSession.objects.create(session_id='s1', itinerary=itinerary)
+        with self.captureOnCommitCallbacks(execute=True):
+            message = ChatMessage.objects.create(session=session, message_type='user', content='Add a temple visit')
+            edit = ItineraryEdit.objects.create(
+                itinerary=itinerary, edit_type='add_activity', original_data={}, modified_data={},
+                edit_reason='More temples please'
+            )
+
+        self.assertEqual(self.search.search_ids('message', 'temple'), [message.pk])
+        self.assertEqual(self.search.search_ids('edit', 'temples'), [edit.pk])
+        self.assertEqual(self.search.search_ids('itinerary', 'temple'), [itinerary.pk])
+
+    def test_admin_search_uses_the_index(self):
+        itinerary = self.create('Temple weekend')
+        with self.captureOnCommitCallbacks(execute=True):
+            edit = ItineraryEdit.objects.create(
+                itinerary=itinerary, edit_type='remove_activity', original_data={}, modified_data={},
+                edit_reason='Too much walking'
+            )
+        admin = site._registry[ItineraryEdit]
+        request = RequestFactory().get('/admin/itinerary/itineraryedit/')
+
+        results, may_have_duplicates = admin.get_search_results(request, ItineraryEdit.objects.all(), 'walking')
+
+        self.assertEqual(list(results), [edit])
+        self.assertFalse(may_have_duplicates)
+
+    def test_rebuild_indexes_every_kind(self):
+        itinerary = self.create('Temple weekend')
+        ItineraryEdit.objects.create(
+            itinerary=itinerary, edit_type='add_activity', original_data={}, modified_data={}, edit_reason='Ramen'
+        )
+
+        counts = self.search.rebuild()
+
+        self.assertEqual(counts, {'itinerary': 1, 'message': 0, 'edit': 1})
+        self.assertEqual(len(self.search.search_ids('edit', 'ramen')), 1)
@@ -0,0 +1,53 @@
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from itinerary.models import Itinerary
+from chat.models import ChatMessage
+from .services import SearchService
+
+
+@api_view(['GET'])
+def search(request):
+    """Ranked full-text search over itineraries or chat messages"""
+    query = request.query_params.get('q', '').strip()
+    kind = request.query_params.get('kind', 'itinerary')
+
+    if not query or kind not in ('itinerary', 'message'):
+        return Response({'error': 'A query (q) and a kind of itinerary or message are required'},
+                       status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+    except ValueError:
+        limit = 20
+
+    ranked = SearchService().search(kind, query, limit=limit)
+    ids = [object_id for object_id, score in ranked]
+
+    results = []
+    if kind == 'itinerary':
+        objects = Itinerary.objects.in_bulk(ids)
+        for object_id, score in ranked:
+            itinerary = objects.get(object_id)
+            if itinerary:
+                results.append({
+                    'id': itinerary.id,
+                    'title': itinerary.title,
+                    'destination': itinerary.destination,
+                    'score': score
+                })
+    else:
+        objects = ChatMessage.objects.select_related('session').in_bulk(ids)
+        for object_id, score in ranked:
+            message = objects.get(object_id)
+            if message:
+                results.append({
+                    'id': message.id,
+                    'session_id': message.session.session_id,
+                    'type': message.message_type,
+                    'content': message.content,
+                    'timestamp': message.created_at.isoformat(),
+                    'score': score
+                })
+
+    return Response({'results': results})
@@ -0,0 +1,280 @@
+"""
+Admission control for LLM-backed endpoints
+
+Each guarded endpoint gets a per-process concurrency limit with a bounded
+wait queue, plus a per-user/IP token bucket rate limit whose state lives in
+Redis (or in memory for development and tests). Requests over either limit
+are turned away immediately with 429 or 503 and a Retry-After header, so a
+spike on the LLM endpoints cannot tie up every worker and take the cheap
+read endpoints down with it.
+"""
+import math
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.http import JsonResponse
+from . import metrics
+
+
+ADMISSION_TOTAL = metrics.registry.counter(
+    'tripmate_admission_total', 'Admission control decisions', ['endpoint', 'outcome'])
+ADMISSION_WAIT_SECONDS = metrics.registry.histogram(
+    'tripmate_admission_wait_seconds', 'Time spent queued for a concurrency slot', ['endpoint'])
+
+
+class Rejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """Bounded number of in-flight requests with a bounded, deadline-aware queue"""
+
+    def __init__(self, limit, queue_size, max_wait):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting up to max_wait; raises Rejected when full"""
+        with self._condition:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return 0.0
+            if self.waiting >= self.queue_size:
+                raise Rejected(503, 'queue_full', self._retry_after())
+
+            started = time.monotonic()
+            deadline = started + self.max_wait
+            self.waiting += 1
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Rejected(503, 'queue_timeout', self._retry_after())
+                    self._condition.wait(remaining)
+                self.active += 1
+                return time.monotonic() - started
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def _retry_after(self):
+        return max(1, math.ceil(self.max_wait))
+
+
+class InMemoryRateLimitBackend:
+    """Process-local token buckets, for development and tests
+
+    A bucket that has refilled completely is the same as no bucket, so those
+    are dropped every SWEEP_INTERVAL seconds; memory then follows the number
+    of recently active clients rather than every client ever seen.
+    """
+
+    SWEEP_INTERVAL = 10.0
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + self.SWEEP_INTERVAL
+
+    def take(self, key, rate, capacity):
+        """Take one token; returns (allowed, retry_after_seconds)"""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # Keep when the bucket will be full again, for the sweep
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            return (True, 0.0) if allowed else (False, (1 - tokens) / rate)
+
+    def _sweep(self, now):
+        # Called with self._lock held
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._next_sweep = now + self.SWEEP_INTERVAL
+
+
+class RedisRateLimitBackend:
+    """Token buckets shared by every worker through Redis"""
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    local retry_after = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    else
+        retry_after = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(retry_after)}
+    """
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, capacity):
+        allowed, retry_after = self.script(keys=[f"ratelimit:{key}"], args=[rate, capacity, time.time()])
+        return bool(allowed), float(retry_after)
+
+
+class ReleasingIterator:
+    """Wraps a streaming body and releases a concurrency slot exactly once"""
+
+    def __init__(self, iterable, release):
+        self.iterable = iterable
+        self.release = release
+        self.released = False
+
+    def __iter__(self):
+        try:
+            yield from self.iterable
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            self.release()
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+
+
+class AdmissionController:
+    """Applies the configured limits for one endpoint"""
+
+    def __init__(self, endpoint, config, rate_backend):
+        self.endpoint = endpoint
+        self.rate = config.get('rate')
+        self.burst = config.get('burst', 1)
+        self.rate_backend = rate_backend
+        self.limiter = ConcurrencyLimiter(
+            config.get('concurrency', 8), config.get('queue', 16), config.get('max_wait', 5.0)
+        )
+
+    def admit(self, request):
+        """Check the rate limit and take a concurrency slot; raises Rejected"""
+        self.admit_client(client_identity(request))
+
+    def admit_client(self, identity):
+        """admit() for work that has no HTTP request, such as a WebSocket turn"""
+        if self.rate:
+            allowed, retry_after = self.rate_backend.take(
+                f"{self.endpoint}:{identity}", self.rate, self.burst
+            )
+            if not allowed:
+                raise Rejected(429, 'rate_limited', max(1, math.ceil(retry_after)))
+        waited = self.limiter.acquire()
+        ADMISSION_WAIT_SECONDS.observe(waited, endpoint=self.endpoint)
+
+    def release(self):
+        self.limiter.release()
+
+
+def client_identity(request):
+    """Rate limit key: the user id when authenticated, otherwise the client IP"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    if getattr(settings, 'ADMISSION_TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+    return f"ip:{request.META.get('REMOTE_ADDR', 'unknown')}"
+
+
+def scope_identity(scope):
+    """client_identity() for an ASGI connection scope"""
+    if getattr(settings, 'ADMISSION_TRUST_X_FORWARDED_FOR', False):
+        forwarded = dict(scope.get('headers') or []).get(b'x-forwarded-for', b'').decode('latin-1')
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+    client = scope.get('client')
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+_controllers = {}
+_rate_backend = None
+_lock = threading.Lock()
+
+
+def get_rate_backend():
+    global _rate_backend
+    if _rate_backend is None:
+        if getattr(settings, 'RATE_LIMIT_BACKEND', 'memory') == 'redis':
+            _rate_backend = RedisRateLimitBackend(settings.REDIS_URL)
+        else:
+            _rate_backend = InMemoryRateLimitBackend()
+    return _rate_backend
+
+
+def get_controller(endpoint):
+    """Return the endpoint's controller, or None when it has no limits configured"""
+    with _lock:
+        if endpoint not in _controllers:
+            config = getattr(settings, 'ADMISSION_CONTROL', {}).get(endpoint)
+            _controllers[endpoint] = AdmissionController(endpoint, config, get_rate_backend()) if config else None
+        return _controllers[endpoint]
+
+
+def admission_control(endpoint):
+    """Guard a view with the ADMISSION_CONTROL settings for ``endpoint``"""
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            controller = get_controller(endpoint)
+            if controller is None:
+                return view_func(request, *args, **kwargs)
+            try:
+                controller.admit(request)
+            except Rejected as rejection:
+                ADMISSION_TOTAL.inc(endpoint=endpoint, outcome=rejection.reason)
+                response = JsonResponse({
+                    'error': 'Too many requests, please retry shortly' if rejection.status == 429
+                    else 'Service is busy, please retry shortly',
+                    'reason': rejection.reason,
+                }, status=rejection.status)
+                response['Retry-After'] = str(rejection.retry_after)
+                return response
+
+            ADMISSION_TOTAL.inc(endpoint=endpoint, outcome='admitted')
+            handed_off = False
+            try:
+                response = view_func(request, *args, **kwargs)
+                if getattr(response, 'streaming', False):
+                    # Streamed work happens after the view returns; hold the
+                    # slot until the response body is finished or closed.
+                    response.streaming_content = ReleasingIterator(response.streaming_content, controller.release)
+                    handed_off = True
+                return response
+            finally:
+                if not handed_off:
+                    controller.release()
+        return wrapped
+    return decorator
@@ -1,5 +1,8 @@
 """
 ASGI config for trip_mate project.
+
+HTTP requests go to Django; WebSocket connections go to the chat channel
+(see chat.websocket).
 """
 
 import os
@@ -7,5 +10,16 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trip_mate.settings')
+# Server processes build their LLM clients and services at boot, not on the first request
+os.environ.setdefault('WARM_UP_ON_START', 'true')
+
+django_application = get_asgi_application()
+
+from chat.websocket import websocket_application  # noqa: E402  (needs the app registry)
+
 
-application = get_asgi_application()
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
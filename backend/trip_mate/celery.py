@@ -0,0 +1,13 @@
+"""
+Celery application for background jobs
+
+    celery -A trip_mate worker --beat
+"""
+import os
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trip_mate.settings')
+
+app = Celery('trip_mate')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,252 @@
+"""
+Idempotency-Key support for endpoints that start expensive work
+
+Flaky mobile connections and double submits resend the same POST. A request
+carrying an Idempotency-Key header claims that key (scoped to the endpoint
+and the caller) before its view runs. A duplicate that arrives while the
+first request is still running waits for its result instead of starting
+new work, and a duplicate that arrives afterwards gets the stored response
+replayed, marked with an Idempotent-Replayed header. Reusing a key with a
+different body is rejected with 422.
+
+Keys live in Redis (shared by every worker) or in memory for development
+and tests. Server errors and admission rejections are not stored, so a
+retry after one of them runs the request again.
+"""
+import base64
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from . import metrics
+from .admission import client_identity
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_TOTAL = metrics.registry.counter(
+    'tripmate_idempotency_requests_total', 'Requests carrying an Idempotency-Key, by outcome', ['endpoint', 'outcome'])
+IDEMPOTENCY_WAIT_SECONDS = metrics.registry.histogram(
+    'tripmate_idempotency_wait_seconds', 'Time duplicates spent waiting for the in-flight original', ['endpoint'])
+
+OUTCOMES = ('executed', 'replayed', 'coalesced', 'mismatch', 'timeout')
+
+
+class InMemoryIdempotencyStore:
+    """Process-local keys; duplicates wait on an event set by the original"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._pruned = time.monotonic()
+
+    def claim(self, key, fingerprint, lock_ttl):
+        """Returns ('claimed' | 'in_flight' | 'done' | 'mismatch', stored response or None)"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._pruned > 60:
+                self._pruned = now
+                for stale in [k for k, entry in self._entries.items() if entry['expires'] < now]:
+                    del self._entries[stale]
+            entry = self._entries.get(key)
+            if entry is None or entry['expires'] < now:
+                self._entries[key] = {
+                    'fingerprint': fingerprint, 'response': None,
+                    'event': threading.Event(), 'expires': now + lock_ttl,
+                }
+                return 'claimed', None
+            if entry['fingerprint'] != fingerprint:
+                return 'mismatch', None
+            return ('done', entry['response']) if entry['response'] is not None else ('in_flight', None)
+
+    def wait(self, key, timeout):
+        """Wait for an in-flight key; returns ('done', response), ('released', None) or ('timeout', None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return 'released', None
+        if not entry['event'].wait(timeout):
+            return 'timeout', None
+        return ('done', entry['response']) if entry['response'] is not None else ('released', None)
+
+    def complete(self, key, fingerprint, response, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['response'] = response
+                entry['expires'] = time.monotonic() + ttl
+        if entry is not None:
+            entry['event'].set()
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry['event'].set()
+
+
+class RedisIdempotencyStore:
+    """Keys shared by every worker through Redis; duplicates poll for the result"""
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def claim(self, key, fingerprint, lock_ttl):
+        name = f"idempotency:{key}"
+        if self.client.set(name, json.dumps({'fingerprint': fingerprint}), nx=True, ex=lock_ttl):
+            return 'claimed', None
+        return self._state(self.client.get(name), fingerprint)
+
+    def wait(self, key, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            raw = self.client.get(f"idempotency:{key}")
+            if raw is None:
+                return 'released', None
+            record = json.loads(raw)
+            if 'response' in record:
+                return 'done', _decode(record['response'])
+            time.sleep(self.POLL_INTERVAL)
+        return 'timeout', None
+
+    def complete(self, key, fingerprint, response, ttl):
+        record = {'fingerprint': fingerprint, 'response': _encode(response)}
+        self.client.set(f"idempotency:{key}", json.dumps(record), ex=ttl)
+
+    def release(self, key):
+        self.client.delete(f"idempotency:{key}")
+
+    def _state(self, raw, fingerprint):
+        if raw is None:
+            # Expired between the two calls; the caller claims again
+            return 'released', None
+        record = json.loads(raw)
+        if record['fingerprint'] != fingerprint:
+            return 'mismatch', None
+        if 'response' in record:
+            return 'done', _decode(record['response'])
+        return 'in_flight', None
+
+
+def _encode(response):
+    return {**response, 'content': base64.b64encode(response['content']).decode('ascii')}
+
+
+def _decode(response):
+    return {**response, 'content': base64.b64decode(response['content'])}
+
+
+_store = None
+_store_lock = threading.Lock()
+_endpoints = set()
+
+
+def get_idempotency_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if getattr(settings, 'IDEMPOTENCY_BACKEND', 'memory') == 'redis':
+                    _store = RedisIdempotencyStore(settings.REDIS_URL)
+                else:
+                    _store = InMemoryIdempotencyStore()
+    return _store
+
+
+def stats():
+    """Keyed requests per endpoint and outcome, with the duplicates absorbed"""
+    result = {}
+    for endpoint in sorted(_endpoints):
+        counts = {outcome: IDEMPOTENCY_TOTAL.value(endpoint=endpoint, outcome=outcome) for outcome in OUTCOMES}
+        result[endpoint] = {**counts, 'duplicates_absorbed': counts['replayed'] + counts['coalesced']}
+    return result
+
+
+def idempotent(endpoint):
+    """Deduplicate requests to a view that carry an Idempotency-Key header
+
+    Goes outside admission_control, so absorbed duplicates take no rate
+    limit tokens or concurrency slots.
+    """
+    _endpoints.add(endpoint)
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            raw_key = request.META.get(HEADER)
+            if raw_key is None or request.method in ('GET', 'HEAD', 'OPTIONS'):
+                return view_func(request, *args, **kwargs)
+            if not raw_key or len(raw_key) > MAX_KEY_LENGTH:
+                return JsonResponse({'error': f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"}, status=400)
+
+            store = get_idempotency_store()
+            key = f"{endpoint}:{client_identity(request)}:{raw_key}"
+            fingerprint = hashlib.sha256(request.body).hexdigest()
+            lock_ttl = getattr(settings, 'IDEMPOTENCY_LOCK_TTL', 300)
+            started = time.monotonic()
+            deadline = started + getattr(settings, 'IDEMPOTENCY_WAIT', 60.0)
+
+            while True:
+                state, stored = store.claim(key, fingerprint, lock_ttl)
+                if state == 'claimed':
+                    break
+                if state == 'mismatch':
+                    IDEMPOTENCY_TOTAL.inc(endpoint=endpoint, outcome='mismatch')
+                    return JsonResponse(
+                        {'error': 'This Idempotency-Key was already used with a different request body'}, status=422)
+                if state == 'done':
+                    IDEMPOTENCY_TOTAL.inc(endpoint=endpoint, outcome='replayed')
+                    return _replay(stored)
+                if state == 'in_flight':
+                    state, stored = store.wait(key, max(0.0, deadline - time.monotonic()))
+                    if state == 'done':
+                        IDEMPOTENCY_TOTAL.inc(endpoint=endpoint, outcome='coalesced')
+                        IDEMPOTENCY_WAIT_SECONDS.observe(time.monotonic() - started, endpoint=endpoint)
+                        return _replay(stored)
+                    if state == 'timeout':
+                        IDEMPOTENCY_TOTAL.inc(endpoint=endpoint, outcome='timeout')
+                        response = JsonResponse(
+                            {'error': 'A request with this Idempotency-Key is still in progress'}, status=409)
+                        response['Retry-After'] = '1'
+                        return response
+                # Released: the original failed, so this request takes over the key
+
+            IDEMPOTENCY_TOTAL.inc(endpoint=endpoint, outcome='executed')
+            stored = None
+            try:
+                response = view_func(request, *args, **kwargs)
+                stored = _storable(response)
+                return response
+            finally:
+                if stored is not None:
+                    store.complete(key, fingerprint, stored, getattr(settings, 'IDEMPOTENCY_TTL', 3600))
+                else:
+                    store.release(key)
+        return wrapped
+    return decorator
+
+
+def _storable(response):
+    """The parts of a response needed to replay it, or None if it must not be stored"""
+    if getattr(response, 'streaming', False) or response.status_code >= 500 or response.status_code == 429:
+        return None
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    return {
+        'status': response.status_code,
+        'content_type': response.get('Content-Type', 'application/json'),
+        'content': bytes(response.content),
+    }
+
+
+def _replay(stored):
+    response = HttpResponse(stored['content'], status=stored['status'], content_type=stored['content_type'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
@@ -0,0 +1,256 @@
+"""
+Model routing for LLM calls
+
+Every LLM call names a task (intent, activity, qa, generation, ...). Each task has
+an ordered list of model tiers, primary first, each with a timeout and a
+latency budget below it (``budget``, by default LATENCY_BUDGET_RATIO of the
+timeout). When the rolling p95 latency of a tier exceeds its budget the
+router downgrades to the next (faster) tier before calls start timing out,
+sending an occasional probe request to the slow tier so it can recover once
+latency improves. Tiers marked ``json_mode`` use the API's JSON response
+format for calls that expect JSON. Naming a task without tiers is an error.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from . import metrics
+
+# Share of a tier's timeout its p95 may reach before calls are downgraded
+LATENCY_BUDGET_RATIO = 0.8
+
+DEFAULT_MODEL_TIERS = {
+    'generation': [
+        {'model': 'gpt-4', 'timeout': 60.0},
+        {'model': 'gpt-3.5-turbo', 'timeout': 30.0, 'json_mode': True},
+    ],
+    'skeleton': [
+        {'model': 'gpt-3.5-turbo', 'timeout': 10.0, 'json_mode': True},
+    ],
+    'day_plan': [
+        {'model': 'gpt-4', 'timeout': 30.0},
+        {'model': 'gpt-3.5-turbo', 'timeout': 15.0, 'json_mode': True},
+    ],
+    'qa': [
+        {'model': 'gpt-4', 'timeout': 10.0},
+        {'model': 'gpt-3.5-turbo', 'timeout': 6.0},
+    ],
+    'activity': [
+        {'model': 'gpt-3.5-turbo', 'timeout': 8.0, 'json_mode': True},
+    ],
+    'adaptation': [
+        {'model': 'gpt-3.5-turbo', 'timeout': 10.0, 'json_mode': True},
+    ],
+    'intent': [
+        {'model': 'gpt-3.5-turbo', 'timeout': 5.0, 'json_mode': True},
+    ],
+}
+
+
+class LatencyWindow:
+    """Rolling window of recent call latencies"""
+
+    def __init__(self, size=100):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def p95(self):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class ModelRouter:
+    """Routes LLM calls for a task to the fastest healthy model tier"""
+
+    def __init__(self, tiers=None, client=None, window_size=100, min_samples=10, probe_every=20):
+        self.tiers = tiers or {**DEFAULT_MODEL_TIERS, **getattr(settings, 'LLM_MODEL_TIERS', {})}
+        self.window_size = window_size
+        self.min_samples = min_samples
+        self.probe_every = probe_every
+        self._client = client
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._skips = {}
+        self._counters = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            import openai  # Deferred: importing the SDK is a large share of worker boot time
+            self._client = openai.OpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                base_url=settings.OPENAI_BASE_URL or None
+            )
+        return self._client
+
+    def complete(self, task, messages, json_response=False, **kwargs):
+        """Run a chat completion for a task, downgrading tiers as needed
+
+        ``json_response`` requests a JSON object from tiers that support it.
+
+        Raises the last error when every tier fails; callers keep their own
+        template fallbacks for that case.
+        """
+        import openai
+
+        tiers = self.tiers_for(task)
+        last_error = None
+
+        for position, tier in enumerate(tiers):
+            is_last = position == len(tiers) - 1
+            if not is_last and self._should_skip(task, tier):
+                self._count(task, tier['model'], 'downgrades')
+                continue
+
+            options = dict(kwargs)
+            if json_response and tier.get('json_mode'):
+                options['response_format'] = {'type': 'json_object'}
+
+            started = time.monotonic()
+            try:
+                with metrics.span(f"llm.{task}"):
+                    response = self.client.with_options(timeout=tier['timeout'], max_retries=0) \
+                        .chat.completions.create(model=tier['model'], messages=messages, **options)
+            except openai.APITimeoutError as e:
+                self._record(task, tier, time.monotonic() - started, 'timeouts')
+                last_error = e
+                continue
+            except openai.OpenAIError as e:
+                self._record(task, tier, time.monotonic() - started, 'errors')
+                last_error = e
+                continue
+
+            self._record(task, tier, time.monotonic() - started, 'calls')
+            metrics.record_tokens(task, getattr(response, 'usage', None))
+            return response
+
+        raise last_error or RuntimeError(f"No model tiers configured for task '{task}'")
+
+    def stream(self, task, messages, **kwargs):
+        """Stream the text of a chat completion for a task as it is generated
+
+        Tiers are tried in order until one produces its first chunk; after
+        that the stream is committed to that tier and errors propagate. The
+        tier's latency window gets the time to the first chunk, which is
+        what its timeout bounds; the rest depends on the answer's length
+        and on how fast the consumer reads.
+        """
+        import openai
+
+        tiers = self.tiers_for(task)
+        last_error = None
+
+        for position, tier in enumerate(tiers):
+            is_last = position == len(tiers) - 1
+            if not is_last and self._should_skip(task, tier):
+                self._count(task, tier['model'], 'downgrades')
+                continue
+
+            started = time.monotonic()
+            try:
+                with metrics.span(f"llm.{task}.first_token"):
+                    chunks = self.client.with_options(timeout=tier['timeout'], max_retries=0) \
+                        .chat.completions.create(model=tier['model'], messages=messages, stream=True, **kwargs)
+                    iterator = iter(chunks)
+                    first = next(iterator, None)
+            except openai.APITimeoutError as e:
+                self._record(task, tier, time.monotonic() - started, 'timeouts')
+                last_error = e
+                continue
+            except openai.OpenAIError as e:
+                self._record(task, tier, time.monotonic() - started, 'errors')
+                last_error = e
+                continue
+
+            self._observe(task, tier, time.monotonic() - started)
+            outcome = 'errors'
+            try:
+                for chunk in itertools.chain([first] if first is not None else [], iterator):
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        yield text
+                outcome = 'calls'
+            except GeneratorExit:
+                # The consumer stopped early; the tier did nothing wrong
+                outcome = 'calls'
+                raise
+            finally:
+                # Release the HTTP connection even if the consumer stops early
+                chunks.response.close()
+                self._count(task, tier['model'], outcome)
+            return
+
+        raise last_error or RuntimeError(f"No model tiers configured for task '{task}'")
+
+    def tiers_for(self, task):
+        tiers = self.tiers.get(task)
+        if not tiers:
+            # A typo must not end up on another task's model and timeout
+            raise ValueError(f"No model tiers configured for task '{task}'")
+        return tiers
+
+    def stats(self):
+        """Snapshot of routing decisions and latencies per task and model"""
+        with self._lock:
+            snapshot = {}
+            for (task, model), counters in self._counters.items():
+                window = self._windows.get((task, model))
+                snapshot.setdefault(task, {})[model] = {
+                    **counters,
+                    'p95_seconds': round(window.p95(), 4) if window else 0.0,
+                    'samples': len(window) if window else 0,
+                }
+            return snapshot
+
+    def _should_skip(self, task, tier):
+        key = (task, tier['model'])
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or len(window) < self.min_samples or window.p95() < _budget(tier):
+                return False
+            # Let every Nth request through so the window can recover.
+            self._skips[key] = self._skips.get(key, 0) + 1
+            return self._skips[key] % self.probe_every != 0
+
+    def _record(self, task, tier, elapsed, outcome):
+        # A timed-out call counts as at least its whole budget.
+        self._observe(task, tier, max(elapsed, tier['timeout']) if outcome == 'timeouts' else elapsed)
+        self._count(task, tier['model'], outcome)
+
+    def _observe(self, task, tier, elapsed):
+        with self._lock:
+            self._windows.setdefault((task, tier['model']), LatencyWindow(self.window_size)).add(elapsed)
+
+    def _count(self, task, model, outcome):
+        with self._lock:
+            counters = self._counters.setdefault((task, model), {
+                'calls': 0, 'errors': 0, 'timeouts': 0, 'downgrades': 0
+            })
+            counters[outcome] += 1
+        metrics.LLM_ROUTING.inc(task=task, model=model, outcome=outcome)
+
+
+def _budget(tier):
+    return tier.get('budget', tier['timeout'] * LATENCY_BUDGET_RATIO)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Return the process-wide model router"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter()
+    return _router
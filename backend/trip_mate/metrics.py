@@ -0,0 +1,190 @@
+"""
+In-process metrics and tracing spans
+
+Counters and histograms live in a process-wide registry and are exported in
+the Prometheus text format by the /metrics view. ``span()`` times a block of
+work, records it in a latency histogram labelled with the current endpoint,
+and adds it to the per-request timing summary kept by RequestMetricsMiddleware.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_request_timing = ContextVar('tripmate_request_timing', default=None)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    labels = _format_labels(self.labelnames + ('le',), key + (le,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+    def _get_or_create(self, metric_class, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, labelnames, **kwargs)
+            return metric
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'tripmate_request_seconds', 'HTTP request latency', ['endpoint', 'method', 'status'])
+REQUEST_DB_QUERIES = registry.counter(
+    'tripmate_request_db_queries_total', 'Database queries issued by requests', ['endpoint'])
+SPAN_SECONDS = registry.histogram(
+    'tripmate_span_seconds', 'Latency of instrumented operations', ['span', 'endpoint'])
+LLM_TOKENS = registry.counter(
+    'tripmate_llm_tokens_total', 'LLM tokens used', ['task', 'endpoint', 'kind'])
+LLM_FALLBACKS = registry.counter(
+    'tripmate_llm_fallbacks_total', 'LLM calls answered by a local fallback', ['task', 'endpoint'])
+LLM_ROUTING = registry.counter(
+    'tripmate_llm_routing_total', 'Model routing outcomes per task and model', ['task', 'model', 'outcome'])
+CACHE_REQUESTS = registry.counter(
+    'tripmate_cache_requests_total', 'Cache lookups by result', ['cache', 'result'])
+
+
+def current_endpoint():
+    timing = _request_timing.get()
+    return timing['endpoint'] if timing else 'none'
+
+
+@contextmanager
+def span(name):
+    """Time a block of work and record it under the current endpoint"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timing = _request_timing.get()
+        SPAN_SECONDS.observe(elapsed, span=name, endpoint=timing['endpoint'] if timing else 'none')
+        if timing is not None:
+            spans = timing['spans']
+            spans[name] = spans.get(name, 0.0) + elapsed
+
+
+def record_tokens(task, usage):
+    """Count prompt and completion tokens from an OpenAI usage object"""
+    if usage is None:
+        return
+    endpoint = current_endpoint()
+    LLM_TOKENS.inc(getattr(usage, 'prompt_tokens', 0) or 0, task=task, endpoint=endpoint, kind='prompt')
+    LLM_TOKENS.inc(getattr(usage, 'completion_tokens', 0) or 0, task=task, endpoint=endpoint, kind='completion')
+
+
+def record_fallback(task):
+    LLM_FALLBACKS.inc(task=task, endpoint=current_endpoint())
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def start_request(endpoint):
+    """Begin collecting spans for the current request; returns a reset token"""
+    return _request_timing.set({'endpoint': endpoint, 'spans': {}})
+
+
+def set_endpoint(endpoint):
+    timing = _request_timing.get()
+    if timing is not None:
+        timing['endpoint'] = endpoint
+
+
+def finish_request(token):
+    """Stop collecting spans and return the request's timing summary"""
+    timing = _request_timing.get()
+    _request_timing.reset(token)
+    return timing
@@ -0,0 +1,111 @@
+"""
+Project-wide middleware
+"""
+import json
+import logging
+import random
+import time
+from django.conf import settings
+from django.db import connection
+from . import metrics, profiling
+
+timing_logger = logging.getLogger('trip_mate.timing')
+
+
+class RequestMetricsMiddleware:
+    """Record request latency, DB query counts and per-request span timings
+
+    With REQUEST_TIMING_LOG enabled, each request also emits one structured
+    JSON log line on the ``trip_mate.timing`` logger.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.log_timings = getattr(settings, 'REQUEST_TIMING_LOG', False)
+
+    def __call__(self, request):
+        token = metrics.start_request('unmatched')
+        db = [0, 0.0]
+
+        def track_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db[0] += 1
+                db[1] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        status = 500
+        try:
+            with connection.execute_wrapper(track_query):
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            timing = metrics.finish_request(token)
+            endpoint = timing['endpoint']
+            metrics.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=status)
+            metrics.REQUEST_DB_QUERIES.inc(db[0], endpoint=endpoint)
+            if self.log_timings:
+                timing_logger.info(json.dumps({
+                    'endpoint': endpoint,
+                    'method': request.method,
+                    'path': request.path,
+                    'status': status,
+                    'duration_ms': round(elapsed * 1000, 2),
+                    'db_queries': db[0],
+                    'db_ms': round(db[1] * 1000, 2),
+                    'spans_ms': {name: round(seconds * 1000, 2) for name, seconds in timing['spans'].items()},
+                }))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if match is not None:
+            metrics.set_endpoint(match.url_name or match.view_name)
+        return None
+
+
+class ProfilingMiddleware:
+    """Profile a sample of requests, and any request with a signed debug header
+
+    Goes first in MIDDLEWARE so that the other middleware and rendering are
+    part of the profile. Profiled responses carry an X-TripMate-Profile-Id
+    header naming the stored profile.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+        self.max_active = getattr(settings, 'PROFILE_MAX_ACTIVE', 4)
+
+    def __call__(self, request):
+        token = request.META.get(profiling.TOKEN_HEADER)
+        if token is not None and profiling.verify_token(token):
+            reason = 'requested'
+        elif self.sample_rate and random.random() < self.sample_rate:
+            reason = 'sampled'
+        else:
+            return self.get_response(request)
+
+        sampler = profiling.get_sampler()
+        if reason == 'sampled' and sampler.active >= self.max_active:
+            return self.get_response(request)
+        profile = sampler.start(reason)
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+        finally:
+            sampler.stop()
+            match = request.resolver_match
+            endpoint = (match.url_name or match.view_name) if match is not None else 'unmatched'
+            try:
+                profile_id = profiling.ProfileStore().save(endpoint, profile, request, status, sampler.interval)
+            except OSError:
+                timing_logger.exception("Could not store request profile")
+                profile_id = None
+        if profile_id is not None:
+            response['X-TripMate-Profile-Id'] = f"{endpoint}/{profile_id}"
+        return response
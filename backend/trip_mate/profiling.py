@@ -0,0 +1,301 @@
+"""
+Sampled request profiling
+
+A small share of requests (PROFILE_SAMPLE_RATE), plus any request carrying
+a valid signed X-TripMate-Profile header, is profiled by a sampling
+profiler: one background thread snapshots the request thread's stack every
+PROFILE_INTERVAL seconds, so the profiled code runs untouched. Unsampled
+requests pay for one random number and a header lookup.
+
+Each profile records its stacks and a breakdown of samples by where the
+time went (view code, PlanEngine, TripMateService, LLM calls, the ORM,
+rendering) and is written under PROFILE_DIR/<endpoint>/. The newest
+PROFILE_KEEP profiles per endpoint are kept, for download as collapsed
+stacks (flamegraph.pl, speedscope) or speedscope JSON.
+"""
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from django.conf import settings
+
+
+TOKEN_HEADER = 'HTTP_X_TRIPMATE_PROFILE'
+
+# Checked leaf first: a sample belongs to the innermost frame that matches.
+# Helpers such as geocoding or weather match nothing, so they count towards
+# whichever of these called them.
+CATEGORIES = [
+    ('orm', ('/django/db/',)),
+    ('render', ('/rest_framework/renderers.py', '/trip_mate/renderers.py', '/django/template/')),
+    ('llm', ('/openai/', '/httpx/', '/httpcore/', '/trip_mate/llm.py')),
+    ('plan_engine', ('/itinerary/services.py', '/itinerary/fanout.py', '/itinerary/bulk.py')),
+    ('trip_mate_service', ('/chat/services.py', '/chat/resolver.py')),
+    ('view', ('/views.py', '/rest_framework/decorators.py')),
+]
+
+
+def sign_token(ttl=600):
+    """A debug header value that asks for profiling until it expires"""
+    expires = str(int(time.time() + ttl))
+    return f"{expires}.{_signature(expires)}"
+
+
+def verify_token(token):
+    expires, _, signature = (token or '').partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(expires))
+
+
+def _signature(expires):
+    secret = getattr(settings, 'PROFILE_SECRET', '') or settings.SECRET_KEY
+    return hmac.new(secret.encode(), f"profile:{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+class Profile:
+    """Stack samples of one request"""
+
+    def __init__(self, reason):
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.stacks = Counter()
+
+    def add(self, frame, describe):
+        stack = []
+        while frame is not None:
+            stack.append(describe(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks[tuple(stack)] += 1
+
+
+class Sampler:
+    """One thread that samples the stacks of every request being profiled"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}
+        self._codes = {}  # code object -> (name, file, first line, category)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, reason):
+        """Profile the calling thread until stop()"""
+        profile = Profile(reason)
+        with self._lock:
+            self._active[threading.get_ident()] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return profile
+
+    def stop(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    @property
+    def active(self):
+        return len(self._active)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                active = dict(self._active)
+                if not active:
+                    # Idle until the next profiled request
+                    self._wake.clear()
+                    continue
+            frames = sys._current_frames()
+            for ident, profile in active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    profile.add(frame, self._describe)
+            del frames
+            time.sleep(self.interval)
+
+    def _describe(self, code):
+        described = self._codes.get(code)
+        if described is None:
+            described = (code.co_name, _short_path(code.co_filename), code.co_firstlineno)
+            self._codes[code] = described
+        return described
+
+
+def _short_path(filename):
+    filename = filename.replace(os.sep, '/')
+    if 'site-packages/' in filename:
+        return filename.split('site-packages/', 1)[1]
+    base = str(settings.BASE_DIR).replace(os.sep, '/') + '/'
+    return filename[len(base):] if filename.startswith(base) else filename
+
+
+def category(stack):
+    """Where a sampled stack spent its time, judged by its innermost known frame"""
+    for _, filename, _ in reversed(stack):
+        path = '/' + filename
+        for name, patterns in CATEGORIES:
+            if any(pattern in path for pattern in patterns):
+                return name
+    return 'other'
+
+
+class ProfileStore:
+    """Profiles on disk under one directory per endpoint, newest PROFILE_KEEP kept"""
+
+    def __init__(self, directory=None, keep=None):
+        self.directory = str(directory or settings.PROFILE_DIR)
+        self.keep = keep or getattr(settings, 'PROFILE_KEEP', 20)
+
+    def save(self, endpoint, profile, request, status, interval):
+        frames, index, stacks = [], {}, []
+        for stack, count in profile.stacks.most_common():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append(list(frame))
+                ids.append(index[frame])
+            stacks.append([ids, count])
+        breakdown = Counter()
+        for stack, count in profile.stacks.items():
+            breakdown[category(stack)] += count
+
+        profile_id = f"{int(profile.started_at * 1000)}-{uuid.uuid4().hex[:8]}"
+        record = {
+            'id': profile_id,
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': status,
+            'reason': profile.reason,
+            'started_at': profile.started_at,
+            'duration_ms': round((time.perf_counter() - profile.started) * 1000, 2),
+            'interval_ms': interval * 1000,
+            'samples': sum(profile.stacks.values()),
+            'breakdown': dict(breakdown.most_common()),
+            'frames': frames,
+            'stacks': stacks,
+        }
+        directory = os.path.join(self.directory, endpoint)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{profile_id}.json"), 'w') as f:
+            json.dump(record, f, separators=(',', ':'))
+        for stale in sorted(os.listdir(directory), reverse=True)[self.keep:]:
+            try:
+                os.remove(os.path.join(directory, stale))
+            except FileNotFoundError:
+                pass
+        return profile_id
+
+    def list(self, endpoint=None):
+        """Profile summaries, newest first"""
+        summaries = []
+        for name in self._endpoints() if endpoint is None else [endpoint]:
+            for profile_id in self._ids(name):
+                record = self.load(name, profile_id)
+                if record is not None:
+                    summaries.append({key: value for key, value in record.items() if key not in ('frames', 'stacks')})
+        return sorted(summaries, key=lambda summary: summary['started_at'], reverse=True)
+
+    def load(self, endpoint, profile_id):
+        if not _safe_name(endpoint) or not _safe_name(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, endpoint, f"{profile_id}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def load_all(self, endpoint):
+        """Every stored profile of an endpoint"""
+        if not _safe_name(endpoint):
+            return []
+        return [record for record in (self.load(endpoint, i) for i in self._ids(endpoint)) if record is not None]
+
+    def _endpoints(self):
+        try:
+            return sorted(name for name in os.listdir(self.directory) if _safe_name(name))
+        except FileNotFoundError:
+            return []
+
+    def _ids(self, endpoint):
+        try:
+            names = os.listdir(os.path.join(self.directory, endpoint))
+        except FileNotFoundError:
+            return []
+        return sorted((name[:-5] for name in names if name.endswith('.json')), reverse=True)
+
+
+def _safe_name(name):
+    return bool(name) and all(c.isalnum() or c in '-_.' for c in name) and not name.startswith('.')
+
+
+def collapsed(records):
+    """Folded stacks, one "frame;frame;frame count" line per distinct stack"""
+    totals = Counter()
+    for record in records:
+        for ids, count in record['stacks']:
+            totals[';'.join(_label(record['frames'][i]) for i in ids)] += count
+    return ''.join(f"{stack} {count}\n" for stack, count in totals.most_common())
+
+
+def speedscope(records, name):
+    """speedscope file with one sampled profile per request"""
+    frames, index = [], {}
+    profiles = []
+    for record in records:
+        samples, weights = [], []
+        for ids, count in record['stacks']:
+            stack = []
+            for i in ids:
+                key = tuple(record['frames'][i])
+                if key not in index:
+                    index[key] = len(frames)
+                    frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+                stack.append(index[key])
+            samples.append(stack)
+            weights.append(count * record['interval_ms'])
+        profiles.append({
+            'type': 'sampled',
+            'name': f"{record['method']} {record['path']} ({record['id']})",
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        })
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'tripmate',
+        'shared': {'frames': frames},
+        'profiles': profiles,
+    }
+
+
+def _label(frame):
+    name, filename, line = frame
+    return f"{name} ({filename}:{line})"
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = Sampler(getattr(settings, 'PROFILE_INTERVAL', 0.005))
+    return _sampler
@@ -0,0 +1,26 @@
+"""
+Prompt templates compiled once at import
+
+Templates are dedented (so indentation is not sent as tokens) and split into
+literal text and field names when the module loads; rendering is a single
+join. Fields use str.format syntax, with literal braces doubled.
+"""
+import string
+import textwrap
+
+
+class PromptTemplate:
+    def __init__(self, text):
+        self.text = textwrap.dedent(text).strip()
+        self.parts = []
+        for literal, field, spec, conversion in string.Formatter().parse(self.text):
+            if literal:
+                self.parts.append((True, literal))
+            if field is not None:
+                if spec or conversion or not field.isidentifier():
+                    raise ValueError(f"Prompt fields must be plain names, got {{{field}}}")
+                self.parts.append((False, field))
+        self.fields = {value for is_literal, value in self.parts if not is_literal}
+
+    def render(self, **values):
+        return ''.join(value if is_literal else str(values[value]) for is_literal, value in self.parts)
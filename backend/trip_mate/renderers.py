@@ -0,0 +1,10 @@
+from rest_framework.renderers import JSONRenderer
+from .metrics import span
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that records serialization time as a span"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span('json.render'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -3,7 +3,9 @@ Django settings for trip_mate project.
 """
 
 from pathlib import Path
+from corsheaders.defaults import default_headers as default_cors_headers
 from decouple import config
+import json
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -29,9 +31,13 @@ INSTALLED_APPS = [
     'corsheaders',
     'itinerary',
     'chat',
+    'search',
+    'retention',
 ]
 
 MIDDLEWARE = [
+    'trip_mate.middleware.ProfilingMiddleware',
+    'trip_mate.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -61,6 +67,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'trip_mate.wsgi.application'
+ASGI_APPLICATION = 'trip_mate.asgi.application'
 
 # Database
 DATABASES = {
@@ -106,11 +113,12 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_cors_headers, 'idempotency-key')
 
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'trip_mate.renderers.TimedJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
@@ -119,8 +127,157 @@ REST_FRAMEWORK = {
 
 # External API Keys
 OPENAI_API_KEY = config('OPENAI_API_KEY', default='')
+OPENAI_BASE_URL = config('OPENAI_BASE_URL', default='')  # e.g. the benchmark stand-in server
+# Per-task model tiers, primary first, e.g.
+# {"intent": [{"model": "gpt-3.5-turbo", "timeout": 5, "budget": 3}], "generation": [...]}
+# A tier is skipped while its p95 latency is over "budget" (default 0.8 of
+# "timeout"). Unset tasks use trip_mate.llm.DEFAULT_MODEL_TIERS.
+LLM_MODEL_TIERS = config('LLM_MODEL_TIERS', default='{}', cast=json.loads)
+# Trips of at least FANOUT_MIN_DAYS are planned skeleton-first with days
+# generated concurrently, up to FANOUT_MAX_PARALLEL LLM calls at once
+FANOUT_MIN_DAYS = config('FANOUT_MIN_DAYS', default=5, cast=int)
+FANOUT_MAX_PARALLEL = config('FANOUT_MAX_PARALLEL', default=8, cast=int)
+# Bulk generation: items per batch, concurrent generations per batch, how
+# many finished itineraries are inserted per bulk_create, and how long a run
+# holds its claim on an item before a resume may take it over
+BULK_GENERATION_MAX_ITEMS = config('BULK_GENERATION_MAX_ITEMS', default=500, cast=int)
+BULK_GENERATION_WORKERS = config('BULK_GENERATION_WORKERS', default=4, cast=int)
+BULK_GENERATION_INSERT_CHUNK = config('BULK_GENERATION_INSERT_CHUNK', default=25, cast=int)
+BULK_GENERATION_CLAIM_TTL = config('BULK_GENERATION_CLAIM_TTL', default=600, cast=int)
 WEATHER_API_KEY = config('WEATHER_API_KEY', default='')
+# Forecast provider for weather-aware adjustments: 'openweathermap' (needs
+# WEATHER_API_KEY), 'fixture' for tests and benchmarks, or '' to disable
+WEATHER_PROVIDER = config('WEATHER_PROVIDER', default='openweathermap')
+WEATHER_FIXTURE_PATH = config('WEATHER_FIXTURE_PATH', default='')
+WEATHER_CACHE_TTL = config('WEATHER_CACHE_TTL', default=3 * 60 * 60, cast=int)
+# Seconds a failed provider call is remembered before the next try (0 = not at all)
+WEATHER_FAILURE_TTL = config('WEATHER_FAILURE_TTL', default=60, cast=int)
+WEATHER_BAD_PRECIPITATION = config('WEATHER_BAD_PRECIPITATION', default=0.6, cast=float)
 MAPBOX_API_KEY = config('MAPBOX_API_KEY', default='')
+# Geocoding provider for activity locations: 'mapbox' (needs MAPBOX_API_KEY),
+# 'local' stand-in for tests and benchmarks, or '' to disable
+GEOCODING_PROVIDER = config('GEOCODING_PROVIDER', default='mapbox')
+GEOCODING_LRU_SIZE = config('GEOCODING_LRU_SIZE', default=4096, cast=int)
+GEOCODING_BATCH_SIZE = config('GEOCODING_BATCH_SIZE', default=50, cast=int)
+# Seconds before a place the provider could not find is looked up again
+GEOCODING_MISS_TTL = config('GEOCODING_MISS_TTL', default=7 * 24 * 60 * 60, cast=int)
+
+# Similarity-based reuse of stored itineraries: matches at or above
+# ITINERARY_REUSE_ADAPT_SIMILARITY (Jaccard over interests, duration and
+# budget bands) are adapted locally; matches at or above
+# ITINERARY_REUSE_EDIT_SIMILARITY are adapted by a short LLM edit prompt.
+# Only itineraries never edited and generated without constraints are reused
+ITINERARY_REUSE = config('ITINERARY_REUSE', default=True, cast=bool)
+ITINERARY_REUSE_ADAPT_SIMILARITY = config('ITINERARY_REUSE_ADAPT_SIMILARITY', default=0.8, cast=float)
+ITINERARY_REUSE_EDIT_SIMILARITY = config('ITINERARY_REUSE_EDIT_SIMILARITY', default=0.5, cast=float)
+# Seconds between checks for itineraries other processes created or changed
+ITINERARY_REUSE_REFRESH = config('ITINERARY_REUSE_REFRESH', default=30, cast=int)
+
+# Largest number of pyramid cells one map viewport query may cover
+MAP_VIEWPORT_MAX_CELLS = config('MAP_VIEWPORT_MAX_CELLS', default=4096, cast=int)
 
 # Redis configuration for caching
 REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+# Shared cache ('redis' across workers, or per-process 'memory')
+CACHE_BACKEND = config('CACHE_BACKEND', default='memory')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if CACHE_BACKEND == 'redis' else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Admission control for LLM-backed endpoints. Concurrency and queue limits are
+# per worker process; rate limits (requests/second per user or IP, with a burst
+# allowance) are shared through Redis when RATE_LIMIT_BACKEND is 'redis'.
+ADMISSION_CONTROL = {
+    'generate': {'concurrency': 4, 'queue': 8, 'max_wait': 10.0, 'rate': 0.1, 'burst': 5},
+    'chat_send': {'concurrency': 16, 'queue': 32, 'max_wait': 5.0, 'rate': 1.0, 'burst': 10},
+    'generate_bulk': {'concurrency': 2, 'queue': 2, 'max_wait': 1.0, 'rate': 0.05, 'burst': 5},
+}
+RATE_LIMIT_BACKEND = config('RATE_LIMIT_BACKEND', default='memory')  # 'memory' or 'redis'
+ADMISSION_TRUST_X_FORWARDED_FOR = config('ADMISSION_TRUST_X_FORWARDED_FOR', default=False, cast=bool)
+
+# Idempotency-Key handling for generate and chat send: how long completed
+# responses are replayed, how long a claimed key is held by an unfinished
+# request, and how long a duplicate waits for the in-flight original
+IDEMPOTENCY_BACKEND = config('IDEMPOTENCY_BACKEND', default='memory')  # 'memory' or 'redis'
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', default=3600, cast=int)
+IDEMPOTENCY_LOCK_TTL = config('IDEMPOTENCY_LOCK_TTL', default=300, cast=int)
+IDEMPOTENCY_WAIT = config('IDEMPOTENCY_WAIT', default=60.0, cast=float)
+
+# WebSocket chat (/ws/chat/<session_id>/): heartbeat interval, how long a
+# silent client is kept, and outgoing queue size / max wait for slow clients
+WEBSOCKET_HEARTBEAT = config('WEBSOCKET_HEARTBEAT', default=20.0, cast=float)
+WEBSOCKET_IDLE_TIMEOUT = config('WEBSOCKET_IDLE_TIMEOUT', default=60.0, cast=float)
+WEBSOCKET_SEND_QUEUE = config('WEBSOCKET_SEND_QUEUE', default=256, cast=int)
+WEBSOCKET_SEND_TIMEOUT = config('WEBSOCKET_SEND_TIMEOUT', default=10.0, cast=float)
+
+# Retention: days to keep each kind of cold row (None disables a policy).
+# Messages of active sessions are never removed by age.
+# Rows are archived to RETENTION_ARCHIVE_DIR as gzipped JSONL, then deleted
+# RETENTION_BATCH_SIZE rows per transaction.
+RETENTION_POLICIES = {
+    'inactive_itineraries': config('RETENTION_INACTIVE_ITINERARY_DAYS', default=90, cast=int),
+    'ended_chat_sessions': config('RETENTION_ENDED_SESSION_DAYS', default=30, cast=int),
+    'chat_messages': config('RETENTION_CHAT_MESSAGE_DAYS', default=180, cast=int),
+    'itinerary_edits': config('RETENTION_ITINERARY_EDIT_DAYS', default=180, cast=int),
+}
+RETENTION_ARCHIVE_DIR = config('RETENTION_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+RETENTION_BATCH_SIZE = config('RETENTION_BATCH_SIZE', default=500, cast=int)
+RETENTION_BATCH_PAUSE = config('RETENTION_BATCH_PAUSE', default=0.1, cast=float)
+
+# Celery (background jobs)
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=REDIS_URL)
+CELERY_BEAT_SCHEDULE = {
+    'enforce-retention': {'task': 'retention.enforce', 'schedule': 24 * 60 * 60},
+}
+
+# Chat turns are persisted write-behind: messages are journaled to
+# CHAT_JOURNAL_DIR and bulk-inserted every CHAT_FLUSH_INTERVAL seconds (0
+# writes synchronously) or once CHAT_FLUSH_BATCH_SIZE are queued. Session
+# state is cached for CHAT_STATE_TTL seconds. Itinerary edits are only
+# written behind with CACHE_BACKEND=redis, where every worker sees the same
+# version claims; with the per-process memory cache they are saved at once.
+CHAT_FLUSH_INTERVAL = config('CHAT_FLUSH_INTERVAL', default=0.5, cast=float)
+CHAT_FLUSH_BATCH_SIZE = config('CHAT_FLUSH_BATCH_SIZE', default=200, cast=int)
+CHAT_JOURNAL_DIR = config('CHAT_JOURNAL_DIR', default=str(BASE_DIR / 'journal'))
+CHAT_JOURNAL_FSYNC = config('CHAT_JOURNAL_FSYNC', default=True, cast=bool)
+CHAT_STATE_TTL = config('CHAT_STATE_TTL', default=600, cast=int)
+
+# Build process-wide services (LLM client, PlanEngine, TripMate) in a
+# background thread at startup; wsgi.py and asgi.py turn this on
+WARM_UP_ON_START = config('WARM_UP_ON_START', default=False, cast=bool)
+
+# Full-text search backend ('sqlite' or 'postgresql'); defaults to the database vendor
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='')
+
+# Emit one structured JSON timing line per request on the trip_mate.timing logger
+REQUEST_TIMING_LOG = config('REQUEST_TIMING_LOG', default=False, cast=bool)
+
+# Sampling profiler: the share of requests profiled (requests with a header
+# from trip_mate.profiling.sign_token() always are), the sampling interval
+# in seconds, and where the newest PROFILE_KEEP profiles per endpoint go.
+# PROFILE_SECRET signs debug headers and defaults to SECRET_KEY.
+PROFILE_SAMPLE_RATE = config('PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+PROFILE_INTERVAL = config('PROFILE_INTERVAL', default=0.005, cast=float)
+PROFILE_MAX_ACTIVE = config('PROFILE_MAX_ACTIVE', default=4, cast=int)
+PROFILE_DIR = config('PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILE_KEEP = config('PROFILE_KEEP', default=20, cast=int)
+PROFILE_SECRET = config('PROFILE_SECRET', default='')
+# /metrics and /api/llm/routing/ are for staff users, signed debug headers,
+# and these client addresses (REMOTE_ADDR, e.g. the Prometheus scraper)
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='', cast=lambda v: [s.strip() for s in v.split(',') if s.strip()])
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'trip_mate.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -3,9 +3,16 @@ URL configuration for trip_mate project.
 """
 from django.contrib import admin
 from django.urls import path, include
+from . import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/itinerary/', include('itinerary.urls')),
     path('api/chat/', include('chat.urls')),
+    path('api/search/', include('search.urls')),
+    path('api/llm/routing/', views.llm_routing_stats, name='llm_routing_stats'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
+    path('api/profiles/', views.list_profiles, name='list_profiles'),
+    path('api/profiles/<str:endpoint>/', views.download_profile, name='download_endpoint_profiles'),
+    path('api/profiles/<str:endpoint>/<str:profile_id>/', views.download_profile, name='download_profile'),
 ]
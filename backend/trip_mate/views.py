@@ -0,0 +1,75 @@
+import json
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from . import idempotency, metrics, profiling
+from .llm import get_router
+
+METRICS_FORBIDDEN = 'A staff user, a signed X-TripMate-Profile header or an address in METRICS_ALLOWED_IPS is required'
+
+
+@api_view(['GET'])
+def llm_routing_stats(request):
+    """Model routing decisions and latencies per task and model, itinerary reuse and absorbed duplicates"""
+    from itinerary.reuse import tracker
+
+    if not _may_read_metrics(request):
+        return Response({'error': METRICS_FORBIDDEN}, status=403)
+    return Response({
+        'routing': get_router().stats(),
+        'reuse': tracker.stats(),
+        'idempotency': idempotency.stats(),
+    })
+
+
+def prometheus_metrics(request):
+    """Export metrics in the Prometheus text format"""
+    if not _may_read_metrics(request):
+        return JsonResponse({'error': METRICS_FORBIDDEN}, status=403)
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _may_read_profiles(request):
+    # Profiles expose code paths: staff users or holders of a debug token only
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    return profiling.verify_token(request.META.get(profiling.TOKEN_HEADER))
+
+
+def _may_read_metrics(request):
+    # Traffic, model names and token spend: as for profiles, or an allowlisted scraper
+    if request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', []):
+        return True
+    return _may_read_profiles(request)
+
+
+def list_profiles(request):
+    """Stored request profiles, newest first (optionally for one ?endpoint=)"""
+    if not _may_read_profiles(request):
+        return JsonResponse({'error': 'A staff user or a signed X-TripMate-Profile header is required'}, status=403)
+    return JsonResponse({'profiles': profiling.ProfileStore().list(request.GET.get('endpoint'))})
+
+
+def download_profile(request, endpoint, profile_id=None):
+    """One profile, or all stored profiles of an endpoint, as ?format=speedscope (default) or collapsed"""
+    if not _may_read_profiles(request):
+        return JsonResponse({'error': 'A staff user or a signed X-TripMate-Profile header is required'}, status=403)
+    store = profiling.ProfileStore()
+    if profile_id is None:
+        records = store.load_all(endpoint)
+    else:
+        record = store.load(endpoint, profile_id)
+        records = [record] if record is not None else []
+    if not records:
+        raise Http404
+    name = endpoint if profile_id is None else f"{endpoint}-{profile_id}"
+
+    if request.GET.get('format') == 'collapsed':
+        response = HttpResponse(profiling.collapsed(records), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{name}.folded"'
+    else:
+        response = HttpResponse(json.dumps(profiling.speedscope(records, name)), content_type='application/json')
+        response['Content-Disposition'] = f'attachment; filename="{name}.speedscope.json"'
+    return response
@@ -7,5 +7,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trip_mate.settings')
+# Server processes build their LLM clients and services at boot, not on the first request
+os.environ.setdefault('WARM_UP_ON_START', 'true')
 
 application = get_wsgi_application()
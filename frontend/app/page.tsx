@@ -89,6 +89,7 @@ export default function Home() {
             itinerary={itinerary} 
             onStartChat={handleStartChat}
             onBackToWizard={() => setCurrentStep('wizard')}
+            onItineraryUpdated={setItinerary}
           />
         )}
         
@@ -1,18 +1,84 @@
 'use client'
 
-import { useState } from 'react'
-import { MapPin, Clock, DollarSign, MessageCircle, ArrowLeft, Map, Calendar, Star } from 'lucide-react'
+import { useState, useRef } from 'react'
+import { MapPin, Clock, DollarSign, MessageCircle, ArrowLeft, Map, Calendar, Star, Trash2 } from 'lucide-react'
 import ItineraryMap from './ItineraryMap'
+import { applyPatch } from '@/lib/jsonPatch'
 
 interface ItineraryResultsProps {
   itinerary: any
   onStartChat: (session: any) => void
   onBackToWizard: () => void
+  onItineraryUpdated?: (itinerary: any) => void
 }
 
-export default function ItineraryResults({ itinerary, onStartChat, onBackToWizard }: ItineraryResultsProps) {
+export default function ItineraryResults({ itinerary: initialItinerary, onStartChat, onBackToWizard, onItineraryUpdated }: ItineraryResultsProps) {
   const [activeTab, setActiveTab] = useState<'schedule' | 'map'>('schedule')
   const [isStartingChat, setIsStartingChat] = useState(false)
+  const [isEditing, setIsEditing] = useState(false)
+  const [itinerary, setItinerary] = useState(initialItinerary)
+  // Version of itinerary on the server; edits sent with it come back as a patch
+  const itineraryVersion = useRef<number | undefined>(initialItinerary.version)
+
+  const showItinerary = (next: any, version: number | undefined) => {
+    itineraryVersion.current = version
+    setItinerary(next)
+    onItineraryUpdated?.(next)
+  }
+
+  const reloadItinerary = async () => {
+    const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/itinerary/${itinerary.id}/`)
+    if (!response.ok) {
+      throw new Error('Failed to load itinerary')
+    }
+    const data = await response.json()
+    showItinerary({ ...data.generated_data, id: data.itinerary.id, version: data.itinerary.version }, data.itinerary.version)
+  }
+
+  const handleRemoveActivity = async (day: number, activityIndex: number) => {
+    setIsEditing(true)
+    try {
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/itinerary/${itinerary.id}/edit/`, {
+        method: 'PUT',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+          edit_type: 'remove_activity',
+          day,
+          activity_index: activityIndex,
+          known_version: itineraryVersion.current
+        })
+      })
+
+      // 409: someone else edited it first, so what we show is out of date
+      if (response.status === 409) {
+        await reloadItinerary()
+        alert('This itinerary was changed elsewhere; here is the latest version.')
+        return
+      }
+      if (!response.ok) {
+        throw new Error('Failed to edit itinerary')
+      }
+
+      const data = await response.json()
+      if (data.patch) {
+        // A patch only applies to the version it was computed from
+        if (data.base_version === itineraryVersion.current) {
+          showItinerary({ ...applyPatch(itinerary, data.patch), version: data.version }, data.version)
+        } else {
+          await reloadItinerary()
+        }
+      } else {
+        showItinerary({ ...data.generated_data, id: data.itinerary.id, version: data.itinerary.version }, data.itinerary.version)
+      }
+    } catch (error) {
+      console.error('Error editing itinerary:', error)
+      alert('Failed to update itinerary. Please try again.')
+    } finally {
+      setIsEditing(false)
+    }
+  }
 
   const handleStartChat = async () => {
     setIsStartingChat(true)
@@ -170,6 +236,16 @@ export default function ItineraryResults({ itinerary, onStartChat, onBackToWizar
                               <span className="text-sm text-gray-500">
                                 {formatTime(activity.time)}
                               </span>
+                              {itinerary.id && (
+                                <button
+                                  onClick={() => handleRemoveActivity(day.day, activityIndex)}
+                                  disabled={isEditing}
+                                  className="text-gray-400 hover:text-red-600 disabled:opacity-50 disabled:cursor-not-allowed"
+                                  aria-label="Remove activity"
+                                >
+                                  <Trash2 className="h-4 w-4" />
+                                </button>
+                              )}
                             </div>
                           </div>
                           <div className="mt-2 flex items-center space-x-4 text-sm text-gray-600">
@@ -1,6 +1,6 @@
 'use client'
 
-import { useState } from 'react'
+import { useRef, useState } from 'react'
 import { MapPin, Calendar, DollarSign, Heart, ArrowRight, Sparkles } from 'lucide-react'
 
 interface ItineraryWizardProps {
@@ -17,6 +17,8 @@ export default function ItineraryWizard({ onItineraryGenerated }: ItineraryWizar
     constraints: ''
   })
   const [isGenerating, setIsGenerating] = useState(false)
+  // Kept across resubmits of the same form so the backend runs the generation once
+  const idempotencyKey = useRef<string | null>(null)
 
   const interestOptions = [
     'Culture & History', 'Food & Dining', 'Nature & Outdoors', 
@@ -24,10 +26,12 @@ export default function ItineraryWizard({ onItineraryGenerated }: ItineraryWizar
   ]
 
   const handleInputChange = (field: string, value: any) => {
+    idempotencyKey.current = null
     setFormData(prev => ({ ...prev, [field]: value }))
   }
 
   const handleInterestToggle = (interest: string) => {
+    idempotencyKey.current = null
     setFormData(prev => ({
       ...prev,
       interests: prev.interests.includes(interest)
@@ -39,12 +43,15 @@ export default function ItineraryWizard({ onItineraryGenerated }: ItineraryWizar
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault()
     setIsGenerating(true)
+    const key = idempotencyKey.current ?? crypto.randomUUID()
+    idempotencyKey.current = key
 
     try {
       const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/itinerary/generate/`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Idempotency-Key': key,
         },
         body: JSON.stringify({
           destination: formData.destination,
@@ -61,7 +68,9 @@ export default function ItineraryWizard({ onItineraryGenerated }: ItineraryWizar
       }
 
       const data = await response.json()
-      onItineraryGenerated(data.generated_data)
+      idempotencyKey.current = null
+      // Keep the id and version with the data so later edits can come back as patches
+      onItineraryGenerated({ ...data.generated_data, id: data.itinerary.id, version: data.itinerary.version })
     } catch (error) {
       console.error('Error generating itinerary:', error)
       alert('Failed to generate itinerary. Please try again.')
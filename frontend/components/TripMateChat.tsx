@@ -2,6 +2,7 @@
 
 import { useState, useEffect, useRef } from 'react'
 import { MessageCircle, Send, ArrowLeft, Bot, User, Sparkles } from 'lucide-react'
+import { applyPatch } from '@/lib/jsonPatch'
 
 interface TripMateChatProps {
   session: any
@@ -22,6 +23,8 @@ export default function TripMateChat({ session, itinerary, onBackToResults }: Tr
   const [inputMessage, setInputMessage] = useState('')
   const [isLoading, setIsLoading] = useState(false)
   const [updatedItinerary, setUpdatedItinerary] = useState(itinerary)
+  // Version of updatedItinerary on the server, when it came with one
+  const itineraryVersion = useRef<number | undefined>(itinerary.version)
   const messagesEndRef = useRef<HTMLDivElement>(null)
 
   useEffect(() => {
@@ -42,6 +45,36 @@ export default function TripMateChat({ session, itinerary, onBackToResults }: Tr
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
   }
 
+  // One Idempotency-Key per message, reused by its retries, so a resend
+  // after a dropped connection is answered once rather than applied twice
+  const sendWithRetries = async (body: string, attempts = 3) => {
+    const key = crypto.randomUUID()
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/chat/send/`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': key,
+          },
+          body
+        })
+        // Server errors, rate limits and "still in progress" (409 with
+        // Retry-After) are not stored against the key, so they are worth retrying
+        const retryable = response.status >= 500 || response.status === 429 ||
+          (response.status === 409 && response.headers.has('Retry-After'))
+        if (!retryable || attempt >= attempts) {
+          return response
+        }
+      } catch (error) {
+        if (attempt >= attempts) {
+          throw error
+        }
+      }
+      await new Promise(resolve => setTimeout(resolve, 500 * 2 ** (attempt - 1)))
+    }
+  }
+
   const handleSendMessage = async (e: React.FormEvent) => {
     e.preventDefault()
     if (!inputMessage.trim() || isLoading) return
@@ -60,18 +93,14 @@ export default function TripMateChat({ session, itinerary, onBackToResults }: Tr
     setMessages(prev => [...prev, newUserMessage])
 
     try {
-      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/chat/send/`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          session_id: session.session_id,
-          message: userMessage
-        })
-      })
+      const response = await sendWithRetries(JSON.stringify({
+        session_id: session.session_id,
+        message: userMessage,
+        itinerary_version: itineraryVersion.current
+      }))
 
-      if (!response.ok) {
+      // A 409 means the itinerary changed during the turn; it carries the current one
+      if (!response.ok && response.status !== 409) {
         throw new Error('Failed to send message')
       }
 
@@ -87,9 +116,13 @@ export default function TripMateChat({ session, itinerary, onBackToResults }: Tr
       }
       setMessages(prev => [...prev, assistantMessage])
 
-      // Update itinerary if changes were made
-      if (data.edit_applied && data.updated_itinerary) {
+      // Update itinerary if changes were made; a patch applies to the version we sent
+      if (data.edit_applied && data.itinerary_patch) {
+        setUpdatedItinerary((current: any) => applyPatch(current, data.itinerary_patch))
+        itineraryVersion.current = data.itinerary_version
+      } else if (data.updated_itinerary) {
         setUpdatedItinerary(data.updated_itinerary)
+        itineraryVersion.current = data.itinerary_version
       }
 
     } catch (error) {
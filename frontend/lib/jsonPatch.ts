@@ -0,0 +1,39 @@
+// Applies the RFC 6902 patches the backend sends for itinerary edits
+// (add, remove and replace only). The input document is left untouched.
+
+import type { JsonPatchOperation } from '../../shared/types'
+
+export type { JsonPatchOperation }
+
+const parsePointer = (pointer: string): string[] => {
+  if (pointer === '') return []
+  return pointer.slice(1).split('/').map(token => token.replace(/~1/g, '/').replace(/~0/g, '~'))
+}
+
+export function applyPatch<T>(document: T, patch: JsonPatchOperation[]): T {
+  let result: any = JSON.parse(JSON.stringify(document))
+  for (const operation of patch) {
+    const tokens = parsePointer(operation.path)
+    if (tokens.length === 0) {
+      if (operation.op === 'remove') throw new Error('Cannot remove the document root')
+      result = operation.value
+      continue
+    }
+    let parent = result
+    for (const token of tokens.slice(0, -1)) {
+      parent = parent[Array.isArray(parent) ? Number(token) : token]
+    }
+    const last = tokens[tokens.length - 1]
+    if (Array.isArray(parent)) {
+      const index = last === '-' ? parent.length : Number(last)
+      if (operation.op === 'add') parent.splice(index, 0, operation.value)
+      else if (operation.op === 'remove') parent.splice(index, 1)
+      else parent[index] = operation.value
+    } else if (operation.op === 'remove') {
+      delete parent[last]
+    } else {
+      parent[last] = operation.value
+    }
+  }
+  return result
+}
@@ -13,6 +13,8 @@ export interface Itinerary {
   created_at?: string
   updated_at?: string
   is_active?: boolean
+  // Bumped on every change to itinerary_data
+  version?: number
 }
 
 export interface ItineraryData {
@@ -71,10 +73,84 @@ export interface ItineraryEditRequest {
   activity_index?: number
   new_activity?: Activity
   edit_reason?: string
+  // Version the client holds; the response is then an ItineraryPatchResponse
+  known_version?: number
+}
+
+// RFC 6902 operations; the backend only produces add, remove and replace
+export type JsonPatchOperation =
+  | { op: 'add'; path: string; value: any }
+  | { op: 'remove'; path: string }
+  | { op: 'replace'; path: string; value: any }
+
+// Edit response for a client that sent its known_version, when the patch
+// is smaller than the itinerary; otherwise the full itinerary is returned
+export interface ItineraryPatchResponse {
+  itinerary_id: number
+  base_version: number
+  version: number
+  patch: JsonPatchOperation[]
+}
+
+export interface TripMateRequest {
+  session_id: string
+  message: string
+  // Version of the itinerary the client holds, from an earlier response
+  itinerary_version?: number
 }
 
 export interface TripMateResponse {
   response: string
   edit_applied: boolean
+  // Present when the session has an itinerary
+  itinerary_version?: number
+  // Exactly one of these accompanies an applied edit: the patch when the
+  // request's itinerary_version was the version before the edit
   updated_itinerary?: ItineraryData
+  itinerary_patch?: JsonPatchOperation[]
+  // Set on a 409: the itinerary changed during the turn, so the edit was
+  // not applied and updated_itinerary holds the current version
+  error?: string
+}
+
+// WebSocket chat (/ws/chat/{session_id}/)
+export type ChatSocketClientEvent =
+  | { type: 'message'; content: string }
+  | { type: 'ping' }
+  | { type: 'pong' }
+
+export type ChatSocketServerEvent =
+  | { type: 'ready'; session_id: string; itinerary_id: number | null; itinerary_version: number | null }
+  | { type: 'token'; text: string }
+  | { type: 'itinerary_updated'; version: number; itinerary: ItineraryData }
+  // Changes from base_version, the version this socket last received
+  | { type: 'itinerary_patch'; base_version: number; version: number; patch: JsonPatchOperation[] }
+  | { type: 'message_complete'; message_id: string; response: string; edit_applied: boolean }
+  // reason and retry_after (seconds) are set when admission control turned the message away
+  | { type: 'error'; error: string; reason?: string; retry_after?: number }
+  | { type: 'ping' }
+  | { type: 'pong' }
+
+// GET /api/itinerary/map/?bbox=west,south,east,north&zoom=z
+// Map points of all active itineraries in the viewport: cells holding
+// several points come back as clusters, lone points as themselves
+export interface MapCluster {
+  lat: number
+  lng: number
+  count: number
+  cell: string  // "zoom/x/y"; zoom in to split it
+}
+
+export interface MapLocation {
+  itinerary_id: number
+  name: string
+  day: number | null
+  lat: number
+  lng: number
+}
+
+export interface MapViewportResponse {
+  zoom: number  // Zoom the clusters were taken from (capped at 16)
+  clusters: MapCluster[]
+  points: MapLocation[]
 }